@@ -1,40 +1,31 @@
-import pygame
 import sys
-import random
+import time
+import argparse
 import math
+import bisect
+import cProfile
+import os
+import json
+import queue
+import threading
+import asyncio
+import struct
 from datetime import datetime, timedelta
-
-pygame.init()
-
-# === НАСТРОЙКИ ===
-WIDTH, HEIGHT = 1920, 1080
-FPS = 30
-MAX_CARS_IN_CITY = 1400
-MAX_SPEED_KMH = 80
-MAX_SPEED = 1.8
-
-# Характеристики водителей
-YOUNG_DRIVER_AGE = 25
-OLD_DRIVER_AGE = 60
-INATTENTIVE_DRIVER_PERCENT = 60
-VERY_ATTENTIVE_DRIVER_PERCENT = 20
-BAD_TIRES_PERCENT = 7
-BAD_BRAKES_PERCENT = 3
-
-# Интенсивность движения
-TRAFFIC_INTENSITY = {
-    0: 0.003, 1: 0.002, 2: 0.001, 3: 0.001, 4: 0.001, 5: 0.002,
-    6: 0.005, 7: 0.015, 8: 0.03, 9: 0.02, 10: 0.015, 11: 0.015,
-    12: 0.015, 13: 0.015, 14: 0.015, 15: 0.015, 16: 0.02, 17: 0.025,
-    18: 0.03, 19: 0.02, 20: 0.01, 21: 0.005, 22: 0.003, 23: 0.002
-}
-
-ACCIDENT_DURATION = 1 * FPS
-
-# === Инициализация экрана ===
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Реалистичный трафик: Городской симулятор с авариями")
-clock = pygame.time.Clock()
+from collections import OrderedDict
+
+# Ядро: машины, светофоры, движки, снимки, запись, статистика. Имена - явным
+# списком, чтобы граница окна и ядра была видна в одном месте
+from traffic import (
+    FPS, WIDTH, HEIGHT, TICK_RATE, TIME_SPEED, CAR_SIZE, ROAD_WIDTH, STOP_LINE_DISTANCE, LEFT, RIGHT,
+    MOODS, SEVERITIES, ACCIDENT_DURATION, MAX_CARS_IN_CITY, VISIBLE_MARGIN, STEP_PHASES, SNAPSHOT_FILE,
+    ACCIDENT_EVENT, IN_ACCIDENT_FLAG,
+    Simulation, NumpySimulation, ShardedSimulation, Intersection, Accident,
+    TrajectoryRecorder, Recording, StatsAggregator,
+    np, lazy_import, gc_paused, load_city, car_sprite_keys, common_state, gather_car_columns, event_car_id,
+    save_snapshot, load_snapshot, run_headless, run_monte_carlo, ticks_per_day,
+)
+
+pygame = lazy_import("pygame")  # Только для окна и повтора: без них pygame не загружается
 
 # === Цвета ===
 BACKGROUND = (25, 30, 35)
@@ -51,642 +42,67 @@ INFO_BG = (40, 45, 50)
 BUTTON_COLOR = (70, 130, 180)
 BUTTON_HOVER = (100, 160, 210)
 
-# === Параметры дорог ===
-ROAD_WIDTH = 60
-LANE_WIDTH = ROAD_WIDTH // 4
-CAR_SIZE = 16
-LIGHT_OFFSET = 35
-CYCLE_TIME = 4 * FPS
-FOLLOW_DISTANCE = CAR_SIZE * 1.5
-STOP_LINE_DISTANCE = 20
-TURN_PROBABILITY = 0.4
-
-# Глобальное время
-current_time = datetime(2024, 1, 1, 6, 0)
-TIME_SPEED = 10
-game_start_time = pygame.time.get_ticks()
-
-# === Дороги ===
-# ИСПРАВЛЕНО: Правильные координаты дорог с учетом ширины
-h_roads = [200, 500,800, 950, 1400]  # Горизонтальные дороги (y-координаты)
-v_roads = [250, 750,1050, 1650]       # Вертикальные дороги (x-координаты)
-
-# ИСПРАВЛЕНО: Правильные смещения для полос
-# Горизонтальные дороги: полосы 0-1 (верхние) - движение слева направо
-H_LANE_OFFSETS = [15, 5, -5, -15]
-
-# Вертикальные дороги: полосы 0-1 (левые) - движение сверху вниз
-V_LANE_OFFSETS = [-15, -5, 5, 15]
-
-# === Авария ===
-class Accident:
-    def __init__(self, x, y, car1, car2, reason):
-        self.x = x
-        self.y = y
-        self.car1 = car1
-        self.car2 = car2
-        self.reason = reason
-        self.timer = ACCIDENT_DURATION
-        self.severity = random.choice(["легкая", "средняя", "тяжелая"])
-
-    def update(self):
-        self.timer -= 1
-        return self.timer > 0
-
-    def draw(self, surface):
-        radius = 25 - (self.timer / ACCIDENT_DURATION * 15)
-        if radius > 5:
-            pygame.draw.circle(surface, ACCIDENT_COLOR, (int(self.x), int(self.y)), int(radius))
-            pygame.draw.circle(surface, RED, (int(self.x), int(self.y)), int(radius - 3))
-
-# === Перекрёсток ===
-class Intersection:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.timer = random.randint(0, CYCLE_TIME)
-        self.horizontal_green = random.choice([True, False])
-        self.rect = pygame.Rect(x - ROAD_WIDTH//2, y - ROAD_WIDTH//2, ROAD_WIDTH, ROAD_WIDTH)
-        
-        # ИСПРАВЛЕНО: Правильные стоп-линии
-        self.stop_lines = {
-            'right': x - ROAD_WIDTH//2 - STOP_LINE_DISTANCE,
-            'left': x + ROAD_WIDTH//2 + STOP_LINE_DISTANCE,
-            'down': y - ROAD_WIDTH//2 - STOP_LINE_DISTANCE,
-            'up': y + ROAD_WIDTH//2 + STOP_LINE_DISTANCE
-        }
-
-    def update(self):
-        self.timer += 1
-        if self.timer >= CYCLE_TIME:
-            self.timer = 0
-            self.horizontal_green = not self.horizontal_green
-
-    def is_green_for(self, direction):
-        if direction in ('left', 'right'):
-            return self.horizontal_green
-        else:  # up, down
-            return not self.horizontal_green
-
-    def toggle_lights(self):
-        self.horizontal_green = not self.horizontal_green
-        self.timer = 0
-
-    def draw(self, surface):
-        left_right_color = GREEN if self.horizontal_green else RED
-        up_down_color = GREEN if not self.horizontal_green else RED
-
-        light_size = 4
-
-        # Светофоры для горизонтального движения
-        pygame.draw.circle(surface, left_right_color, (self.x - ROAD_WIDTH//2 - 20, self.y - 25), light_size)
-        pygame.draw.circle(surface, left_right_color, (self.x - ROAD_WIDTH//2 - 20, self.y + 25), light_size)
-        pygame.draw.circle(surface, left_right_color, (self.x + ROAD_WIDTH//2 + 20, self.y - 25), light_size)
-        pygame.draw.circle(surface, left_right_color, (self.x + ROAD_WIDTH//2 + 20, self.y + 25), light_size)
-
-        # Светофоры для вертикального движения
-        pygame.draw.circle(surface, up_down_color, (self.x - 25, self.y - ROAD_WIDTH//2 - 20), light_size)
-        pygame.draw.circle(surface, up_down_color, (self.x + 25, self.y - ROAD_WIDTH//2 - 20), light_size)
-        pygame.draw.circle(surface, up_down_color, (self.x - 25, self.y + ROAD_WIDTH//2 + 20), light_size)
-        pygame.draw.circle(surface, up_down_color, (self.x + 25, self.y + ROAD_WIDTH//2 + 20), light_size)
-
-        # Стоп-линии
-        pygame.draw.line(surface, WHITE, (self.x - ROAD_WIDTH//2, self.y - STOP_LINE_DISTANCE),
-                         (self.x + ROAD_WIDTH//2, self.y - STOP_LINE_DISTANCE), 2)
-        pygame.draw.line(surface, WHITE, (self.x - ROAD_WIDTH//2, self.y + STOP_LINE_DISTANCE),
-                         (self.x + ROAD_WIDTH//2, self.y + STOP_LINE_DISTANCE), 2)
-        pygame.draw.line(surface, WHITE, (self.x - STOP_LINE_DISTANCE, self.y - ROAD_WIDTH//2),
-                         (self.x - STOP_LINE_DISTANCE, self.y + ROAD_WIDTH//2), 2)
-        pygame.draw.line(surface, WHITE, (self.x + STOP_LINE_DISTANCE, self.y - ROAD_WIDTH//2),
-                         (self.x + STOP_LINE_DISTANCE, self.y + ROAD_WIDTH//2), 2)
-
-# === Машина ===
-class Car:
-    def __init__(self, x, y, direction, lane, base_road):
-        self.x = x
-        self.y = y
-        self.direction = direction
-        self.lane = lane
-        self.base_road = base_road
-        self.speed = 0.0
-
-        # Характеристики водителя
-        self.driver_age = random.randint(18, 75)
-        self.driver_experience = max(1, self.driver_age - 18)
-        self.driver_mood = random.choice(["спокойный", "нервный", "расслабленный", "злой", "уставший"])
-        self.driver_attention = self.calculate_attention()
-        self.driver_aggression = random.uniform(0.1, 1.0)
-
-        # Характеристики машины
-        self.car_age = random.randint(0, 20)
-        self.bad_tires = random.random() < BAD_TIRES_PERCENT / 100
-        self.bad_brakes = random.random() < BAD_BRAKES_PERCENT / 100
-        self.engine_power = random.uniform(0.8, 1.2)
-
-        # Манера езды
-        self.max_speed_multiplier = self.calculate_max_speed()
-        self.max_speed = MAX_SPEED * self.max_speed_multiplier
-        self.accel = 0.07 * self.engine_power
-        self.decel = 0.15 * (0.7 if self.bad_brakes else 1.0)
-        self.reaction_time = self.calculate_reaction_time()
-
-        self.color = (
-            random.randint(180, 255),
-            random.randint(100, 220),
-            random.randint(100, 220)
-        )
-
-        # Система поворотов
-        self.turn_decision = None
-        self.turning = False
-        self.passed_stop_line = False
-
-        # Для смены полосы
-        self.changing_lane = False
-        self.lane_change_progress = 0
-        self.target_lane_temp = lane
-        self.lane_change_cooldown = 0
-
-        # Для аварий
-        self.accident_timer = 0
-        self.in_accident = False
-
-        # Для выделения
-        self.selected = False
-
-    def calculate_attention(self):
-        base_attention = 1.0
-
-        if self.driver_age < YOUNG_DRIVER_AGE:
-            base_attention *= 0.8
-        elif self.driver_age > OLD_DRIVER_AGE:
-            base_attention *= 0.9
-
-        mood_effects = {
-            "нервный": 0.8,
-            "злой": 0.7,
-            "уставший": 0.6,
-            "расслабленный": 1.0,
-            "спокойный": 1.1
-        }
-        base_attention *= mood_effects.get(self.driver_mood, 1.0)
-
-        base_attention *= min(1.2, 1.0 + self.driver_experience * 0.01)
-
-        rand_val = random.random() * 100
-        if rand_val < INATTENTIVE_DRIVER_PERCENT:
-            base_attention *= 0.7
-        elif rand_val < INATTENTIVE_DRIVER_PERCENT + VERY_ATTENTIVE_DRIVER_PERCENT:
-            base_attention *= 1.2
-
-        return base_attention
-
-    def calculate_max_speed(self):
-        multiplier = 1.0
-        if self.driver_age < YOUNG_DRIVER_AGE:
-            multiplier *= 1.1
-        if self.driver_mood == "злой":
-            multiplier *= 1.2
-        multiplier *= (0.9 + self.driver_aggression * 0.2)
-        return multiplier
-
-    def calculate_reaction_time(self):
-        reaction = 1.0
-        if self.driver_age > OLD_DRIVER_AGE:
-            reaction *= 1.2
-        if self.driver_experience < 5:
-            reaction *= 1.1
-
-        if self.driver_mood in ["уставший", "нервный"]:
-            reaction *= 1.2
-
-        reaction /= self.driver_attention
-
-        return max(0.7, min(1.5, reaction))
-
-    def get_position(self):
-        # ИСПРАВЛЕНО: Правильное позиционирование на дороге
-        if self.direction == 'right':
-            offset = H_LANE_OFFSETS[self.lane]
-            return self.x, self.base_road + offset
-        elif self.direction == 'left':
-            offset = H_LANE_OFFSETS[self.lane]
-            return self.x, self.base_road + offset
-        elif self.direction == 'down':
-            offset = V_LANE_OFFSETS[self.lane]
-            return self.base_road + offset, self.y
-        elif self.direction == 'up':
-            offset = V_LANE_OFFSETS[self.lane]
-            return self.base_road + offset, self.y
-
-    def check_accident(self, other_car, distance):
-        if self.in_accident or other_car.in_accident:
-            return False
-
-        accident_prob = 0.0
-
-        if distance < FOLLOW_DISTANCE * 0.3:
-            accident_prob = 0.01
-
-        risk_multiplier = 1.0
-
-        risk_multiplier *= (1.5 - min(self.driver_attention, other_car.driver_attention))
-
-        if self.bad_brakes or other_car.bad_brakes:
-            risk_multiplier *= 1.2
-        if self.bad_tires or other_car.bad_tires:
-            risk_multiplier *= 1.1
-
-        risk_multiplier *= (0.5 + (self.speed + other_car.speed) / (MAX_SPEED * 2))
-
-        if self.driver_experience < 3 or other_car.driver_experience < 3:
-            risk_multiplier *= 1.05
-
-        if "злой" in [self.driver_mood, other_car.driver_mood]:
-            risk_multiplier *= 1.1
-
-        final_probability = accident_prob * risk_multiplier * 0.02
-
-        return random.random() < final_probability
-
-    def update(self, intersections, all_cars, accidents):
-        if self.in_accident:
-            self.accident_timer -= 1
-            if self.accident_timer <= 0:
-                self.in_accident = False
-                self.speed = self.max_speed * 0.5
-            return True
-
-        if self.turning:
-            return self.update_turn()
-
-        if self.changing_lane:
-            self.lane_change_progress += 0.1
-            if self.lane_change_progress >= 1:
-                self.lane = self.target_lane_temp
-                self.changing_lane = False
-                self.lane_change_progress = 0
-                self.lane_change_cooldown = 30
-            else:
-                # Плавное изменение позиции при смене полосы
-                if self.direction in ['left', 'right']:
-                    start_offset = H_LANE_OFFSETS[self.lane]
-                    end_offset = H_LANE_OFFSETS[self.target_lane_temp]
-                    current_offset = start_offset + (end_offset - start_offset) * self.lane_change_progress
-                    self.y = self.base_road + current_offset
-                else:
-                    start_offset = V_LANE_OFFSETS[self.lane]
-                    end_offset = V_LANE_OFFSETS[self.target_lane_temp]
-                    current_offset = start_offset + (end_offset - start_offset) * self.lane_change_progress
-                    self.x = self.base_road + current_offset
-        else:
-            self.x, self.y = self.get_position()
-
-        if self.lane_change_cooldown > 0:
-            self.lane_change_cooldown -= 1
-
-        # Удаление машин за пределами экрана
-        if (self.x < -100 or self.x > WIDTH + 100 or
-            self.y < -100 or self.y > HEIGHT + 100):
-            return False
-
-        # Поиск ближайшего перекрёстка
-        next_int = None
-        dist_to_int = float('inf')
-        for inter in intersections:
-            if self.direction == 'right' and abs(inter.y - self.base_road) < 10 and inter.x > self.x:
-                d = inter.x - self.x - STOP_LINE_DISTANCE
-                if d < dist_to_int and d > 0:
-                    dist_to_int = d
-                    next_int = inter
-            elif self.direction == 'left' and abs(inter.y - self.base_road) < 10 and inter.x < self.x:
-                d = self.x - inter.x - STOP_LINE_DISTANCE
-                if d < dist_to_int and d > 0:
-                    dist_to_int = d
-                    next_int = inter
-            elif self.direction == 'down' and abs(inter.x - self.base_road) < 10 and inter.y > self.y:
-                d = inter.y - self.y - STOP_LINE_DISTANCE
-                if d < dist_to_int and d > 0:
-                    dist_to_int = d
-                    next_int = inter
-            elif self.direction == 'up' and abs(inter.x - self.base_road) < 10 and inter.y < self.y:
-                d = self.y - inter.y - STOP_LINE_DISTANCE
-                if d < dist_to_int and d > 0:
-                    dist_to_int = d
-                    next_int = inter
-
-        # Проверка проезда стоп-линии
-        if next_int and not self.passed_stop_line:
-            if self.direction == 'right' and self.x > next_int.x - STOP_LINE_DISTANCE:
-                self.passed_stop_line = True
-            elif self.direction == 'left' and self.x < next_int.x + STOP_LINE_DISTANCE:
-                self.passed_stop_line = True
-            elif self.direction == 'down' and self.y > next_int.y - STOP_LINE_DISTANCE:
-                self.passed_stop_line = True
-            elif self.direction == 'up' and self.y < next_int.y + STOP_LINE_DISTANCE:
-                self.passed_stop_line = True
-
-        # Поиск ближайшей машины впереди
-        lead_dist = float('inf')
-        lead_car = None
-        for other in all_cars:
-            if other is self or other.turning or other.in_accident:
-                continue
-            if other.direction != self.direction or other.lane != self.lane:
-                continue
-
-            if self.direction == 'right' and other.x > self.x:
-                d = other.x - self.x
-                if d < lead_dist:
-                    lead_dist = d
-                    lead_car = other
-            elif self.direction == 'left' and other.x < self.x:
-                d = self.x - other.x
-                if d < lead_dist:
-                    lead_dist = d
-                    lead_car = other
-            elif self.direction == 'down' and other.y > self.y:
-                d = other.y - self.y
-                if d < lead_dist:
-                    lead_dist = d
-                    lead_car = other
-            elif self.direction == 'up' and other.y < self.y:
-                d = self.y - other.y
-                if d < lead_dist:
-                    lead_dist = d
-                    lead_car = other
-
-        # Проверка на аварию
-        if lead_car and lead_dist < CAR_SIZE:
-            if self.check_accident(lead_car, lead_dist):
-                self.cause_accident(lead_car, "Столкновение", accidents)
-                return True
-
-        # Определение состояния светофора
-        light_ok = True
-        if next_int:
-            light_ok = next_int.is_green_for(self.direction)
-
-        # Логика движения
-        should_brake = False
-        
-        # 1. Торможение из-за машины впереди
-        safe_follow_distance = FOLLOW_DISTANCE * (1.0 + (1 - self.driver_attention) * 0.5)
-        if lead_car and lead_dist < safe_follow_distance:
-            should_brake = True
-            # Попытка смены полосы
-            if (not self.changing_lane and self.lane_change_cooldown == 0 and
-                random.random() < 0.02 * self.driver_aggression):
-                self.try_change_lane(all_cars)
-        
-        # 2. Торможение на красный свет
-        if next_int and dist_to_int < STOP_LINE_DISTANCE * 3:
-            if not light_ok and not self.passed_stop_line:
-                should_brake = True
-                if dist_to_int < 5:
-                    self.speed = 0
-        
-        # 3. Торможение из-за пробки
-        if lead_car and lead_car.speed == 0 and lead_dist < safe_follow_distance * 1.2:
-            should_brake = True
-
-        # Ускорение/торможение
-        if should_brake:
-            self.speed = max(0, self.speed - self.decel * self.reaction_time)
-        else:
-            self.speed = min(self.max_speed, self.speed + self.accel)
-
-        # Движение
-        if self.speed > 0:
-            if self.direction == 'right':
-                self.x += self.speed
-            elif self.direction == 'left':
-                self.x -= self.speed
-            elif self.direction == 'down':
-                self.y += self.speed
-            elif self.direction == 'up':
-                self.y -= self.speed
-
-        # Корректировка позиции
-        if not self.turning and not self.changing_lane:
-            self.x, self.y = self.get_position()
-
-        # Решение о повороте
-        if (next_int and dist_to_int < 40 and
-            self.speed > 0.1 and light_ok and
-            self.turn_decision is None and not self.passed_stop_line):
-            self.decide_turn()
-
-        # Начало поворота
-        if (self.turn_decision and not self.turning and
-            next_int and dist_to_int < 20 and light_ok and self.speed > 0.1):
-            self.start_turn(next_int)
-
-        return True
-
-    def try_change_lane(self, all_cars):
-        if self.changing_lane or self.lane_change_cooldown > 0:
-            return
-
-        # Определение возможных полос для смены
-        possible_lanes = []
-        if self.direction in ['right', 'left']:
-            if self.lane == 0: possible_lanes = [1]
-            elif self.lane == 1: possible_lanes = [0]
-            elif self.lane == 2: possible_lanes = [3]
-            elif self.lane == 3: possible_lanes = [2]
-        else:
-            if self.lane == 0: possible_lanes = [1]
-            elif self.lane == 1: possible_lanes = [0]
-            elif self.lane == 2: possible_lanes = [3]
-            elif self.lane == 3: possible_lanes = [2]
-
-        if not possible_lanes:
-            return
-
-        # Проверка доступности полосы
-        for new_lane in possible_lanes:
-            lane_clear = True
-            for other in all_cars:
-                if other is self or other.in_accident or other.turning:
-                    continue
-                if other.direction != self.direction:
-                    continue
-                if other.lane != new_lane:
-                    continue
-
-                # Проверка дистанции
-                if self.direction in ['left', 'right']:
-                    if abs(other.x - self.x) < FOLLOW_DISTANCE * 2:
-                        lane_clear = False
-                        break
-                else:
-                    if abs(other.y - self.y) < FOLLOW_DISTANCE * 2:
-                        lane_clear = False
-                        break
-
-            if lane_clear:
-                self.target_lane_temp = new_lane
-                self.changing_lane = True
-                self.lane_change_progress = 0
-                break
-
-    def cause_accident(self, other_car, reason, accidents):
-        self.in_accident = True
-        other_car.in_accident = True
-        self.accident_timer = ACCIDENT_DURATION
-        other_car.accident_timer = ACCIDENT_DURATION
-        self.speed = 0
-        other_car.speed = 0
-
-        accident_x = (self.x + other_car.x) / 2
-        accident_y = (self.y + other_car.y) / 2
-        accidents.append(Accident(accident_x, accident_y, self, other_car, reason))
-
-    def decide_turn(self):
-        options = ['straight']
-
-        # Логика доступных поворотов
-        if self.direction == 'right':
-            if self.lane == 0:  # Левая полоса
-                options = ['straight', 'left', 'uturn']
-            elif self.lane == 1:  # Правая полоса
-                options = ['straight', 'right']
-
-        elif self.direction == 'left':
-            if self.lane == 3:  # Правая полоса
-                options = ['straight', 'left', 'uturn']
-            elif self.lane == 2:  # Левая полоса
-                options = ['straight', 'right']
-
-        elif self.direction == 'down':
-            if self.lane == 0:  # Левая полоса
-                options = ['straight', 'left', 'uturn']
-            elif self.lane == 1:  # Правая полоса
-                options = ['straight', 'right']
-
-        elif self.direction == 'up':
-            if self.lane == 3:  # Правая полоса
-                options = ['straight', 'left', 'uturn']
-            elif self.lane == 2:  # Левая полоса
-                options = ['straight', 'right']
-
-        if random.random() < TURN_PROBABILITY:
-            self.turn_decision = random.choice(options)
-        else:
-            self.turn_decision = 'straight'
-
-    def start_turn(self, intersection):
-        if self.turn_decision == 'straight':
-            self.turn_decision = None
-            return
-
-        self.turning = True
-        self.passed_stop_line = False
-
-        # ИСПРАВЛЕНО: Упрощенный поворот - резкая смена направления
-        if self.turn_decision == 'left':
-            if self.direction == 'right':
-                self.direction = 'up'
-                self.lane = 2  # Крайняя левая полоса
-            elif self.direction == 'left':
-                self.direction = 'down'
-                self.lane = 0  # Крайняя левая полоса
-            elif self.direction == 'down':
-                self.direction = 'right'
-                self.lane = 0  # Крайняя левая полоса
-            elif self.direction == 'up':
-                self.direction = 'left'
-                self.lane = 2  # Крайняя левая полоса
-
-        elif self.turn_decision == 'right':
-            if self.direction == 'right':
-                self.direction = 'down'
-                self.lane = 1  # Крайняя правая полоса
-            elif self.direction == 'left':
-                self.direction = 'up'
-                self.lane = 3  # Крайняя правая полоса
-            elif self.direction == 'down':
-                self.direction = 'left'
-                self.lane = 3  # Крайняя правая полоса
-            elif self.direction == 'up':
-                self.direction = 'right'
-                self.lane = 1  # Крайняя правая полоса
-
-        elif self.turn_decision == 'uturn':
-            # ИСПРАВЛЕНО: При развороте машина перестраивается на соседнюю полосу встречного направления
-            if self.direction == 'right':
-                self.direction = 'left'
-                # Была полоса 0 или 1 (движение направо), после разворота - полоса 2 или 3 (движение налево)
-                self.lane = 2 if self.lane == 0 else 3
-            elif self.direction == 'left':
-                self.direction = 'right'
-                # Была полоса 2 или 3 (движение налево), после разворота - полоса 0 или 1 (движение направо)
-                self.lane = 0 if self.lane == 2 else 1
-            elif self.direction == 'down':
-                self.direction = 'up'
-                # Была полоса 0 или 1 (движение вниз), после разворота - полоса 2 или 3 (движение вверх)
-                self.lane = 2 if self.lane == 0 else 3
-            elif self.direction == 'up':
-                self.direction = 'down'
-                # Была полоса 2 или 3 (движение вверх), после разворота - полоса 0 или 1 (движение вниз)
-                self.lane = 0 if self.lane == 2 else 1
-
-        # Обновление базовой дороги
-        if self.direction in ['left', 'right']:
-            self.base_road = intersection.y
-        else:
-            self.base_road = intersection.x
-
-        self.turn_decision = None
-        self.turning = False
-
-    def update_turn(self):
-        # ИСПРАВЛЕНО: Упрощенная логика поворота
-        return True
-
-    def draw(self, surface):
-        if self.in_accident:
-            if pygame.time.get_ticks() % 500 < 250:
-                color = RED
-            else:
-                color = self.color
-        else:
-            color = self.color
-
-        if self.direction in ('left', 'right'):
-            pygame.draw.rect(surface, color,
-                             (self.x - CAR_SIZE//2, self.y - CAR_SIZE//4, CAR_SIZE, CAR_SIZE//2))
-        else:
-            pygame.draw.rect(surface, color,
-                             (self.x - CAR_SIZE//4, self.y - CAR_SIZE//2, CAR_SIZE//2, CAR_SIZE))
-
-        if self.selected:
-            if self.direction in ('left', 'right'):
-                pygame.draw.rect(surface, YELLOW,
-                                (self.x - CAR_SIZE//2 - 3, self.y - CAR_SIZE//4 - 3,
-                                 CAR_SIZE + 6, CAR_SIZE//2 + 6), 2)
-            else:
-                pygame.draw.rect(surface, YELLOW,
-                                (self.x - CAR_SIZE//4 - 3, self.y - CAR_SIZE//2 - 3,
-                                 CAR_SIZE//2 + 6, CAR_SIZE + 6), 2)
+# === Перекрёстки и аварии ===
+def intersection_rect(inter):
+    return pygame.Rect(inter.x - ROAD_WIDTH//2, inter.y - ROAD_WIDTH//2, ROAD_WIDTH, ROAD_WIDTH)
+
+def draw_stop_lines(surface, inter, offset=(0, 0)):
+    # Стоп-линии не меняются и рисуются один раз в фоновый слой
+    x, y = inter.x - offset[0], inter.y - offset[1]
+    pygame.draw.line(surface, WHITE, (x - ROAD_WIDTH//2, y - STOP_LINE_DISTANCE),
+                     (x + ROAD_WIDTH//2, y - STOP_LINE_DISTANCE), 2)
+    pygame.draw.line(surface, WHITE, (x - ROAD_WIDTH//2, y + STOP_LINE_DISTANCE),
+                     (x + ROAD_WIDTH//2, y + STOP_LINE_DISTANCE), 2)
+    pygame.draw.line(surface, WHITE, (x - STOP_LINE_DISTANCE, y - ROAD_WIDTH//2),
+                     (x - STOP_LINE_DISTANCE, y + ROAD_WIDTH//2), 2)
+    pygame.draw.line(surface, WHITE, (x + STOP_LINE_DISTANCE, y - ROAD_WIDTH//2),
+                     (x + STOP_LINE_DISTANCE, y + ROAD_WIDTH//2), 2)
+
+def draw_lights(surface, inter, offset=(0, 0)):
+    left_right_color = GREEN if inter.horizontal_green else RED
+    up_down_color = GREEN if not inter.horizontal_green else RED
+
+    light_size = 4
+    x, y = inter.x - offset[0], inter.y - offset[1]
+
+    # Светофоры для горизонтального движения
+    pygame.draw.circle(surface, left_right_color, (x - ROAD_WIDTH//2 - 20, y - 25), light_size)
+    pygame.draw.circle(surface, left_right_color, (x - ROAD_WIDTH//2 - 20, y + 25), light_size)
+    pygame.draw.circle(surface, left_right_color, (x + ROAD_WIDTH//2 + 20, y - 25), light_size)
+    pygame.draw.circle(surface, left_right_color, (x + ROAD_WIDTH//2 + 20, y + 25), light_size)
+
+    # Светофоры для вертикального движения
+    pygame.draw.circle(surface, up_down_color, (x - 25, y - ROAD_WIDTH//2 - 20), light_size)
+    pygame.draw.circle(surface, up_down_color, (x + 25, y - ROAD_WIDTH//2 - 20), light_size)
+    pygame.draw.circle(surface, up_down_color, (x - 25, y + ROAD_WIDTH//2 + 20), light_size)
+    pygame.draw.circle(surface, up_down_color, (x + 25, y + ROAD_WIDTH//2 + 20), light_size)
+
+def draw_accident(surface, accident, offset=(0, 0)):
+    # offset - мировые координаты левого верхнего угла поверхности
+    radius = 25 - (accident.timer / ACCIDENT_DURATION * 15)
+    if radius > 5:
+        center = (int(accident.x - offset[0]), int(accident.y - offset[1]))
+        rect = pygame.draw.circle(surface, ACCIDENT_COLOR, center, int(radius))
+        pygame.draw.circle(surface, RED, center, int(radius - 3))
+        return rect
+    return None
 
 # === Кнопка паузы ===
 class Button:
-    def __init__(self, x, y, width, height, text):
+    def __init__(self, x, y, width, height, text, font):
         self.rect = pygame.Rect(x, y, width, height)
         self.text = text
         self.hovered = False
+        self.text_surface = font.render(text, True, WHITE)
 
     def draw(self, surface):
         color = BUTTON_HOVER if self.hovered else BUTTON_COLOR
         pygame.draw.rect(surface, color, self.rect)
         pygame.draw.rect(surface, WHITE, self.rect, 2)
 
-        font = pygame.font.SysFont(None, 28)
-        text_surface = font.render(self.text, True, WHITE)
-        text_rect = text_surface.get_rect(center=self.rect.center)
-        surface.blit(text_surface, text_rect)
+        text_rect = self.text_surface.get_rect(center=self.rect.center)
+        surface.blit(self.text_surface, text_rect)
+        return self.rect
 
     def check_hover(self, pos):
         self.hovered = self.rect.collidepoint(pos)
@@ -696,180 +112,1082 @@ class Button:
             return self.rect.collidepoint(pos)
         return False
 
-# === Спавн машин ===
-def spawn_cars(cars):
-    global current_time
-
-    hour = current_time.hour
-    spawn_probability = TRAFFIC_INTENSITY.get(hour, 0.01)
-
-    if len(cars) >= MAX_CARS_IN_CITY * 0.8:
-        spawn_probability *= 0.5
-
-    # ИСПРАВЛЕНО: Правильный спавн машин только на правых полосах
-    for y in h_roads:
-        if random.random() < spawn_probability:
-            lane = random.choice([0, 1])  # Только правые полосы для движения направо
-            cars.append(Car(-50, y, 'right', lane, y))
-        if random.random() < spawn_probability:
-            lane = random.choice([2, 3])  # Только левые полосы для движения налево
-            cars.append(Car(WIDTH + 50, y, 'left', lane, y))
-
-    for x in v_roads:
-        if random.random() < spawn_probability:
-            lane = random.choice([0, 1])  # Только левые полосы для движения вниз
-            cars.append(Car(x, -50, 'down', lane, x))
-        if random.random() < spawn_probability:
-            lane = random.choice([2, 3])  # Только правые полосы для движения вверх
-            cars.append(Car(x, HEIGHT + 50, 'up', lane, x))
-
-# === Инициализация ===
-intersections = [Intersection(x, y) for x in v_roads for y in h_roads]
-cars = []
-accidents = []
-font = pygame.font.SysFont(None, 24)
-small_font = pygame.font.SysFont(None, 20)
-large_font = pygame.font.SysFont(None, 36)
-
-pause_button = Button(10, HEIGHT - 50, 100, 40, "Пауза")
-paused = False
-selected_car = None
-
-# === Главный цикл ===
-running = True
-while running:
-    dt = clock.tick(FPS)
-
-    mouse_pos = pygame.mouse.get_pos()
-    pause_button.check_hover(mouse_pos)
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            for inter in intersections:
-                if inter.rect.collidepoint(mouse_pos):
-                    inter.toggle_lights()
-
-            selected_car = None
-            car_clicked = False
-            for car in cars:
-                if car.direction in ('left', 'right'):
-                    car_rect = pygame.Rect(car.x - CAR_SIZE//2, car.y - CAR_SIZE//4, CAR_SIZE, CAR_SIZE//2)
-                else:
-                    car_rect = pygame.Rect(car.x - CAR_SIZE//4, car.y - CAR_SIZE//2, CAR_SIZE//2, CAR_SIZE)
-
-                if car_rect.collidepoint(mouse_pos):
-                    selected_car = car
-                    car.selected = True
-                    car_clicked = True
-                else:
-                    car.selected = False
-
-            if not car_clicked and not any(inter.rect.collidepoint(mouse_pos) for inter in intersections):
-                selected_car = None
-                for car in cars:
-                    car.selected = False
-
-            if pause_button.is_clicked(mouse_pos, event):
-                paused = not paused
-
-    if not paused:
-        current_time += timedelta(minutes=TIME_SPEED)
-        spawn_cars(cars)
-
-        for light in intersections:
-            light.update()
-
-        cars = [car for car in cars if car.update(intersections, cars, accidents)]
-        accidents = [accident for accident in accidents if accident.update()]
-
-    # === Отрисовка ===
-    screen.fill(BACKGROUND)
+# === Кэш текста ===
+# font.render дорогой, а текст HUD меняется редко: готовые поверхности хранятся
+# по ключу (шрифт, текст, цвет), давно не нужные вытесняются
+TEXT_CACHE_SIZE = 256
+
+class TextCache:
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+# === Телеметрия ===
+# Локальный сервер asyncio для панелей и внешних инструментов: слушает порт
+# (host:port) или сокет Unix (unix:путь) и каждый тик рассылает двоичную дельту -
+# машины, которые появились или сдвинулись, номера уехавших, переключённые
+# светофоры и новые аварии. Дельта считается в потоке симуляции массивами NumPy
+# против прошлого тика, а рассылает её отдельный поток с циклом asyncio, так что
+# сеть тик не задерживает. Отстающий клиент (буфер отправки больше
+# TELEMETRY_BUFFER_LIMIT) перестаёт получать дельты, а когда буфер опустеет,
+# получает один свежий снимок и дальше снова дельты - очередь к нему не растёт.
+#
+# Кадр: заголовок FRAME_HEADER (длина данных, тип), затем данные:
+#   HELLO - JSON: планировка, перекрёстки по порядку, причины аварий и тяжести;
+#           присылается заново, когда появляется новая причина;
+#   SNAPSHOT и DELTA - TICK_HEADER, затем массивы WIRE_CAR, номера уехавших (u4),
+#           WIRE_LIGHT и WIRE_ACCIDENT подряд. В снимке - всё состояние целиком.
+# Управление - строки JSON от клиента: {"cmd": "pause"}, {"cmd": "resume"},
+# {"cmd": "toggle_light", "intersection": 3}, {"cmd": "time_speed", "value": 20}.
+# Команды копятся в очереди и выполняются в потоке симуляции между тиками.
+FRAME_HEADER = struct.Struct('<IB')
+HELLO_FRAME, SNAPSHOT_FRAME, DELTA_FRAME = range(3)
+# Тик, игровое время (секунды от TELEMETRY_EPOCH), минут за тик, флаги, затем
+# число машин, уехавших, светофоров и аварий
+TICK_HEADER = struct.Struct('<qdHBIIII')
+PAUSED_FLAG = 1
+TELEMETRY_EPOCH = datetime(1970, 1, 1)
+WIRE_CAR = [('car_id', '<u4'), ('x', '<f4'), ('y', '<f4'), ('direction', 'i1'), ('flags', 'u1')]
+WIRE_LIGHT = [('intersection', '<u4'), ('horizontal_green', 'u1')]
+# car1, car2 - номера машин или -1, reason и severity - номера в списках из HELLO
+WIRE_ACCIDENT = [('x', '<f4'), ('y', '<f4'), ('car1', '<i4'), ('car2', '<i4'), ('reason', 'u1'), ('severity', 'u1')]
+TELEMETRY_BUFFER_LIMIT = 1 << 20  # Байт в буфере отправки клиента, больше - клиент отстал
+TELEMETRY_PENDING = 64  # Кадров, ждущих рассылки; больше - поток сети завис, все получат снимок
+TELEMETRY_CONTROLS = 256  # Команд в очереди; лишние отбрасываются
+TELEMETRY_LINE_LIMIT = 4096  # Байт в строке команды
+MAX_TIME_SPEED = 24 * 60
+
+def parse_address(address):
+    # "unix:/tmp/dtp.sock" или "host:port", хост по умолчанию - только локальный
+    if address.startswith("unix:"):
+        return None, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not port.isdigit():
+        raise ValueError("нужен адрес host:port или unix:путь")
+    return host or "127.0.0.1", int(port)
+
+def telemetry_frame(kind, data):
+    return FRAME_HEADER.pack(len(data), kind) + data
+
+def light_rows(indices, lights):
+    rows = np.empty(len(indices), dtype=WIRE_LIGHT)
+    rows['intersection'] = indices
+    rows['horizontal_green'] = lights[indices]
+    return rows
+
+def tick_frame(kind, header, arrays):
+    cars, removed, lights, accidents = arrays
+    data = TICK_HEADER.pack(*header, len(cars), len(removed), len(lights), len(accidents))
+    return telemetry_frame(kind, b"".join([data, cars.tobytes(), removed.tobytes(), lights.tobytes(), accidents.tobytes()]))
+
+class TelemetryClient(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.stale = True  # Новый клиент сначала ждёт снимок
+        self.blocked = False  # Буфер отправки выше TELEMETRY_BUFFER_LIMIT
+        self.line = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=TELEMETRY_BUFFER_LIMIT, low=0)
+        transport.write(self.server.hello)
+        self.server.want_snapshot = True
+        self.server.clients.add(self)
+
+    def connection_lost(self, exc):
+        self.server.clients.discard(self)
+
+    def data_received(self, data):
+        *lines, self.line = (self.line + data).split(b"\n")
+        if len(self.line) > TELEMETRY_LINE_LIMIT:
+            self.transport.close()
+            return
+        for line in lines:
+            try:
+                command = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(command, dict):
+                try:
+                    self.server.controls.put_nowait(command)
+                except queue.Full:
+                    pass
+
+    def pause_writing(self):
+        # Клиент отстал: дельты ему больше не шлются
+        self.stale = True
+        self.blocked = True
+
+    def resume_writing(self):
+        # Буфер опустел: следующим кадром клиент получит снимок
+        self.blocked = False
+        self.server.want_snapshot = True
+
+class TelemetryServer:
+    def __init__(self, address, sim):
+        self.address = address
+        self.clients = set()  # Меняется только в потоке asyncio
+        self.controls = queue.Queue(maxsize=TELEMETRY_CONTROLS)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.resync = False
+        self.want_snapshot = False
+        self.reasons = []
+        self.hello = self._hello(sim)
+        self.prev_cars = np.zeros(0, dtype=WIRE_CAR)
+        self.prev_lights = None
+
+        # Сокет открывается здесь, чтобы ошибка была видна сразу, а не в потоке
+        self.loop = asyncio.new_event_loop()
+        host, port = parse_address(address)
+        self.unix_path = port if host is None else None
+        if host is None:
+            create = self.loop.create_unix_server(lambda: TelemetryClient(self), port)
+        else:
+            create = self.loop.create_server(lambda: TelemetryClient(self), host, port)
+        try:
+            self.server = self.loop.run_until_complete(create)
+        except OSError:
+            self.loop.close()
+            raise
+        self.thread = threading.Thread(target=self.loop.run_forever, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def _hello(self, sim):
+        layout = dict(common_state(sim)['layout'])
+        layout['start_time'] = layout['start_time'].isoformat()
+        hello = {'layout': layout,
+                 'intersections': [(inter.x, inter.y) for inter in sim.intersections],
+                 'reasons': self.reasons, 'severities': SEVERITIES,
+                 'wire': {'car': WIRE_CAR, 'light': WIRE_LIGHT, 'accident': WIRE_ACCIDENT}}
+        return telemetry_frame(HELLO_FRAME, json.dumps(hello, ensure_ascii=False).encode("utf-8"))
+
+    def _accidents(self, accidents):
+        rows = []
+        for accident in accidents:
+            if accident.reason not in self.reasons:
+                self.reasons.append(accident.reason)
+            rows.append((accident.x, accident.y, event_car_id(accident.car1), event_car_id(accident.car2),
+                         self.reasons.index(accident.reason), SEVERITIES.index(accident.severity)))
+        return np.array(rows, dtype=WIRE_ACCIDENT)
+
+    def publish(self, sim, paused=False):
+        # Раз в тик, в конце sim.step, и после команд управления
+        if not self.clients:
+            # Слушать некому: следующий клиент всё равно начнёт со снимка
+            self.prev_lights = None
+            return
+        columns = gather_car_columns(sim)
+        cars = np.empty(len(columns['car_id']), dtype=WIRE_CAR)
+        for name, _ in WIRE_CAR:
+            cars[name] = columns[name]
+        lights = np.fromiter((inter.horizontal_green for inter in sim.intersections),
+                             dtype='u1', count=len(sim.intersections))
+        reasons = len(self.reasons)
+        new_accidents = self._accidents(sim.new_accidents)
+        frames = []
+        if len(self.reasons) != reasons:
+            # Новая причина аварии: клиенты получают обновлённый список до кадра с ней
+            self.hello = self._hello(sim)
+            frames.append((HELLO_FRAME, self.hello))
+
+        header = (sim.ticks, (sim.current_time - TELEMETRY_EPOCH).total_seconds(), sim.time_speed,
+                  PAUSED_FLAG if paused else 0)
+        if self.prev_lights is not None and len(self.prev_lights) == len(lights):
+            # Номера машин отсортированы: сдвинувшиеся и новые ищутся бинарным поиском по прошлому тику
+            prev = self.prev_cars
+            if len(prev):
+                i = np.minimum(np.searchsorted(prev['car_id'], cars['car_id']), len(prev) - 1)
+                changed = (prev['car_id'][i] != cars['car_id']) | (prev[i] != cars)
+                removed = prev['car_id'][~np.isin(prev['car_id'], cars['car_id'], assume_unique=True)]
+            else:
+                changed = np.ones(len(cars), dtype=bool)
+                removed = np.zeros(0, dtype='<u4')
+            switched = np.flatnonzero(lights != self.prev_lights)
+            delta = [cars[changed], removed.astype('<u4'), light_rows(switched, lights), new_accidents]
+            frames.append((DELTA_FRAME, tick_frame(DELTA_FRAME, header, delta)))
+        self.prev_cars, self.prev_lights = cars, lights
+
+        if self.want_snapshot:
+            self.want_snapshot = False
+            active = self._accidents(sim.accidents)
+            snapshot = [cars, np.zeros(0, dtype='<u4'), light_rows(np.arange(len(lights)), lights), active]
+            frames.append((SNAPSHOT_FRAME, tick_frame(SNAPSHOT_FRAME, header, snapshot)))
+
+        with self.lock:
+            self.pending.extend(frames)
+            if len(self.pending) > TELEMETRY_PENDING:
+                # Поток сети не успевает: копить дальше нельзя, все начнут со снимка
+                self.pending = [item for item in self.pending if item[0] == HELLO_FRAME]
+                self.resync = True
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            resync, self.resync = self.resync, False
+            self.scheduled = False
+        if resync:
+            for client in self.clients:
+                client.stale = True
+            self.want_snapshot = True
+        for client in list(self.clients):
+            for kind, data in pending:
+                if kind == HELLO_FRAME:
+                    client.transport.write(data)
+                elif not client.stale:
+                    if kind == DELTA_FRAME:
+                        client.transport.write(data)
+                elif kind == SNAPSHOT_FRAME and not client.blocked:
+                    # Свежий снимок вместо всех пропущенных дельт
+                    client.transport.write(data)
+                    client.stale = False
+
+    def apply_controls(self, sim, paused):
+        # В потоке симуляции между тиками; возвращает новое состояние паузы
+        changed = False
+        while True:
+            try:
+                command = self.controls.get_nowait()
+            except queue.Empty:
+                break
+            cmd = command.get('cmd')
+            if cmd in ("pause", "resume"):
+                paused = cmd == "pause"
+            elif cmd == "toggle_light":
+                index = command.get('intersection')
+                if isinstance(index, int) and 0 <= index < len(sim.intersections):
+                    sim.intersections[index].toggle_lights()
+            elif cmd == "time_speed":
+                value = command.get('value')
+                if isinstance(value, int) and 1 <= value <= MAX_TIME_SPEED:
+                    sim.time_speed = value
+            else:
+                continue
+            changed = True
+        # На паузе тиков нет: снимок для нового или догнавшего клиента шлётся отсюда
+        if changed or (paused and self.want_snapshot):
+            self.publish(sim, paused)
+        return paused
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self.thread.join()
+        self.loop.close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.remove(self.unix_path)
+
+    def _shutdown(self):
+        self.server.close()
+        for client in list(self.clients):
+            client.transport.abort()
+        # Остановка - следующим шагом цикла, когда сокеты клиентов уже закрыты
+        self.loop.call_soon(self.loop.stop)
+
+# === Окно ===
+# Симуляция идёт фиксированными тиками по TICK_RATE в секунду, отдельно от кадров:
+# реальное время копится в аккумуляторе, за кадр выполняется столько тиков, сколько
+# накопилось, а машины рисуются между двумя последними тиками
+FAST_FORWARD = (1, 4, 16, None)  # Скорости по клавише F; None - сколько успеет за кадр
+MAX_TICKS_PER_FRAME = 64  # Больше не догоняем: симуляция отстанет, но окно не зависнет
+MAX_SPEED_BUDGET = 0.8  # Доля кадра на тики в режиме максимальной скорости
+DIRTY_AREA_LIMIT = 0.3  # Доля экрана, начиная с которой выгоднее обновить его целиком
+LIGHT_RECT_MARGIN = 2 * (20 + 4) + 2  # Светофоры стоят за пределами перекрёстка
+
+# === Камера ===
+# Мир может быть намного больше окна. Камера хранит левый верхний угол видимой
+# части мира и масштаб; рисуется только то, что попало в её прямоугольник.
+# WASD или правая кнопка мыши - сдвиг, колесо - масштаб вокруг курсора.
+ZOOM_LEVELS = (0.5, 0.75, 1.0, 1.5, 2.0, 3.0)
+CAMERA_SPEED = 900  # Пикселей экрана в секунду при сдвиге клавишами
+
+class Camera:
+    def __init__(self, world_width, world_height):
+        self.world_width = world_width
+        self.world_height = world_height
+        self.x = 0.0
+        self.y = 0.0
+        self.zoom_index = ZOOM_LEVELS.index(1.0)
+        self.dragging = False
+
+    @property
+    def zoom(self):
+        return ZOOM_LEVELS[self.zoom_index]
+
+    def view_rect(self):
+        # Видимая часть мира в целых пикселях мира
+        return pygame.Rect(int(self.x), int(self.y), math.ceil(WIDTH / self.zoom), math.ceil(HEIGHT / self.zoom))
+
+    def to_world(self, pos):
+        return self.x + pos[0] / self.zoom, self.y + pos[1] / self.zoom
+
+    def to_screen(self, x, y):
+        return (x - int(self.x)) * self.zoom, (y - int(self.y)) * self.zoom
+
+    def clamp(self):
+        # Немного пустоты за краем мира допустимо, но город не должен уехать с экрана
+        width, height = WIDTH / self.zoom, HEIGHT / self.zoom
+        self.x = min(max(self.x, -width / 2), max(-width / 2, self.world_width - width / 2))
+        self.y = min(max(self.y, -height / 2), max(-height / 2, self.world_height - height / 2))
+
+    def zoom_at(self, pos, steps):
+        world_x, world_y = self.to_world(pos)
+        self.zoom_index = min(len(ZOOM_LEVELS) - 1, max(0, self.zoom_index + steps))
+        self.x = world_x - pos[0] / self.zoom
+        self.y = world_y - pos[1] / self.zoom
+        self.clamp()
+
+    def handle_event(self, event):
+        # True, если событие забрала камера
+        if event.type == pygame.MOUSEWHEEL:
+            self.zoom_at(pygame.mouse.get_pos(), event.y)
+            return True
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:
+            self.dragging = True
+            return True
+        if event.type == pygame.MOUSEBUTTONUP and event.button == 3:
+            self.dragging = False
+            return True
+        if event.type == pygame.MOUSEMOTION and self.dragging:
+            self.x -= event.rel[0] / self.zoom
+            self.y -= event.rel[1] / self.zoom
+            self.clamp()
+            return True
+        return False
 
-    # Горизонтальные дороги
-    for y in h_roads:
-        pygame.draw.rect(screen, ROAD_COLOR, (0, y - ROAD_WIDTH//2, WIDTH, ROAD_WIDTH))
-        pygame.draw.line(screen, CENTER_LINE, (0, y), (WIDTH, y), 2)
-        for x in range(0, WIDTH, 40):
-            pygame.draw.rect(screen, LANE_MARK, (x, y - 10, 20, 2))
-            pygame.draw.rect(screen, LANE_MARK, (x, y + 10, 20, 2))
+    def update(self, dt):
+        keys = pygame.key.get_pressed()
+        dx = keys[pygame.K_d] - keys[pygame.K_a]
+        dy = keys[pygame.K_s] - keys[pygame.K_w]
+        if dx or dy:
+            step = CAMERA_SPEED * dt / 1000 / self.zoom
+            self.x += dx * step
+            self.y += dy * step
+            self.clamp()
+
+def visible_intersections(city, rect):
+    # Перекрёстки идут столбцами: по одному на пару (x из v_roads, y из h_roads)
+    margin = ROAD_WIDTH + LIGHT_RECT_MARGIN
+    rows = len(city.h_roads)
+    y_lo = bisect.bisect_left(city.h_roads, rect.top - margin)
+    y_hi = bisect.bisect_right(city.h_roads, rect.bottom + margin)
+    x_lo = bisect.bisect_left(city.v_roads, rect.left - margin)
+    x_hi = bisect.bisect_right(city.v_roads, rect.right + margin)
+    return [city.intersections[column * rows + row] for column in range(x_lo, x_hi) for row in range(y_lo, y_hi)]
+
+def intersections_at(city, pos):
+    return [inter for inter in visible_intersections(city, pygame.Rect(pos, (1, 1))) if intersection_rect(inter).collidepoint(pos)]
+
+def render_background(city, rect):
+    # Дороги, разметка и стоп-линии не меняются: видимая часть рисуется во
+    # внеэкранную поверхность заново, только когда сдвинулась камера
+    surface = pygame.Surface(rect.size).convert()
+    surface.fill(BACKGROUND)
+    left, top = rect.topleft
+
+    # Горизонтальные дороги; разметка привязана к миру, а не к экрану
+    marks_x = range(rect.left - rect.left % 40, rect.right, 40)
+    for y in city.h_roads[bisect.bisect_left(city.h_roads, rect.top - ROAD_WIDTH):
+                          bisect.bisect_right(city.h_roads, rect.bottom + ROAD_WIDTH)]:
+        y -= top
+        pygame.draw.rect(surface, ROAD_COLOR, (0, y - ROAD_WIDTH//2, rect.width, ROAD_WIDTH))
+        pygame.draw.line(surface, CENTER_LINE, (0, y), (rect.width, y), 2)
+        for x in marks_x:
+            pygame.draw.rect(surface, LANE_MARK, (x - left, y - 10, 20, 2))
+            pygame.draw.rect(surface, LANE_MARK, (x - left, y + 10, 20, 2))
 
     # Вертикальные дороги
-    for x in v_roads:
-        pygame.draw.rect(screen, ROAD_COLOR, (x - ROAD_WIDTH//2, 0, ROAD_WIDTH, HEIGHT))
-        pygame.draw.line(screen, CENTER_LINE, (x, 0), (x, HEIGHT), 2)
-        for y in range(0, HEIGHT, 40):
-            pygame.draw.rect(screen, LANE_MARK, (x - 10, y, 2, 20))
-            pygame.draw.rect(screen, LANE_MARK, (x + 10, y, 2, 20))
-
-    for light in intersections:
-        light.draw(screen)
-
-    for car in cars:
-        car.draw(screen)
-
-    for accident in accidents:
-        accident.draw(screen)
-
-    # Время игры сверху по центру
-    game_time = (pygame.time.get_ticks() - game_start_time) // 1000
-    minutes = game_time // 60
-    seconds = game_time % 60
-    time_text = large_font.render(f"Время игры: {minutes:02d}:{seconds:02d}", True, WHITE)
-    time_rect = time_text.get_rect(center=(WIDTH//2, 30))
-    screen.blit(time_text, time_rect)
-
-    if selected_car:
-        info_lines = [
-            f"Возраст: {selected_car.driver_age}",
-            f"Опыт: {selected_car.driver_experience}л",
-            f"Настроение: {selected_car.driver_mood}",
-            f"Машина: {selected_car.car_age}л",
-            f"Шины: {'ПЛОХИЕ' if selected_car.bad_tires else 'норм'}",
-            f"Тормоза: {'ПЛОХИЕ' if selected_car.bad_brakes else 'норм'}"
+    marks_y = range(rect.top - rect.top % 40, rect.bottom, 40)
+    for x in city.v_roads[bisect.bisect_left(city.v_roads, rect.left - ROAD_WIDTH):
+                          bisect.bisect_right(city.v_roads, rect.right + ROAD_WIDTH)]:
+        x -= left
+        pygame.draw.rect(surface, ROAD_COLOR, (x - ROAD_WIDTH//2, 0, ROAD_WIDTH, rect.height))
+        pygame.draw.line(surface, CENTER_LINE, (x, 0), (x, rect.height), 2)
+        for y in marks_y:
+            pygame.draw.rect(surface, LANE_MARK, (x - 10, y - top, 2, 20))
+            pygame.draw.rect(surface, LANE_MARK, (x + 10, y - top, 2, 20))
+
+    for inter in visible_intersections(city, rect):
+        draw_stop_lines(surface, inter, rect.topleft)
+
+    return surface
+
+def rects_area(rects):
+    return sum(rect.width * rect.height for rect in rects)
+
+# === Спрайты машин ===
+# Машины рисуются не парой draw.rect каждая, а готовыми картинками из кэша, и все
+# разом одним Surface.blits. Цвет округляется до COLOR_BUCKET, поэтому картинок
+# немного: по одной на оттенок, ориентацию и состояние (обычная, выбранная,
+# красная при мигании в аварии). Ключ машины - цвет и направление, у машин в
+# аварии и выбранной к ним добавлено состояние; какой картинке ключ соответствует,
+# запоминается в SpriteMemo, и на машину за кадр приходится один поиск в словаре
+COLOR_BUCKET = 16
+ACCIDENT_BLINK_MS = 500
+SELECTION_BORDER = 3  # Рамка выбранной машины отстоит от неё на пиксель
+SPRITE_MEMO_SIZE = 50000
+class SpriteMemo(dict):
+    # Ключ машины -> (картинка, сдвиг от центра) для одной фазы мигания аварий
+    def __init__(self, sprites, blink):
+        super().__init__()
+        self.sprites = sprites
+        self.blink = blink
+
+    def __missing__(self, key):
+        color, direction, in_accident, selected = key if len(key) == 4 else key + (False, False)
+        if self.blink and in_accident:
+            color = RED
+        else:
+            half = COLOR_BUCKET // 2
+            color = tuple(channel - channel % COLOR_BUCKET + half for channel in color)
+        if len(self) >= SPRITE_MEMO_SIZE:
+            self.clear()
+        sprite = self[key] = self.sprites.sprite(color, direction in (LEFT, RIGHT), selected)
+        return sprite
+
+class CarSprites:
+    def __init__(self):
+        self.sprites = {}  # (цвет, горизонтальная, выбрана) -> (картинка, сдвиг от центра)
+        self.memo = (SpriteMemo(self, False), SpriteMemo(self, True))
+
+    def sprite(self, color, horizontal, selected):
+        key = (color, horizontal, selected)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = self.sprites[key] = self.render(color, horizontal, selected)
+        return sprite
+
+    def render(self, color, horizontal, selected):
+        width, height = (CAR_SIZE, CAR_SIZE//2) if horizontal else (CAR_SIZE//2, CAR_SIZE)
+        if not selected:
+            image = pygame.Surface((width, height)).convert()
+            image.fill(color)
+            return image, -(width // 2), -(height // 2)
+
+        border = SELECTION_BORDER
+        image = pygame.Surface((width + 2 * border, height + 2 * border)).convert()
+        image.fill(BLACK)
+        image.set_colorkey(BLACK)  # Зазор между машиной и рамкой прозрачный
+        image.fill(color, (border, border, width, height))
+        pygame.draw.rect(image, YELLOW, image.get_rect(), 2)
+        return image, -(width // 2) - border, -(height // 2) - border
+
+    def draw(self, surface, cars, positions, offset=(0, 0), doreturn=False, sprite_keys=car_sprite_keys):
+        # positions - мировые координаты машин, sprite_keys - как получить их ключи
+        # (у движка NumPy - sim.sprite_keys). Мигание аварий выбирается раз на кадр
+        blink = pygame.time.get_ticks() % ACCIDENT_BLINK_MS < ACCIDENT_BLINK_MS // 2
+        offset_x, offset_y = offset
+        with gc_paused():
+            sprites = map(self.memo[blink].__getitem__, sprite_keys(cars))
+            batch = [(image, (x - offset_x + dx, y - offset_y + dy))
+                     for (image, dx, dy), (x, y) in zip(sprites, positions)]
+            return surface.blits(batch, doreturn)
+
+# === Оверлей производительности ===
+# F3 - показать/скрыть, F9 - записать cProfile следующих кадров в файл
+OVERLAY_REFRESH = 15  # Текст оверлея пересобирается раз в столько кадров, а не каждый кадр
+DRAW_PHASES = ('background', 'draw_lights', 'draw_cars', 'hud')
+PROFILE_FRAMES = 300
+
+def performance_lines(sim, clock):
+    timer = sim.timer
+    tick_ms = timer.tick_time() * 1000
+    lines = [
+        f"Кадр: {timer.average('frame') * 1000:.2f} мс (p95 {timer.percentile('frame', 95) * 1000:.2f}), FPS {clock.get_fps():.0f}",
+        f"Тик: {tick_ms:.2f} мс, машин/мс: {len(sim) / tick_ms if tick_ms else 0:.0f}",
+    ]
+    for phase in STEP_PHASES + DRAW_PHASES:
+        lines.append(f"  {phase}: {timer.average(phase) * 1000:.3f} / p95 {timer.percentile(phase, 95) * 1000:.3f}")
+    return lines
+
+def run_gui(sim, dirty_rects=False, profile_frames=PROFILE_FRAMES):
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Реалистичный трафик: Городской симулятор с авариями")
+    clock = pygame.time.Clock()
+    game_start_time = pygame.time.get_ticks()
+
+    font = pygame.font.SysFont(None, 24)
+    small_font = pygame.font.SysFont(None, 20)
+    large_font = pygame.font.SysFont(None, 36)
+    button_font = pygame.font.SysFont(None, 28)
+    text_cache = TextCache()
+    car_sprites = CarSprites()
+
+    # Фон видимой части мира пересобирается, только когда сдвинулась камера.
+    # При масштабе 1 мир рисуется прямо на экран, иначе - в поверхность view,
+    # которая потом растягивается на экран
+    camera = Camera(sim.world_width, sim.world_height)
+    background = None
+    background_rect = None
+    view = screen
+
+    pause_button = Button(10, HEIGHT - 50, 100, 40, "Пауза", button_font)
+    paused = False
+    selected_car = None
+
+    # Для режима грязных прямоугольников: что рисовали в прошлом кадре
+    previous_rects = []
+    full_redraw = True
+    light_states = {}  # Перекрёсток -> цвет, который на нём нарисован
+
+    timer = sim.timer
+    show_overlay = False
+    overlay_surfaces = []
+    frame = 0
+    profiler = None
+    profile_left = 0
+
+    tick_ms = 1000 / TICK_RATE
+    speed_index = 0
+    accumulator = 0.0
+    snapshot = None  # Положения машин до последнего тика, для интерполяции
+
+    # === Главный цикл ===
+    running = True
+    while running:
+        dt = clock.tick(FPS)
+        frame_start = time.perf_counter()
+        frame += 1
+
+        mouse_pos = pygame.mouse.get_pos()
+        pause_button.check_hover(mouse_pos)
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F3:
+                    show_overlay = not show_overlay
+                    overlay_surfaces = []
+                elif event.key == pygame.K_f:
+                    speed_index = (speed_index + 1) % len(FAST_FORWARD)
+                    accumulator = 0.0
+                elif event.key == pygame.K_F5:
+                    started = time.perf_counter()
+                    save_snapshot(sim, SNAPSHOT_FILE)
+                    print(f"Снимок сохранён в {SNAPSHOT_FILE} за {(time.perf_counter() - started) * 1000:.1f} мс")
+                elif event.key == pygame.K_F8 and os.path.exists(SNAPSHOT_FILE):
+                    started = time.perf_counter()
+                    recorder, stats, telemetry = sim.recorder, sim.stats, sim.telemetry
+                    sim = load_snapshot(SNAPSHOT_FILE)
+                    sim.recorder, sim.stats, sim.telemetry = recorder, stats, telemetry
+                    print(f"Снимок {SNAPSHOT_FILE} загружен за {(time.perf_counter() - started) * 1000:.1f} мс")
+                    # Новый город: свой фон, светофоры, таймер фаз и никакой интерполяции со старым
+                    timer = sim.timer
+                    camera = Camera(sim.world_width, sim.world_height)
+                    background_rect = None
+                    light_states = {}
+                    selected_car = None
+                    snapshot = None
+                    full_redraw = True
+                elif event.key == pygame.K_F9 and profiler is None:
+                    profiler = cProfile.Profile()
+                    profile_left = profile_frames
+                    profiler.enable()
+            elif camera.handle_event(event):
+                pass
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                # Попадание ищется в координатах мира и только у самой точки клика:
+                # перекрёстки - бинпоиском по дорогам, машины - у движка
+                world_pos = camera.to_world(mouse_pos)
+                for inter in intersections_at(sim, world_pos):
+                    inter.toggle_lights()
+                selected_car = sim.car_at(world_pos)
+                sim.select(selected_car)
+
+                if pause_button.is_clicked(mouse_pos, event):
+                    paused = not paused
+
+        if sim.telemetry:
+            paused = sim.telemetry.apply_controls(sim, paused)
+        camera.update(dt)
+        view_rect = camera.view_rect()
+
+        if not paused:
+            speed = FAST_FORWARD[speed_index]
+            if speed is None:
+                # Максимальная скорость: тики до конца бюджета кадра, рисуется только последний
+                deadline = frame_start + MAX_SPEED_BUDGET / FPS
+                sim.step()
+                while time.perf_counter() < deadline:
+                    sim.step()
+                snapshot = None
+            else:
+                accumulator += dt * speed
+                ticks = int(accumulator // tick_ms)
+                if ticks > MAX_TICKS_PER_FRAME:
+                    ticks = MAX_TICKS_PER_FRAME
+                    accumulator = ticks * tick_ms
+                for i in range(ticks):
+                    if i == ticks - 1:
+                        snapshot = sim.position_snapshot(view_rect)
+                    sim.step()
+                accumulator -= ticks * tick_ms
+            # Выбор снят, если машина уехала: у движка объектов её объект из пула
+            # мог за те же тики вернуться в город с другим водителем и без флага
+            if selected_car and not (selected_car.selected and sim.has_car(selected_car)):
+                selected_car = None
+                sim.select(None)
+
+        # === Отрисовка ===
+        # В режиме грязных прямоугольников фон восстанавливается только там,
+        # где в прошлом кадре были машины, аварии и HUD
+        timer.start()
+        if view_rect != background_rect:
+            background = render_background(sim, view_rect)
+            background_rect = view_rect
+            view = screen if camera.zoom == 1 else pygame.Surface(view_rect.size).convert()
+            light_states = {}
+            full_redraw = True
+        # Грязные прямоугольники - только без масштаба, иначе меняется весь экран
+        use_dirty = dirty_rects and not full_redraw and view is screen
+        if use_dirty:
+            for rect in previous_rects:
+                screen.blit(background, rect, rect)
+        else:
+            view.blit(background, (0, 0))
+        timer.mark('background')
+
+        offset = view_rect.topleft
+        drawn_rects = []
+        changed_rects = []
+        for light in visible_intersections(sim, view_rect):
+            draw_lights(view, light, offset)
+            if light.horizontal_green != light_states.get(light):
+                light_states[light] = light.horizontal_green
+                changed_rects.append(intersection_rect(light).move(-offset[0], -offset[1]).inflate(LIGHT_RECT_MARGIN, LIGHT_RECT_MARGIN))
+        timer.mark('draw_lights')
+
+        cars = sim.visible_cars(view_rect)
+        if snapshot is not None:
+            positions = sim.interpolate(snapshot, accumulator / tick_ms, cars)
+        else:
+            positions = [(car.x, car.y) for car in cars]
+        # Прямоугольники машин нужны только режиму грязных прямоугольников
+        if dirty_rects:
+            drawn_rects.extend(car_sprites.draw(view, cars, positions, offset, True, sim.sprite_keys))
+        else:
+            car_sprites.draw(view, cars, positions, offset, sprite_keys=sim.sprite_keys)
+
+        for accident in sim.accidents:
+            rect = draw_accident(view, accident, offset)
+            if rect:
+                drawn_rects.append(rect)
+        if view is not screen:
+            pygame.transform.scale(view, (WIDTH, HEIGHT), screen)
+        timer.mark('draw_cars')
+
+        # Время игры сверху по центру
+        game_time = (pygame.time.get_ticks() - game_start_time) // 1000
+        minutes = game_time // 60
+        seconds = game_time % 60
+        time_text = text_cache.render(large_font, f"Время игры: {minutes:02d}:{seconds:02d}", WHITE)
+        time_rect = time_text.get_rect(center=(WIDTH//2, 30))
+        drawn_rects.append(screen.blit(time_text, time_rect))
+
+        if selected_car:
+            info_lines = [
+                f"Возраст: {selected_car.driver_age}",
+                f"Опыт: {selected_car.driver_experience}л",
+                f"Настроение: {MOODS[selected_car.driver_mood]}",
+                f"Машина: {selected_car.car_age}л",
+                f"Шины: {'ПЛОХИЕ' if selected_car.bad_tires else 'норм'}",
+                f"Тормоза: {'ПЛОХИЕ' if selected_car.bad_brakes else 'норм'}"
+            ]
+
+            car_x, car_y = camera.to_screen(selected_car.x, selected_car.y)
+            info_x = car_x + 20
+            info_y = car_y - 80
+
+            info_surfaces = [text_cache.render(small_font, line, WHITE) for line in info_lines]
+            max_width = max(text_surface.get_width() for text_surface in info_surfaces) + 10
+            total_height = len(info_lines) * 18 + 10
+            drawn_rects.append(pygame.draw.rect(screen, INFO_BG, (info_x, info_y, max_width, total_height)))
+            pygame.draw.rect(screen, YELLOW, (info_x, info_y, max_width, total_height), 1)
+
+            for i, text_surface in enumerate(info_surfaces):
+                screen.blit(text_surface, (info_x + 5, info_y + 5 + i * 18))
+
+        info_panel_width = 350
+        info_panel_x = WIDTH - info_panel_width - 10
+
+        drawn_rects.append(pygame.draw.rect(screen, INFO_BG, (info_panel_x, 10, info_panel_width, 180)))
+        pygame.draw.rect(screen, WHITE, (info_panel_x, 10, info_panel_width, 180), 2)
+
+        y_offset = 20
+
+        time_text = text_cache.render(font, f"Время: {sim.current_time.strftime('%H:%M')}", WHITE)
+        screen.blit(time_text, (info_panel_x + 10, y_offset))
+        y_offset += 30
+
+        status_text = "ПАУЗА" if paused else "ИГРА"
+        status_color = RED if paused else GREEN
+        status_surface = text_cache.render(font, f"Статус: {status_text}", status_color)
+        screen.blit(status_surface, (info_panel_x + 10, y_offset))
+        y_offset += 30
+
+        cars_text = text_cache.render(font, f"Машин: {len(sim)}/{MAX_CARS_IN_CITY}", WHITE)
+        screen.blit(cars_text, (info_panel_x + 10, y_offset))
+        y_offset += 25
+
+        accidents_text = text_cache.render(
+            font, f"Аварии: {len(sim.accidents)} (всего {sum(sim.accidents_by_reason.values())})", WHITE)
+        screen.blit(accidents_text, (info_panel_x + 10, y_offset))
+        y_offset += 25
+
+        speed = FAST_FORWARD[speed_index]
+        speed_text = text_cache.render(font, f"Скорость: {'макс' if speed is None else f'×{speed}'} (F)", WHITE)
+        screen.blit(speed_text, (info_panel_x + 10, y_offset))
+
+        drawn_rects.append(pause_button.draw(screen))
+
+        if show_overlay:
+            if not overlay_surfaces or frame % OVERLAY_REFRESH == 0:
+                lines = performance_lines(sim, clock)
+                if profiler:
+                    lines.append(f"cProfile: осталось {profile_left} кадров")
+                overlay_surfaces = [small_font.render(line, True, WHITE) for line in lines]
+            overlay_width = max(surface.get_width() for surface in overlay_surfaces) + 10
+            overlay_rect = pygame.Rect(10, 10, overlay_width, len(overlay_surfaces) * 18 + 10)
+            drawn_rects.append(pygame.draw.rect(screen, INFO_BG, overlay_rect))
+            for i, surface in enumerate(overlay_surfaces):
+                screen.blit(surface, (15, 15 + i * 18))
+        timer.mark('hud')
+
+        if use_dirty:
+            dirty = previous_rects + drawn_rects + changed_rects
+            if rects_area(dirty) < WIDTH * HEIGHT * DIRTY_AREA_LIMIT:
+                pygame.display.update(dirty)
+            else:
+                pygame.display.flip()
+        else:
+            pygame.display.flip()
+
+        # Если машин на экране много, дешевле перерисовать фон целиком
+        previous_rects = drawn_rects
+        full_redraw = rects_area(drawn_rects) >= WIDTH * HEIGHT * DIRTY_AREA_LIMIT
+        timer.record('frame', time.perf_counter() - frame_start)
+
+        if profiler:
+            profile_left -= 1
+            if profile_left <= 0:
+                profiler.disable()
+                filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof"
+                profiler.dump_stats(filename)
+                print(f"Профиль {profile_frames} кадров сохранён в {filename}")
+                profiler = None
+
+    if profiler:
+        profiler.disable()
+    pygame.quit()
+
+# === Повтор записи ===
+# Показывает запись --record теми же спрайтами и draw_accident, без логики
+# симуляции. Столбцы - np.memmap, и с диска читается только текущий кадр
+# и события вокруг него, поэтому многочасовая запись открывается сразу.
+# Пробел - пауза, стрелки влево/вправо - кадр назад/вперёд, вверх/вниз -
+# скорость (в том числе обратная), Home/End - начало/конец, клик по шкале - переход.
+REPLAY_SPEEDS = (-16, -4, -1, 1, 4, 16)
+TIMELINE_HEIGHT = 12
+
+class ReplayCar:
+    # Машина из записи с теми атрибутами, которые нужны car_sprite_keys
+    __slots__ = ('x', 'y', 'direction', 'in_accident', 'color')
+    selected = False
+
+    def __init__(self, x, y, direction, in_accident, color):
+        self.x = x
+        self.y = y
+        self.direction = direction
+        self.in_accident = in_accident
+        self.color = color
+
+class Replay:
+    def __init__(self, recording):
+        self.recording = recording
+        layout = recording.layout
+        self.h_roads = layout['h_roads']
+        self.v_roads = layout['v_roads']
+        self.world_width, self.world_height = layout['world_size']
+        # Фазы светофоров берутся из записи, начальные не важны
+        self.intersections = [Intersection(x, y, 0, True) for x in self.v_roads for y in self.h_roads]
+        self.event_ticks = recording.events['tick']
+        self.car_ids = recording.cars['car_id']
+
+    def __len__(self):
+        return len(self.recording)
+
+    def time_at(self, i):
+        layout = self.recording.layout
+        return layout['start_time'] + timedelta(minutes=layout['time_speed'] * int(self.recording.tick[i]))
+
+    def cars_at(self, i, rect):
+        frame = self.recording.frame(i)
+        x, y = frame['x'], frame['y']
+        visible = np.flatnonzero((x >= rect.left - VISIBLE_MARGIN) & (x <= rect.right + VISIBLE_MARGIN) &
+                                 (y >= rect.top - VISIBLE_MARGIN) & (y <= rect.bottom + VISIBLE_MARGIN))
+        # Таблица машин отсортирована по номеру: цвета одним бинпоиском на кадр
+        colors = self.recording.cars['color'][np.searchsorted(self.car_ids, frame['car_id'][visible])]
+        in_accident = (frame['flags'][visible] & IN_ACCIDENT_FLAG) != 0
+        return [ReplayCar(*car) for car in zip(x[visible].tolist(), y[visible].tolist(),
+                                               frame['direction'][visible].tolist(),
+                                               in_accident.tolist(), map(tuple, colors.tolist()))]
+
+    def accidents_at(self, i):
+        # Аварии, которые ещё видны в этом тике. В симуляции таймер аварии уменьшается
+        # уже в тике, когда она случилась, и авария живёт, пока он больше нуля
+        tick = int(self.recording.tick[i])
+        lo = np.searchsorted(self.event_ticks, tick - ACCIDENT_DURATION + 2)
+        hi = np.searchsorted(self.event_ticks, tick, side='right')
+        accidents = []
+        for event in self.recording.events[lo:hi]:
+            if event['kind'] != ACCIDENT_EVENT:
+                continue
+            accident = Accident(float(event['x']), float(event['y']), int(event['car_id']), int(event['other_id']),
+                                self.recording.meta['reasons'][event['a']], None, SEVERITIES[event['b']])
+            accident.timer = ACCIDENT_DURATION - 1 - (tick - int(event['tick']))
+            accidents.append(accident)
+        return accidents
+
+    def update_lights(self, i):
+        states = np.unpackbits(self.recording.lights[i])[:len(self.intersections)]
+        for inter, green in zip(self.intersections, states.tolist()):
+            inter.horizontal_green = bool(green)
+
+def run_replay(path):
+    recording = Recording(path)
+    replay = Replay(recording)
+    if not len(replay):
+        print(f"В записи {path} нет ни одного тика")
+        return
+
+    pygame.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption(f"Повтор записи: {path}")
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 24)
+    text_cache = TextCache()
+    car_sprites = CarSprites()
+    camera = Camera(replay.world_width, replay.world_height)
+    background = None
+    background_rect = None
+    view = screen
+    timeline = pygame.Rect(10, HEIGHT - TIMELINE_HEIGHT - 10, WIDTH - 20, TIMELINE_HEIGHT)
+
+    last = len(replay) - 1
+    position = 0.0  # Дробный номер кадра: на малой скорости кадр держится несколько отрисовок
+    speed_index = REPLAY_SPEEDS.index(1)
+    paused = False
+    shown = None
+    shown_rect = None
+    cars = accidents = []
+
+    running = True
+    while running:
+        dt = clock.tick(FPS)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif camera.handle_event(event):
+                pass
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_RIGHT:
+                    position = min(last, int(position) + 1)
+                elif event.key == pygame.K_LEFT:
+                    position = max(0, int(position) - 1)
+                elif event.key == pygame.K_UP:
+                    speed_index = min(len(REPLAY_SPEEDS) - 1, speed_index + 1)
+                elif event.key == pygame.K_DOWN:
+                    speed_index = max(0, speed_index - 1)
+                elif event.key == pygame.K_HOME:
+                    position = 0
+                elif event.key == pygame.K_END:
+                    position = last
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and timeline.collidepoint(event.pos):
+                position = (event.pos[0] - timeline.x) / timeline.width * last
+
+        if not paused:
+            position = min(last, max(0.0, position + REPLAY_SPEEDS[speed_index] * dt * TICK_RATE / 1000))
+
+        camera.update(dt)
+        view_rect = camera.view_rect()
+        if view_rect != background_rect:
+            background = render_background(replay, view_rect)
+            background_rect = view_rect
+            view = screen if camera.zoom == 1 else pygame.Surface(view_rect.size).convert()
+
+        # Новый кадр читается с диска, только когда сменился номер кадра или камера
+        i = int(position)
+        if i != shown or view_rect != shown_rect:
+            cars = replay.cars_at(i, view_rect)
+            accidents = replay.accidents_at(i)
+            replay.update_lights(i)
+            shown = i
+            shown_rect = view_rect
+
+        offset = view_rect.topleft
+        view.blit(background, (0, 0))
+        for light in visible_intersections(replay, view_rect):
+            draw_lights(view, light, offset)
+        car_sprites.draw(view, cars, [(car.x, car.y) for car in cars], offset)
+        for accident in accidents:
+            draw_accident(view, accident, offset)
+        if view is not screen:
+            pygame.transform.scale(view, (WIDTH, HEIGHT), screen)
+
+        lines = [
+            f"Время: {replay.time_at(i).strftime('%d.%m %H:%M')}",
+            f"Кадр: {i + 1}/{len(replay)} (тик {int(recording.tick[i])})",
+            f"Скорость: ×{REPLAY_SPEEDS[speed_index]}{' ПАУЗА' if paused else ''}",
+            f"Машин: {len(cars)}",
         ]
-
-        info_x = selected_car.x + 20
-        info_y = selected_car.y - 80
-
-        max_width = max(small_font.size(line)[0] for line in info_lines) + 10
-        total_height = len(info_lines) * 18 + 10
-        pygame.draw.rect(screen, INFO_BG, (info_x, info_y, max_width, total_height))
-        pygame.draw.rect(screen, YELLOW, (info_x, info_y, max_width, total_height), 1)
-
-        for i, line in enumerate(info_lines):
-            text_surface = small_font.render(line, True, WHITE)
-            screen.blit(text_surface, (info_x + 5, info_y + 5 + i * 18))
-
-    info_panel_width = 350
-    info_panel_x = WIDTH - info_panel_width - 10
-
-    pygame.draw.rect(screen, INFO_BG, (info_panel_x, 10, info_panel_width, 180))
-    pygame.draw.rect(screen, WHITE, (info_panel_x, 10, info_panel_width, 180), 2)
-
-    y_offset = 20
-
-    time_text = font.render(f"Время: {current_time.strftime('%H:%M')}", True, WHITE)
-    screen.blit(time_text, (info_panel_x + 10, y_offset))
-    y_offset += 30
-
-    status_text = "ПАУЗА" if paused else "ИГРА"
-    status_color = RED if paused else GREEN
-    status_surface = font.render(f"Статус: {status_text}", True, status_color)
-    screen.blit(status_surface, (info_panel_x + 10, y_offset))
-    y_offset += 30
-
-    cars_text = font.render(f"Машин: {len(cars)}/{MAX_CARS_IN_CITY}", True, WHITE)
-    screen.blit(cars_text, (info_panel_x + 10, y_offset))
-    y_offset += 25
-
-    accidents_text = font.render(f"Аварии: {len(accidents)}", True, WHITE)
-    screen.blit(accidents_text, (info_panel_x + 10, y_offset))
-
-    pause_button.draw(screen)
-
-    pygame.display.flip()
-
-pygame.quit()
-sys.exit()
+        pygame.draw.rect(screen, INFO_BG, (WIDTH - 360, 10, 350, 20 + len(lines) * 25))
+        for row, line in enumerate(lines):
+            screen.blit(text_cache.render(font, line, WHITE), (WIDTH - 350, 20 + row * 25))
+
+        pygame.draw.rect(screen, INFO_BG, timeline)
+        done = timeline.width * i // max(1, last)
+        pygame.draw.rect(screen, BUTTON_COLOR, (timeline.x, timeline.y, done, timeline.height))
+        pygame.draw.rect(screen, WHITE, timeline, 1)
+        pygame.display.flip()
+
+    pygame.quit()
+
+def parse_regions(text):
+    # "3x2" -> (3, 2): столбцов и строк районов
+    columns, _, rows = text.lower().partition("x")
+    regions = int(columns), int(rows)
+    if min(regions) < 1:
+        raise ValueError(text)
+    return regions
+
+def main():
+    parser = argparse.ArgumentParser(description="Городской симулятор трафика с авариями")
+    parser.add_argument("--headless", action="store_true", help="без окна и без ограничения FPS")
+    parser.add_argument("--ticks", type=int, default=10000, help="число тиков в режиме --headless")
+    parser.add_argument("--seed", type=int, default=None, help="зерно генератора случайных чисел")
+    parser.add_argument("--engine", choices=["objects", "numpy", "sharded"], default="objects",
+                        help="движок: объекты Car, массивы NumPy или NumPy по районам в отдельных процессах")
+    parser.add_argument("--regions", type=parse_regions, default=(2, 2), metavar="COLSxROWS",
+                        help="на сколько районов делить город для --engine sharded, по умолчанию 2x2")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="обновлять на экране только изменившиеся области")
+    parser.add_argument("--profile-frames", type=int, default=PROFILE_FRAMES,
+                        help="сколько кадров записывать в cProfile по клавише F9")
+    parser.add_argument("--city", metavar="FILE", help="планировка города из JSON (дороги и размер мира)")
+    parser.add_argument("--load", metavar="FILE", help="начать со снимка, сохранённого по F5")
+    parser.add_argument("--populate", type=int, default=0, metavar="CARS",
+                        help="сразу расставить CARS машин по дорогам, как будто город уже жил")
+    parser.add_argument("--record", metavar="DIR", help="записывать траектории машин и события в папку DIR")
+    parser.add_argument("--replay", metavar="DIR", help="показать запись --record вместо симуляции")
+    parser.add_argument("--stats", metavar="DIR",
+                        help="сводная статистика по игровым часам в DIR/stats.csv и DIR/stats.jsonl")
+    parser.add_argument("--telemetry", metavar="ADDR",
+                        help="рассылать состояние и принимать команды на host:port или unix:путь")
+    parser.add_argument("--monte-carlo", type=int, metavar="RUNS",
+                        help="статистика аварий по RUNS независимым прогонам без окна")
+    parser.add_argument("--days", type=int, default=1, help="игровых дней в каждом прогоне --monte-carlo")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число процессов для --monte-carlo, по умолчанию по числу ядер")
+    parser.add_argument("--output", help="файл JSON для результатов --monte-carlo")
+    args = parser.parse_args()
+
+    if args.engine in ("numpy", "sharded") and np is None:
+        parser.error(f"для --engine {args.engine} нужен пакет numpy")
+    if (args.record or args.replay or args.telemetry) and np is None:
+        parser.error("для --record, --replay и --telemetry нужен пакет numpy")
+
+    if args.replay:
+        try:
+            run_replay(args.replay)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        return
+
+    layout = {}
+    if args.city:
+        try:
+            layout = load_city(args.city)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    if args.monte_carlo:
+        if args.engine == "sharded":
+            parser.error("прогоны --monte-carlo и так идут по процессам, движок sharded для них не нужен")
+        try:
+            ticks_per_day(layout.get('time_speed', TIME_SPEED))
+        except ValueError as e:
+            parser.error(f"{args.city}: {e}")
+        run_monte_carlo(args.monte_carlo, args.days, args.seed or 0, args.engine, args.workers, args.output, layout)
+        return
+
+    if args.load:
+        try:
+            sim = load_snapshot(args.load)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    elif args.engine == "numpy":
+        sim = NumpySimulation(args.seed, **layout)
+    elif args.engine == "sharded":
+        try:
+            sim = ShardedSimulation(args.seed, regions=args.regions, **layout)
+        except ValueError as e:
+            parser.error(f"--regions: {e}")
+    else:
+        sim = Simulation(args.seed, **layout)
+    if args.populate:
+        sim.populate(args.populate)
+
+    if args.record:
+        sim.recorder = TrajectoryRecorder(args.record, sim)
+    if args.stats:
+        try:
+            sim.stats = StatsAggregator(args.stats, sim)
+        except OSError as e:
+            parser.error(str(e))
+    if args.telemetry:
+        try:
+            sim.telemetry = TelemetryServer(args.telemetry, sim)
+        except (OSError, ValueError) as e:
+            parser.error(f"{args.telemetry}: {e}")
+
+    try:
+        if args.headless:
+            run_headless(sim, args.ticks)
+        else:
+            run_gui(sim, args.dirty_rects, args.profile_frames)
+    finally:
+        if sim.recorder:
+            sim.recorder.close()
+            print(f"Запись сохранена в {args.record}")
+        if sim.stats:
+            sim.stats.close()
+            print(f"Статистика сохранена в {args.stats}")
+        if sim.telemetry:
+            sim.telemetry.close()
+        if isinstance(sim, ShardedSimulation):
+            sim.close()
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
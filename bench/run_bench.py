@@ -0,0 +1,152 @@
+# Бенчмарк симуляции: фиксированные сценарии с заданным зерном,
+# каждый прогон в отдельном процессе, чтобы пиковая память была честной.
+# Запуск: python bench/run_bench.py --output bench/results.json
+import argparse
+import datetime
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows: пиковую память не меряем
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# === Сценарии ===
+# hour - игровой час, время стоит на месте (time_speed=0), чтобы интенсивность не плыла.
+# populate - сколько машин расставить до старта, grid - своя сетка дорог (строки, столбцы, шаг).
+SCENARIOS = {
+    'night': dict(hour=2, ticks=3000),
+    'rush_morning': dict(hour=8, ticks=3000),
+    'rush_evening': dict(hour=18, ticks=3000),
+    'saturated': dict(hour=12, ticks=1000, populate='max'),
+    'huge_grid': dict(hour=8, ticks=300, grid=(40, 40, 300), populate=10000),
+}
+
+# === Прогон ===
+def load_simulator():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module("traffic")
+
+def build_simulation(sim_module, engine, seed, scenario):
+    layout = {
+        'start_time': datetime.datetime(2024, 1, 1, scenario['hour'], 0),
+        'time_speed': 0,
+    }
+    if 'grid' in scenario:
+        rows, cols, spacing = scenario['grid']
+        layout['h_roads'] = [spacing * (i + 1) for i in range(rows)]
+        layout['v_roads'] = [spacing * (i + 1) for i in range(cols)]
+        layout['world_size'] = (spacing * (cols + 1), spacing * (rows + 1))
+
+    if engine == 'numpy':
+        sim = sim_module.NumpySimulation(seed, **layout)
+    elif engine == 'sharded':
+        sim = sim_module.ShardedSimulation(seed, **layout)
+    else:
+        sim = sim_module.Simulation(seed, **layout)
+
+    count = scenario.get('populate', 0)
+    if count == 'max':
+        count = sim_module.MAX_CARS_IN_CITY
+    if count:
+        sim.populate(count)
+    return sim
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_scenario(name, engine, seed, ticks):
+    sim_module = load_simulator()
+    scenario = SCENARIOS[name]
+    sim = build_simulation(sim_module, engine, seed, scenario)
+    cars_start = len(sim)
+
+    started = time.perf_counter()
+    for _ in range(ticks):
+        sim.step()
+    elapsed = time.perf_counter() - started
+    if engine == 'sharded':
+        sim.close()
+
+    return {
+        'scenario': name,
+        'engine': engine,
+        'seed': seed,
+        'ticks': ticks,
+        'seconds': round(elapsed, 4),
+        'ticks_per_sec': round(ticks / elapsed, 1),
+        'phases_ms_per_tick': {phase: round(total * 1000 / ticks, 4)
+                               for phase, total in sim.timer.totals.items()},
+        'peak_rss_mb': peak_memory_mb(),  # у sharded - только координатор, без процессов районов
+        'cars_start': cars_start,
+        'cars_end': len(sim),
+        'cars_spawned': sim.cars_spawned,
+        'accidents': sum(sim.accidents_by_reason.values()),
+    }
+
+# === Отчёт ===
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк симуляции трафика")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="сценарий (можно несколько раз), по умолчанию все")
+    parser.add_argument('--engine', action='append', choices=['objects', 'numpy', 'sharded'],
+                        help="движок (можно несколько раз), по умолчанию objects и numpy")
+    parser.add_argument('--seed', type=int, default=1, help="зерно случайности")
+    parser.add_argument('--ticks', type=int, help="переопределить число тиков во всех сценариях")
+    parser.add_argument('--output', help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    engines = args.engine or ['objects', 'numpy']
+    if importlib.util.find_spec('numpy') is None and set(engines) & {'numpy', 'sharded'}:
+        print("NumPy не установлен, движки numpy и sharded пропущены")
+        engines = [engine for engine in engines if engine == 'objects']
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name in args.scenario or list(SCENARIOS):
+        for engine in engines:
+            ticks = args.ticks or SCENARIOS[name]['ticks']
+            # Новый процесс на каждый прогон: пиковая память не тянется из прошлых сценариев
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_scenario, name, engine, args.seed, ticks).result()
+            results.append(result)
+            phases = ", ".join(f"{phase} {ms:.3f}" for phase, ms in result['phases_ms_per_tick'].items())
+            print(f"{name:13} {engine:8} {result['ticks_per_sec']:9.1f} тиков/с  "
+                  f"память {result['peak_rss_mb']} МБ  машин {result['cars_end']:6}  мс/тик: {phases}")
+
+    if args.output:
+        report = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+if __name__ == "__main__":
+    main()
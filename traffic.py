@@ -0,0 +1,2866 @@
+# Ядро симулятора без окна: машины, светофоры, оба движка, снимки, запись
+# траекторий, статистика, прогон без окна и Монте-Карло. pygame здесь не
+# импортируется, а NumPy загружается при первом обращении, поэтому ядро
+# импортируется за миллисекунды - это важно для тестов, ноутбуков и сотен
+# процессов Монте-Карло. Окно, повтор записи и телеметрия - в 3.py.
+import sys
+import time
+import random
+import math
+import bisect
+import gc
+import os
+import json
+import pickle
+import csv
+import queue
+import threading
+import importlib.util
+from array import array
+from datetime import datetime, timedelta
+from collections import deque
+from contextlib import contextmanager
+from operator import attrgetter
+
+def lazy_import(name):
+    # Модуль загружается при первом обращении к его атрибуту; None - если не установлен
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        # Как при обычном импорте: подмодуль доступен атрибутом пакета (concurrent.futures)
+        setattr(sys.modules[parent], child, module)
+    spec.loader.exec_module(module)
+    return module
+
+np = lazy_import("numpy")  # Нужен для --engine numpy, --record и пачек профилей водителей
+futures = lazy_import("concurrent.futures")  # Процессы нужны только Монте-Карло
+mp = lazy_import("multiprocessing")  # И процессы районов движка --engine sharded
+
+# === НАСТРОЙКИ ===
+WIDTH, HEIGHT = 1920, 1080
+FPS = 30
+TICK_RATE = 30  # Тиков симуляции в секунду при скорости ×1, независимо от FPS отрисовки
+MAX_CARS_IN_CITY = 1400
+MAX_SPEED_KMH = 80
+MAX_SPEED = 1.8
+
+# Характеристики водителей
+YOUNG_DRIVER_AGE = 25
+OLD_DRIVER_AGE = 60
+INATTENTIVE_DRIVER_PERCENT = 60
+VERY_ATTENTIVE_DRIVER_PERCENT = 20
+BAD_TIRES_PERCENT = 7
+BAD_BRAKES_PERCENT = 3
+MOODS = ["спокойный", "нервный", "расслабленный", "злой", "уставший"]
+CALM, NERVOUS, RELAXED, ANGRY, TIRED = range(len(MOODS))  # Настроение хранится номером в MOODS
+MOOD_ATTENTION = [1.1, 0.8, 1.0, 0.7, 0.6]  # Множитель внимания по номеру настроения
+
+# Интенсивность движения
+TRAFFIC_INTENSITY = {
+    0: 0.003, 1: 0.002, 2: 0.001, 3: 0.001, 4: 0.001, 5: 0.002,
+    6: 0.005, 7: 0.015, 8: 0.03, 9: 0.02, 10: 0.015, 11: 0.015,
+    12: 0.015, 13: 0.015, 14: 0.015, 15: 0.015, 16: 0.02, 17: 0.025,
+    18: 0.03, 19: 0.02, 20: 0.01, 21: 0.005, 22: 0.003, 23: 0.002
+}
+
+ACCIDENT_DURATION = 1 * TICK_RATE
+
+# === Параметры дорог ===
+ROAD_WIDTH = 60
+LANE_WIDTH = ROAD_WIDTH // 4
+CAR_SIZE = 16
+LIGHT_OFFSET = 35
+CYCLE_TIME = 4 * TICK_RATE
+FOLLOW_DISTANCE = CAR_SIZE * 1.5
+STOP_LINE_DISTANCE = 20
+TURN_PROBABILITY = 0.4
+
+# Время симуляции
+START_TIME = datetime(2024, 1, 1, 6, 0)
+TIME_SPEED = 10
+
+# === Дороги ===
+# ИСПРАВЛЕНО: Правильные координаты дорог с учетом ширины
+h_roads = [200, 500,800, 950, 1400]  # Горизонтальные дороги (y-координаты)
+v_roads = [250, 750,1050, 1650]       # Вертикальные дороги (x-координаты)
+
+# ИСПРАВЛЕНО: Правильные смещения для полос
+# Горизонтальные дороги: полосы 0-1 (верхние) - движение слева направо
+H_LANE_OFFSETS = [15, 5, -5, -15]
+
+# Вертикальные дороги: полосы 0-1 (левые) - движение сверху вниз
+V_LANE_OFFSETS = [-15, -5, 5, 15]
+
+# Направления движения и решения о повороте - небольшие целые числа
+RIGHT, LEFT, DOWN, UP = range(4)
+NO_TURN, STRAIGHT, TURN_LEFT, TURN_RIGHT, UTURN = range(5)
+
+# === Случайные числа ===
+# У каждой симуляции свой генератор, а не глобальный random: два города в одном
+# процессе не сбивают друг другу последовательность. Он разбит на потоки по
+# назначению, и каждый поток засевается из зерна и своего имени - лишний бросок
+# в одной подсистеме (новое правило поведения, другой спавн) не сдвигает
+# остальные, и при том же --seed приезжают те же машины с теми же водителями.
+# Одиночные броски движка объектов берутся из random.Random потока: по одному
+# числу он быстрее раздачи из заготовленного блока NumPy. Пачки (профили,
+# --populate, весь движок NumPy) - из генератора NumPy того же потока.
+RANDOM_STREAMS = ('spawn', 'behavior', 'accidents', 'lights')
+
+class SimRandom:
+    def __init__(self, seed=None):
+        if seed is None:
+            # Без зерна - из random: random.seed() снаружи по-прежнему повторяет прогон
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.streams = {name: random.Random(f"{seed}/{name}") for name in RANDOM_STREAMS}
+        self.spawn = self.streams['spawn']
+        self.behavior = self.streams['behavior']
+        self.accidents = self.streams['accidents']
+        self.lights = self.streams['lights']
+        self.generators = {}
+
+    def generator(self, name):
+        # Генератор NumPy потока засевается из самого потока при первом обращении
+        rng = self.generators.get(name)
+        if rng is None:
+            rng = self.generators[name] = np.random.default_rng(self.streams[name].getrandbits(128))
+        return rng
+
+    def getstate(self):
+        return ({name: stream.getstate() for name, stream in self.streams.items()},
+                {name: rng.bit_generator.state for name, rng in self.generators.items()})
+
+    def setstate(self, state):
+        streams, generators = state
+        # Генераторы создаются до восстановления потоков: создание тянет из потока число.
+        # Состояние пишется в те же объекты - их уже держат DriverProfiles и движок NumPy
+        for name in generators:
+            self.generator(name)
+        for name, stream_state in streams.items():
+            self.streams[name].setstate(stream_state)
+        for name, generator_state in generators.items():
+            self.generators[name].bit_generator.state = generator_state
+
+# === Авария ===
+SEVERITIES = ["легкая", "средняя", "тяжелая"]
+
+class Accident:
+    def __init__(self, x, y, car1, car2, reason, driver, severity):
+        self.x = x
+        self.y = y
+        self.car1 = car1
+        self.car2 = car2
+        self.reason = reason
+        # (возраст, настроение) виновника и (плохие тормоза, плохие шины) у любой из машин,
+        # на момент аварии: машины потом уходят в пул и переиспользуются
+        self.driver = driver
+        self.timer = ACCIDENT_DURATION
+        self.severity = severity
+
+    def update(self):
+        self.timer -= 1
+        return self.timer > 0
+
+# === Перекрёсток ===
+class Intersection:
+    def __init__(self, x, y, timer, horizontal_green):
+        self.x = x
+        self.y = y
+        self.timer = timer
+        self.horizontal_green = horizontal_green
+        
+        # ИСПРАВЛЕНО: Правильные стоп-линии
+        self.stop_lines = {
+            RIGHT: x - ROAD_WIDTH//2 - STOP_LINE_DISTANCE,
+            LEFT: x + ROAD_WIDTH//2 + STOP_LINE_DISTANCE,
+            DOWN: y - ROAD_WIDTH//2 - STOP_LINE_DISTANCE,
+            UP: y + ROAD_WIDTH//2 + STOP_LINE_DISTANCE
+        }
+
+    def update(self):
+        self.timer += 1
+        if self.timer >= CYCLE_TIME:
+            self.timer = 0
+            self.horizontal_green = not self.horizontal_green
+
+    def is_green_for(self, direction):
+        if direction in (LEFT, RIGHT):
+            return self.horizontal_green
+        else:  # up, down
+            return not self.horizontal_green
+
+    def toggle_lights(self):
+        self.horizontal_green = not self.horizontal_green
+        self.timer = 0
+
+def city_intersections(v_roads, h_roads, rng):
+    # Перекрёстки всех дорог со случайной фазой светофора из потока rng
+    return [Intersection(x, y, rng.randint(0, CYCLE_TIME), rng.choice([True, False]))
+            for x in v_roads for y in h_roads]
+
+# === Топология дорог ===
+# Строится один раз: для каждой дороги и направления - отсортированные по ходу
+# движения стоп-линии и их перекрёстки. Следующий перекрёсток ищется бинпоиском.
+class RoadTopology:
+    def __init__(self, intersections, width=WIDTH, height=HEIGHT):
+        self.width = width  # Размеры города: за его пределами машины исчезают
+        self.height = height
+        self.roads = {}  # (base_road, direction) -> (стоп-линии, перекрёстки)
+        for inter in intersections:
+            self._add(inter.y, RIGHT, inter.x - STOP_LINE_DISTANCE, inter)
+            self._add(inter.y, LEFT, inter.x + STOP_LINE_DISTANCE, inter)
+            self._add(inter.x, DOWN, inter.y - STOP_LINE_DISTANCE, inter)
+            self._add(inter.x, UP, inter.y + STOP_LINE_DISTANCE, inter)
+
+        for key, entries in self.roads.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.roads[key] = ([stop for stop, _ in entries], [inter for _, inter in entries])
+
+    def _add(self, base_road, direction, stop_line, inter):
+        self.roads.setdefault((base_road, direction), []).append((stop_line, inter))
+
+    def next_intersection(self, car):
+        entry = self.roads.get((car.base_road, car.direction))
+        if entry is None:
+            return None, float('inf')
+        stops, inters = entry
+
+        if car.direction in (RIGHT, DOWN):
+            pos = car.x if car.direction == RIGHT else car.y
+            i = bisect.bisect_right(stops, pos)
+            if i < len(stops):
+                return inters[i], stops[i] - pos
+        else:  # left, up
+            pos = car.x if car.direction == LEFT else car.y
+            i = bisect.bisect_left(stops, pos) - 1
+            if i >= 0:
+                return inters[i], pos - stops[i]
+        return None, float('inf')
+
+# === Индекс полос ===
+# Машины каждой полосы (base_road, direction, lane) хранятся отсортированными
+# по продвижению вдоль дороги, поэтому поиск машины впереди и проверка
+# свободного места в соседней полосе - это поиск соседа, а не перебор всех машин.
+LANE_INDEX_MARGIN = MAX_SPEED * 2  # Запас на смещение машин внутри одного тика
+
+class LaneIndex:
+    def __init__(self):
+        self.lanes = {}  # ключ полосы -> (ключи продвижения, машины)
+
+    def add(self, car):
+        key = car.lane_key()
+        keys, cars = self.lanes.setdefault(key, ([], []))
+        progress = car.progress()
+        i = bisect.bisect_right(keys, progress)
+        keys.insert(i, progress)
+        cars.insert(i, car)
+        car.index_key = key
+        car.index_progress = progress
+
+    def remove(self, car):
+        keys, cars = self.lanes[car.index_key]
+        i = self._find(keys, cars, car)
+        del keys[i]
+        del cars[i]
+        car.index_key = None
+
+    def relocate(self, car):
+        if car.lane_key() != car.index_key:
+            self.remove(car)
+            self.add(car)
+
+    def rebuild(self, cars):
+        # Индекс с нуля, например после загрузки снимка: группировка и одна сортировка на полосу
+        lanes = {}
+        for car in cars:
+            car.index_key = car.lane_key()
+            lanes.setdefault(car.index_key, []).append(car)
+        self.lanes = {key: ([0.0] * len(lane_cars), lane_cars) for key, lane_cars in lanes.items()}
+        self.refresh()
+
+    def refresh(self):
+        # Раз в тик: машины сдвинулись на доли размера машины, порядок почти
+        # не меняется, и сортировка почти упорядоченного списка линейна
+        for key, (keys, cars) in self.lanes.items():
+            cars.sort(key=Car.progress)
+            for i, car in enumerate(cars):
+                progress = car.progress()
+                keys[i] = progress
+                car.index_progress = progress
+
+    def _find(self, keys, cars, car):
+        i = bisect.bisect_left(keys, car.index_progress)
+        while cars[i] is not car:
+            i += 1
+        return i
+
+    def lead(self, car):
+        keys, cars = self.lanes[car.index_key]
+        progress = car.progress()
+        for i in range(self._find(keys, cars, car) + 1, len(cars)):
+            other = cars[i]
+            if other.turning or other.in_accident:
+                continue
+            d = other.progress() - progress
+            if d > 0:
+                return other, d
+        return None, float('inf')
+
+    def is_clear(self, car, lane, gap):
+        entry = self.lanes.get((car.base_road, car.direction, lane))
+        if not entry:
+            return True
+        keys, cars = entry
+        progress = car.progress()
+        lo = bisect.bisect_left(keys, progress - gap - LANE_INDEX_MARGIN)
+        hi = bisect.bisect_right(keys, progress + gap + LANE_INDEX_MARGIN)
+        for other in cars[lo:hi]:
+            if other is car or other.in_accident or other.turning:
+                continue
+            if abs(other.progress() - progress) < gap:
+                return False
+        return True
+
+# === Пространственная сетка ===
+# Машины раскладываются по клеткам размером с машину. Задеть друг друга могут
+# только машины из одной или соседних клеток, поэтому пары для проверки
+# столкновений в любых направлениях ищутся за линейное время, а не перебором всех.
+SIDE_IMPACT_DISTANCE = CAR_SIZE / 2  # Центры ближе - машины уже касаются друг друга
+# Половина соседних клеток: каждая пара клеток просматривается один раз
+HALF_NEIGHBOURS = ((1, 0), (-1, 1), (0, 1), (1, 1))
+
+class SpatialHash:
+    def __init__(self, cell_size=CAR_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (столбец, строка) -> машины
+
+    def rebuild(self, cars):
+        # Раз в тик: машины сдвигаются меньше чем на клетку, но пересобрать
+        # словарь дешевле, чем следить за переходами между клетками
+        cells = self.cells = {}
+        size = self.cell_size
+        for car in cars:
+            key = (int(car.x // size), int(car.y // size))
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [car]
+            else:
+                bucket.append(car)
+
+    def pairs(self, distance):
+        cells = self.cells
+        limit = distance * distance
+        for (cx, cy), cars in cells.items():
+            for i, car in enumerate(cars):
+                for other in cars[i + 1:]:
+                    d = (car.x - other.x) ** 2 + (car.y - other.y) ** 2
+                    if d < limit:
+                        yield car, other, math.sqrt(d)
+            for dx, dy in HALF_NEIGHBOURS:
+                others = cells.get((cx + dx, cy + dy))
+                if not others:
+                    continue
+                for car in cars:
+                    for other in others:
+                        d = (car.x - other.x) ** 2 + (car.y - other.y) ** 2
+                        if d < limit:
+                            yield car, other, math.sqrt(d)
+
+    def near(self, x, y):
+        # Машины клетки точки и восьми соседних: дальше машина точку не накроет
+        size = self.cell_size
+        cx, cy = int(x // size), int(y // size)
+        cells = self.cells
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                yield from cells.get((cx + dx, cy + dy), ())
+
+def car_hit(car, x, y):
+    # Точка на кузове: машина длиной CAR_SIZE и вдвое уже, вдоль своего направления
+    if car.direction in (LEFT, RIGHT):
+        return abs(car.x - x) <= CAR_SIZE / 2 and abs(car.y - y) <= CAR_SIZE / 4
+    return abs(car.x - x) <= CAR_SIZE / 4 and abs(car.y - y) <= CAR_SIZE / 2
+
+# === Машина ===
+def turn_options(direction, lane):
+    options = [STRAIGHT]
+
+    # Логика доступных поворотов
+    if direction == RIGHT:
+        if lane == 0:  # Левая полоса
+            options = [STRAIGHT, TURN_LEFT, UTURN]
+        elif lane == 1:  # Правая полоса
+            options = [STRAIGHT, TURN_RIGHT]
+
+    elif direction == LEFT:
+        if lane == 3:  # Правая полоса
+            options = [STRAIGHT, TURN_LEFT, UTURN]
+        elif lane == 2:  # Левая полоса
+            options = [STRAIGHT, TURN_RIGHT]
+
+    elif direction == DOWN:
+        if lane == 0:  # Левая полоса
+            options = [STRAIGHT, TURN_LEFT, UTURN]
+        elif lane == 1:  # Правая полоса
+            options = [STRAIGHT, TURN_RIGHT]
+
+    elif direction == UP:
+        if lane == 3:  # Правая полоса
+            options = [STRAIGHT, TURN_LEFT, UTURN]
+        elif lane == 2:  # Левая полоса
+            options = [STRAIGHT, TURN_RIGHT]
+
+    return options
+
+class Car:
+    # Без __dict__: машин тысячи, и каждая заметно легче
+    __slots__ = (
+        'car_id', 'x', 'y', 'direction', 'lane', 'base_road', 'speed',
+        'driver_age', 'driver_experience', 'driver_mood', 'driver_attention', 'driver_aggression',
+        'car_age', 'bad_tires', 'bad_brakes', 'engine_power',
+        'max_speed_multiplier', 'max_speed', 'accel', 'decel', 'reaction_time', 'color',
+        'turn_decision', 'turning', 'passed_stop_line',
+        'changing_lane', 'lane_change_progress', 'target_lane_temp', 'lane_change_cooldown',
+        'accident_timer', 'in_accident', 'selected', 'index_key', 'index_progress',
+    )
+
+    def __init__(self, x, y, direction, lane, base_road, profile=None, rng=random):
+        self.reset(x, y, direction, lane, base_road, profile, rng)
+
+    def reset(self, x, y, direction, lane, base_road, profile=None, rng=random):
+        # Полная переинициализация, в том числе для машины, взятой из пула.
+        # profile - готовая строка DriverProfiles; без неё водитель и машина
+        # разыгрываются здесь же из rng - потока спавна симуляции, а у машины
+        # вне симуляции - из глобального random
+        self.car_id = -1  # Номер выдаёт симуляция при добавлении в город
+        self.x = x
+        self.y = y
+        self.direction = direction
+        self.lane = lane
+        self.base_road = base_road
+        self.speed = 0.0
+
+        if profile is None:
+            self.draw_profile(rng)
+        else:
+            (self.driver_age, self.driver_experience, self.driver_mood, self.driver_attention,
+             self.driver_aggression, self.car_age, self.bad_tires, self.bad_brakes, self.engine_power,
+             self.max_speed_multiplier, self.max_speed, self.accel, self.decel, self.reaction_time,
+             self.color) = profile
+
+        # Система поворотов
+        self.turn_decision = NO_TURN
+        self.turning = False
+        self.passed_stop_line = False
+
+        # Для смены полосы
+        self.changing_lane = False
+        self.lane_change_progress = 0
+        self.target_lane_temp = lane
+        self.lane_change_cooldown = 0
+
+        # Для аварий
+        self.accident_timer = 0
+        self.in_accident = False
+
+        # Для выделения
+        self.selected = False
+
+        # Положение в индексе полос
+        self.index_key = None
+        self.index_progress = 0.0
+
+    def draw_profile(self, rng):
+        # Характеристики водителя
+        self.driver_age = rng.randint(18, 75)
+        self.driver_experience = max(1, self.driver_age - 18)
+        self.driver_mood = rng.randrange(len(MOODS))
+        self.driver_attention = self.calculate_attention(rng)
+        self.driver_aggression = rng.uniform(0.1, 1.0)
+
+        # Характеристики машины
+        self.car_age = rng.randint(0, 20)
+        self.bad_tires = rng.random() < BAD_TIRES_PERCENT / 100
+        self.bad_brakes = rng.random() < BAD_BRAKES_PERCENT / 100
+        self.engine_power = rng.uniform(0.8, 1.2)
+
+        # Манера езды
+        self.max_speed_multiplier = self.calculate_max_speed()
+        self.max_speed = MAX_SPEED * self.max_speed_multiplier
+        self.accel = 0.07 * self.engine_power
+        self.decel = 0.15 * (0.7 if self.bad_brakes else 1.0)
+        self.reaction_time = self.calculate_reaction_time()
+
+        self.color = (
+            rng.randint(180, 255),
+            rng.randint(100, 220),
+            rng.randint(100, 220)
+        )
+
+    def calculate_attention(self, rng):
+        base_attention = 1.0
+
+        if self.driver_age < YOUNG_DRIVER_AGE:
+            base_attention *= 0.8
+        elif self.driver_age > OLD_DRIVER_AGE:
+            base_attention *= 0.9
+
+        base_attention *= MOOD_ATTENTION[self.driver_mood]
+
+        base_attention *= min(1.2, 1.0 + self.driver_experience * 0.01)
+
+        rand_val = rng.random() * 100
+        if rand_val < INATTENTIVE_DRIVER_PERCENT:
+            base_attention *= 0.7
+        elif rand_val < INATTENTIVE_DRIVER_PERCENT + VERY_ATTENTIVE_DRIVER_PERCENT:
+            base_attention *= 1.2
+
+        return base_attention
+
+    def calculate_max_speed(self):
+        multiplier = 1.0
+        if self.driver_age < YOUNG_DRIVER_AGE:
+            multiplier *= 1.1
+        if self.driver_mood == ANGRY:
+            multiplier *= 1.2
+        multiplier *= (0.9 + self.driver_aggression * 0.2)
+        return multiplier
+
+    def calculate_reaction_time(self):
+        reaction = 1.0
+        if self.driver_age > OLD_DRIVER_AGE:
+            reaction *= 1.2
+        if self.driver_experience < 5:
+            reaction *= 1.1
+
+        if self.driver_mood in (TIRED, NERVOUS):
+            reaction *= 1.2
+
+        reaction /= self.driver_attention
+
+        return max(0.7, min(1.5, reaction))
+
+    def get_position(self):
+        # ИСПРАВЛЕНО: Правильное позиционирование на дороге
+        if self.direction == RIGHT:
+            offset = H_LANE_OFFSETS[self.lane]
+            return self.x, self.base_road + offset
+        elif self.direction == LEFT:
+            offset = H_LANE_OFFSETS[self.lane]
+            return self.x, self.base_road + offset
+        elif self.direction == DOWN:
+            offset = V_LANE_OFFSETS[self.lane]
+            return self.base_road + offset, self.y
+        elif self.direction == UP:
+            offset = V_LANE_OFFSETS[self.lane]
+            return self.base_road + offset, self.y
+
+    def lane_key(self):
+        return (self.base_road, self.direction, self.lane)
+
+    def progress(self):
+        # Координата вдоль направления движения: растёт по ходу машины
+        if self.direction == RIGHT:
+            return self.x
+        elif self.direction == LEFT:
+            return -self.x
+        elif self.direction == DOWN:
+            return self.y
+        else:  # up
+            return -self.y
+
+    def check_accident(self, other_car, distance, rng):
+        if self.in_accident or other_car.in_accident:
+            return False
+
+        accident_prob = 0.0
+
+        if distance < FOLLOW_DISTANCE * 0.3:
+            accident_prob = 0.01
+
+        risk_multiplier = 1.0
+
+        risk_multiplier *= (1.5 - min(self.driver_attention, other_car.driver_attention))
+
+        if self.bad_brakes or other_car.bad_brakes:
+            risk_multiplier *= 1.2
+        if self.bad_tires or other_car.bad_tires:
+            risk_multiplier *= 1.1
+
+        risk_multiplier *= (0.5 + (self.speed + other_car.speed) / (MAX_SPEED * 2))
+
+        if self.driver_experience < 3 or other_car.driver_experience < 3:
+            risk_multiplier *= 1.05
+
+        if ANGRY in (self.driver_mood, other_car.driver_mood):
+            risk_multiplier *= 1.1
+
+        final_probability = accident_prob * risk_multiplier * 0.02
+
+        return rng.accidents.random() < final_probability
+
+    def update(self, topology, lane_index, accidents, rng):
+        if self.in_accident:
+            self.accident_timer -= 1
+            if self.accident_timer <= 0:
+                self.in_accident = False
+                self.speed = self.max_speed * 0.5
+            return True
+
+        if self.turning:
+            return self.update_turn()
+
+        if self.changing_lane:
+            self.lane_change_progress += 0.1
+            if self.lane_change_progress >= 1:
+                self.lane = self.target_lane_temp
+                self.changing_lane = False
+                self.lane_change_progress = 0
+                self.lane_change_cooldown = 30
+                lane_index.relocate(self)
+            else:
+                # Плавное изменение позиции при смене полосы
+                if self.direction in (LEFT, RIGHT):
+                    start_offset = H_LANE_OFFSETS[self.lane]
+                    end_offset = H_LANE_OFFSETS[self.target_lane_temp]
+                    current_offset = start_offset + (end_offset - start_offset) * self.lane_change_progress
+                    self.y = self.base_road + current_offset
+                else:
+                    start_offset = V_LANE_OFFSETS[self.lane]
+                    end_offset = V_LANE_OFFSETS[self.target_lane_temp]
+                    current_offset = start_offset + (end_offset - start_offset) * self.lane_change_progress
+                    self.x = self.base_road + current_offset
+        else:
+            self.x, self.y = self.get_position()
+
+        if self.lane_change_cooldown > 0:
+            self.lane_change_cooldown -= 1
+
+        # Удаление машин за пределами экрана
+        if (self.x < -100 or self.x > topology.width + 100 or
+            self.y < -100 or self.y > topology.height + 100):
+            return False
+
+        # Поиск ближайшего перекрёстка
+        next_int, dist_to_int = topology.next_intersection(self)
+
+        # Проверка проезда стоп-линии
+        if next_int and not self.passed_stop_line:
+            if self.direction == RIGHT and self.x > next_int.x - STOP_LINE_DISTANCE:
+                self.passed_stop_line = True
+            elif self.direction == LEFT and self.x < next_int.x + STOP_LINE_DISTANCE:
+                self.passed_stop_line = True
+            elif self.direction == DOWN and self.y > next_int.y - STOP_LINE_DISTANCE:
+                self.passed_stop_line = True
+            elif self.direction == UP and self.y < next_int.y + STOP_LINE_DISTANCE:
+                self.passed_stop_line = True
+
+        # Поиск ближайшей машины впереди
+        lead_car, lead_dist = lane_index.lead(self)
+
+        # Проверка на аварию
+        if lead_car and lead_dist < CAR_SIZE:
+            if self.check_accident(lead_car, lead_dist, rng):
+                self.cause_accident(lead_car, "Столкновение", accidents, rng)
+                return True
+
+        # Определение состояния светофора
+        light_ok = True
+        if next_int:
+            light_ok = next_int.is_green_for(self.direction)
+
+        # Логика движения
+        should_brake = False
+        
+        # 1. Торможение из-за машины впереди
+        safe_follow_distance = FOLLOW_DISTANCE * (1.0 + (1 - self.driver_attention) * 0.5)
+        if lead_car and lead_dist < safe_follow_distance:
+            should_brake = True
+            # Попытка смены полосы
+            if (not self.changing_lane and self.lane_change_cooldown == 0 and
+                rng.behavior.random() < 0.02 * self.driver_aggression):
+                self.try_change_lane(lane_index)
+        
+        # 2. Торможение на красный свет
+        if next_int and dist_to_int < STOP_LINE_DISTANCE * 3:
+            if not light_ok and not self.passed_stop_line:
+                should_brake = True
+                if dist_to_int < 5:
+                    self.speed = 0
+        
+        # 3. Торможение из-за пробки
+        if lead_car and lead_car.speed == 0 and lead_dist < safe_follow_distance * 1.2:
+            should_brake = True
+
+        # Ускорение/торможение
+        if should_brake:
+            self.speed = max(0, self.speed - self.decel * self.reaction_time)
+        else:
+            self.speed = min(self.max_speed, self.speed + self.accel)
+
+        # Движение
+        if self.speed > 0:
+            if self.direction == RIGHT:
+                self.x += self.speed
+            elif self.direction == LEFT:
+                self.x -= self.speed
+            elif self.direction == DOWN:
+                self.y += self.speed
+            elif self.direction == UP:
+                self.y -= self.speed
+
+        # Корректировка позиции
+        if not self.turning and not self.changing_lane:
+            self.x, self.y = self.get_position()
+
+        # Решение о повороте
+        if (next_int and dist_to_int < 40 and
+            self.speed > 0.1 and light_ok and
+            self.turn_decision == NO_TURN and not self.passed_stop_line):
+            self.decide_turn(rng)
+
+        # Начало поворота
+        if (self.turn_decision and not self.turning and
+            next_int and dist_to_int < 20 and light_ok and self.speed > 0.1):
+            self.start_turn(next_int)
+            lane_index.relocate(self)
+
+        return True
+
+    def try_change_lane(self, lane_index):
+        if self.changing_lane or self.lane_change_cooldown > 0:
+            return
+
+        # Определение возможных полос для смены
+        possible_lanes = []
+        if self.direction in (RIGHT, LEFT):
+            if self.lane == 0: possible_lanes = [1]
+            elif self.lane == 1: possible_lanes = [0]
+            elif self.lane == 2: possible_lanes = [3]
+            elif self.lane == 3: possible_lanes = [2]
+        else:
+            if self.lane == 0: possible_lanes = [1]
+            elif self.lane == 1: possible_lanes = [0]
+            elif self.lane == 2: possible_lanes = [3]
+            elif self.lane == 3: possible_lanes = [2]
+
+        if not possible_lanes:
+            return
+
+        # Проверка доступности полосы
+        for new_lane in possible_lanes:
+            if lane_index.is_clear(self, new_lane, FOLLOW_DISTANCE * 2):
+                self.target_lane_temp = new_lane
+                self.changing_lane = True
+                self.lane_change_progress = 0
+                break
+
+    def cause_accident(self, other_car, reason, accidents, rng):
+        self.in_accident = True
+        other_car.in_accident = True
+        self.accident_timer = ACCIDENT_DURATION
+        other_car.accident_timer = ACCIDENT_DURATION
+        self.speed = 0
+        other_car.speed = 0
+
+        accident_x = (self.x + other_car.x) / 2
+        accident_y = (self.y + other_car.y) / 2
+        driver = (self.driver_age, self.driver_mood,
+                  self.bad_brakes or other_car.bad_brakes, self.bad_tires or other_car.bad_tires)
+        accidents.append(Accident(accident_x, accident_y, self, other_car, reason, driver,
+                                  rng.accidents.choice(SEVERITIES)))
+
+    def decide_turn(self, rng):
+        options = turn_options(self.direction, self.lane)
+
+        if rng.behavior.random() < TURN_PROBABILITY:
+            self.turn_decision = rng.behavior.choice(options)
+        else:
+            self.turn_decision = STRAIGHT
+
+    def start_turn(self, intersection):
+        if self.turn_decision == STRAIGHT:
+            self.turn_decision = NO_TURN
+            return
+
+        self.turning = True
+        self.passed_stop_line = False
+
+        # ИСПРАВЛЕНО: Упрощенный поворот - резкая смена направления
+        if self.turn_decision == TURN_LEFT:
+            if self.direction == RIGHT:
+                self.direction = UP
+                self.lane = 2  # Крайняя левая полоса
+            elif self.direction == LEFT:
+                self.direction = DOWN
+                self.lane = 0  # Крайняя левая полоса
+            elif self.direction == DOWN:
+                self.direction = RIGHT
+                self.lane = 0  # Крайняя левая полоса
+            elif self.direction == UP:
+                self.direction = LEFT
+                self.lane = 2  # Крайняя левая полоса
+
+        elif self.turn_decision == TURN_RIGHT:
+            if self.direction == RIGHT:
+                self.direction = DOWN
+                self.lane = 1  # Крайняя правая полоса
+            elif self.direction == LEFT:
+                self.direction = UP
+                self.lane = 3  # Крайняя правая полоса
+            elif self.direction == DOWN:
+                self.direction = LEFT
+                self.lane = 3  # Крайняя правая полоса
+            elif self.direction == UP:
+                self.direction = RIGHT
+                self.lane = 1  # Крайняя правая полоса
+
+        elif self.turn_decision == UTURN:
+            # ИСПРАВЛЕНО: При развороте машина перестраивается на соседнюю полосу встречного направления
+            if self.direction == RIGHT:
+                self.direction = LEFT
+                # Была полоса 0 или 1 (движение направо), после разворота - полоса 2 или 3 (движение налево)
+                self.lane = 2 if self.lane == 0 else 3
+            elif self.direction == LEFT:
+                self.direction = RIGHT
+                # Была полоса 2 или 3 (движение налево), после разворота - полоса 0 или 1 (движение направо)
+                self.lane = 0 if self.lane == 2 else 1
+            elif self.direction == DOWN:
+                self.direction = UP
+                # Была полоса 0 или 1 (движение вниз), после разворота - полоса 2 или 3 (движение вверх)
+                self.lane = 2 if self.lane == 0 else 3
+            elif self.direction == UP:
+                self.direction = DOWN
+                # Была полоса 2 или 3 (движение вверх), после разворота - полоса 0 или 1 (движение вниз)
+                self.lane = 0 if self.lane == 2 else 1
+
+        # Обновление базовой дороги
+        if self.direction in (LEFT, RIGHT):
+            self.base_road = intersection.y
+        else:
+            self.base_road = intersection.x
+
+        self.turn_decision = NO_TURN
+        self.turning = False
+
+    def update_turn(self):
+        # ИСПРАВЛЕНО: Упрощенная логика поворота
+        return True
+
+# === Сборщик мусора ===
+# Там, где разом появляются тысячи объектов без циклов (машины, пачка отрисовки),
+# сборщик мусора только зря обходил бы весь город - на это время он выключается
+@contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# === Пул машин ===
+# Уехавшие из города машины не выбрасываются, а достаются новым водителям:
+# спавн не нагружает аллокатор и сборщик мусора
+class CarPool:
+    def __init__(self):
+        self.free = []
+
+    def acquire(self, x, y, direction, lane, base_road, profile=None, rng=random):
+        if self.free:
+            car = self.free.pop()
+            car.reset(x, y, direction, lane, base_road, profile, rng)
+            return car
+        return Car(x, y, direction, lane, base_road, profile, rng)
+
+    def release(self, car):
+        self.free.append(car)
+
+# === Спавн машин ===
+def spawn_cars(sim):
+    hour = sim.current_time.hour
+    spawn_probability = TRAFFIC_INTENSITY.get(hour, 0.01)
+
+    if len(sim.cars) >= MAX_CARS_IN_CITY * 0.8:
+        spawn_probability *= 0.5
+
+    # Сначала разыгрываются въезды, потом все водители тика - одной пачкой профилей
+    # ИСПРАВЛЕНО: Правильный спавн машин только на правых полосах
+    rng = sim.random.spawn
+    entries = []
+    for y in sim.h_roads:
+        if rng.random() < spawn_probability:
+            lane = rng.choice([0, 1])  # Только правые полосы для движения направо
+            entries.append((-50, y, RIGHT, lane, y))
+        if rng.random() < spawn_probability:
+            lane = rng.choice([2, 3])  # Только левые полосы для движения налево
+            entries.append((sim.world_width + 50, y, LEFT, lane, y))
+
+    for x in sim.v_roads:
+        if rng.random() < spawn_probability:
+            lane = rng.choice([0, 1])  # Только левые полосы для движения вниз
+            entries.append((x, -50, DOWN, lane, x))
+        if rng.random() < spawn_probability:
+            lane = rng.choice([2, 3])  # Только правые полосы для движения вверх
+            entries.append((x, sim.world_height + 50, UP, lane, x))
+
+    for entry, profile in zip(entries, sim.new_profiles(len(entries))):
+        sim.add_car(sim.pool.acquire(*entry, profile, rng))
+
+# Водители и машины для движка объектов: вместо десятка вызовов random и трёх
+# calculate_* на машину draw_driver_profiles разыгрывает сразу PROFILE_BLOCK
+# профилей одним проходом NumPy, а машины забирают готовые строки. Блоки
+# разыгрывает генератор NumPy потока спавна, поэтому прогон с --seed повторяется
+PROFILE_BLOCK = 1024
+PROFILE_FIELDS = (
+    'driver_age', 'driver_experience', 'driver_mood', 'driver_attention', 'driver_aggression',
+    'car_age', 'bad_tires', 'bad_brakes', 'engine_power',
+    'max_speed_multiplier', 'max_speed', 'accel', 'decel', 'reaction_time', 'color',
+)  # Порядок - как в распаковке профиля в Car.reset
+
+class DriverProfiles:
+    def __init__(self, rng, block=PROFILE_BLOCK):
+        self.rng = rng
+        self.block = block
+        self.rows = []  # Заготовленные профили, забираются с конца
+
+    def take(self, k):
+        if len(self.rows) < k:
+            self.rows[:0] = self.draw(max(self.block, k - len(self.rows)))
+        taken = self.rows[len(self.rows) - k:]
+        del self.rows[len(self.rows) - k:]
+        return taken
+
+    def draw(self, k):
+        profile = draw_driver_profiles(self.rng, k)
+        columns = [profile[name].tolist() for name in PROFILE_FIELDS]
+        columns[-1] = list(map(tuple, columns[-1]))  # Цвет - кортеж, как в Car
+        return list(zip(*columns))
+
+def random_road_position(sim):
+    # Случайное место на случайной дороге, в полосе своего направления
+    rng = sim.random.spawn
+    road = rng.randrange(len(sim.h_roads) + len(sim.v_roads))
+    forward = rng.random() < 0.5
+    lane = rng.choice([0, 1] if forward else [2, 3])
+    if road < len(sim.h_roads):
+        y = sim.h_roads[road]
+        return rng.uniform(0, sim.world_width), y, RIGHT if forward else LEFT, lane, y
+    x = sim.v_roads[road - len(sim.h_roads)]
+    return x, rng.uniform(0, sim.world_height), DOWN if forward else UP, lane, x
+
+# === Статистика аварий ===
+def age_band(age):
+    if age < YOUNG_DRIVER_AGE:
+        return f"до {YOUNG_DRIVER_AGE}"
+    if age > OLD_DRIVER_AGE:
+        return f"старше {OLD_DRIVER_AGE}"
+    return f"{YOUNG_DRIVER_AGE}-{OLD_DRIVER_AGE}"
+
+def accident_factor_keys(accident, hour):
+    age, mood, bad_brakes, bad_tires = accident.driver
+    return (("причина", accident.reason),
+            ("тяжесть", accident.severity),
+            ("час", hour),
+            ("возраст", age_band(age)),
+            ("настроение", MOODS[mood]),
+            ("тормоза", "плохие" if bad_brakes else "норм"),
+            ("шины", "плохие" if bad_tires else "норм"))
+
+def record_accident(sim, accident):
+    sim.accidents_by_reason[accident.reason] = sim.accidents_by_reason.get(accident.reason, 0) + 1
+    factors = sim.accident_factors
+    for key in accident_factor_keys(accident, sim.current_time.hour):
+        factors[key] = factors.get(key, 0) + 1
+
+# === Замер фаз ===
+# Время каждой фазы тика копится отдельно: mark() закрывает фазу,
+# начатую с прошлой отметки. Два вызова perf_counter на фазу.
+# Последние PROFILE_WINDOW замеров хранятся для средних и перцентилей.
+PROFILE_WINDOW = 120
+STEP_PHASES = ('spawn', 'lights', 'cars', 'collisions', 'accidents')
+class PhaseTimer:
+    def __init__(self, window=PROFILE_WINDOW):
+        self.totals = {}
+        self.recent = {}
+        self.window = window
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.record(phase, now - self.last)
+        self.last = now
+
+    def record(self, phase, seconds):
+        self.totals[phase] = self.totals.get(phase, 0.0) + seconds
+        samples = self.recent.get(phase)
+        if samples is None:
+            samples = self.recent[phase] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def average(self, phase):
+        samples = self.recent.get(phase)
+        return sum(samples) / len(samples) if samples else 0.0
+
+    def percentile(self, phase, q):
+        samples = sorted(self.recent.get(phase, ()))
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def tick_time(self):
+        return sum(self.average(phase) for phase in STEP_PHASES)
+
+# === Планировка города ===
+# JSON с дорогами: либо списки h_roads/v_roads (координаты в пикселях мира) и
+# world_size, либо сетка {"grid": {"rows": R, "cols": C, "spacing": S}}, где
+# дороги идут через S пикселей. Необязательно: start_time (ISO) и time_speed.
+def load_city(path):
+    with open(path, encoding="utf-8") as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}: {e}")
+
+    layout = {}
+    try:
+        if 'grid' in config:
+            grid = config['grid']
+            spacing = grid['spacing']
+            layout['h_roads'] = [spacing * (i + 1) for i in range(grid['rows'])]
+            layout['v_roads'] = [spacing * (i + 1) for i in range(grid['cols'])]
+            layout['world_size'] = (spacing * (grid['cols'] + 1), spacing * (grid['rows'] + 1))
+        else:
+            layout['h_roads'] = [int(y) for y in config.get('h_roads', [])]
+            layout['v_roads'] = [int(x) for x in config.get('v_roads', [])]
+        if 'world_size' in config:
+            width, height = config['world_size']
+            layout['world_size'] = (int(width), int(height))
+        if 'start_time' in config:
+            layout['start_time'] = datetime.fromisoformat(config['start_time'])
+        if 'time_speed' in config:
+            layout['time_speed'] = config['time_speed']
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{path}: неверная планировка: {e!r}")
+
+    if not layout['h_roads'] or not layout['v_roads']:
+        raise ValueError(f"{path}: нужны и горизонтальные, и вертикальные дороги")
+    if 'world_size' not in layout:
+        raise ValueError(f"{path}: не задан world_size")
+    return layout
+
+# === Для окна ===
+# Движки отдают окну видимые машины и ключи их картинок, рисует их 3.py.
+# Ключ машины - цвет и направление, у машин в аварии и выбранной к ним
+# добавлено состояние
+VISIBLE_MARGIN = CAR_SIZE * 2  # Запас вокруг экрана: машина у края видна целиком
+INTERPOLATION_JUMP = CAR_SIZE  # Машина сместилась за тик дальше - скачок, а не движение
+CAR_SPRITE_KEY = attrgetter('color', 'direction')
+CAR_STATE_KEY = attrgetter('color', 'direction', 'in_accident', 'selected')
+
+def car_sprite_keys(cars):
+    keys = list(map(CAR_SPRITE_KEY, cars))
+    for i, car in enumerate(cars):
+        if car.in_accident or car.selected:
+            keys[i] = CAR_STATE_KEY(car)
+    return keys
+
+# === Симуляция ===
+# Всё состояние города и один шаг логики, без отрисовки и без pygame-окна.
+class Simulation:
+    def __init__(self, seed=None, h_roads=h_roads, v_roads=v_roads, world_size=(WIDTH, HEIGHT),
+                 start_time=START_TIME, time_speed=TIME_SPEED):
+        self.random = SimRandom(seed)
+        # Дороги по возрастанию: видимые дороги и перекрёстки ищутся бинпоиском
+        self.h_roads = sorted(h_roads)
+        self.v_roads = sorted(v_roads)
+        self.world_width, self.world_height = world_size
+        self.current_time = start_time
+        self.time_speed = time_speed  # Минут игрового времени за тик
+        self.timer = PhaseTimer()
+        self.intersections = city_intersections(self.v_roads, self.h_roads, self.random.lights)
+        self.topology = RoadTopology(self.intersections, self.world_width, self.world_height)
+        self.lane_index = LaneIndex()
+        self.grid = SpatialHash()
+        self.pool = CarPool()
+        # Без NumPy - по машине в Car.reset
+        self.profiles = DriverProfiles(self.random.generator('spawn')) if np is not None else None
+        self.cars = []
+        self.accidents = []
+        self.new_accidents = []  # Аварии последнего тика
+        self.next_id = 0
+        self.recorder = None
+        self.stats = None
+        self.telemetry = None
+        self.selected_car = None  # Флаг selected стоит только у неё
+
+        # Статистика
+        self.ticks = 0
+        self.cars_spawned = 0
+        self.accidents_by_reason = {}
+        self.accident_factors = {}  # (признак, значение) -> число аварий
+        self.throughput = {}  # (ось, координата) дороги -> машин, покинувших город по ней
+
+    def add_car(self, car):
+        # Номера растут, и self.cars всегда упорядочен по ним
+        car.car_id = self.next_id
+        self.next_id += 1
+        self.cars.append(car)
+        self.lane_index.add(car)
+        self.cars_spawned += 1
+
+    def __len__(self):
+        return len(self.cars)
+
+    def has_car(self, car):
+        return car.index_key is not None
+
+    def car_at(self, pos):
+        # Клик мышью: сетка столкновений собрана в конце тика, смотрятся только
+        # машины у самой точки, сколько бы их ни было в городе
+        x, y = pos
+        hits = [car for car in self.grid.near(x, y) if car_hit(car, x, y)]
+        return min(hits, key=lambda car: (car.x - x) ** 2 + (car.y - y) ** 2, default=None)
+
+    def select(self, car):
+        if self.selected_car:
+            self.selected_car.selected = False
+        self.selected_car = car
+        if car:
+            car.selected = True
+
+    def visible_cars(self, rect):
+        # Машины в прямоугольнике мира: только полосы дорог, пересекающих его,
+        # и в каждой - бинпоиск по продвижению, без обхода всего города
+        left, right = rect.left - VISIBLE_MARGIN, rect.right + VISIBLE_MARGIN
+        top, bottom = rect.top - VISIBLE_MARGIN, rect.bottom + VISIBLE_MARGIN
+        cars = []
+        for (base_road, direction, _), (keys, lane_cars) in self.lane_index.lanes.items():
+            if direction in (LEFT, RIGHT):
+                if not top <= base_road <= bottom:
+                    continue
+                lo, hi = (left, right) if direction == RIGHT else (-right, -left)
+            else:
+                if not left <= base_road <= right:
+                    continue
+                lo, hi = (top, bottom) if direction == DOWN else (-bottom, -top)
+            cars.extend(lane_cars[bisect.bisect_left(keys, lo):bisect.bisect_right(keys, hi)])
+        return cars
+
+    def new_profiles(self, k):
+        if self.profiles is None:
+            return [None] * k
+        return self.profiles.take(k)
+
+    def populate(self, count):
+        # Расставляет машины по дорогам сразу, как будто город уже жил. Места и
+        # профили - одной пачкой, индекс полос строится один раз в конце
+        with gc_paused():
+            if self.profiles is None:
+                positions = [random_road_position(self) for _ in range(count)]
+            else:
+                positions = zip(*(column.tolist() for column in
+                                  draw_road_positions(self.random.generator('spawn'), self, count)))
+            for position, profile in zip(positions, self.new_profiles(count)):
+                car = self.pool.acquire(*position, profile, self.random.spawn)
+                car.car_id = self.next_id
+                self.next_id += 1
+                self.cars.append(car)
+            self.cars_spawned += count
+            self.lane_index.rebuild(self.cars)
+            self.grid.rebuild(self.cars)
+
+    def position_snapshot(self, rect):
+        return {car: (car.x, car.y) for car in self.visible_cars(rect)}
+
+    def save_state(self):
+        state = common_state(self)
+        cars = self.cars
+        state['cars'] = {name: array(typecode, [getattr(car, name) for car in cars])
+                         for name, typecode in CAR_SNAPSHOT_FIELDS.items()}
+        state['cars']['color'] = array('B', [channel for car in cars for channel in car.color])
+        # Машины аварии хранятся номерами в списке; уехавшие из города - None
+        number = {car: i for i, car in enumerate(cars)}
+        state['accidents'] = [accident_state(accident, number.get(accident.car1), number.get(accident.car2))
+                              for accident in self.accidents]
+        # Заготовленные профили - часть состояния генератора: без них после загрузки приедут другие водители
+        state['profiles'] = None if self.profiles is None else list(self.profiles.rows)
+        return state
+
+    def load_state(self, state):
+        columns = state['cars']
+        cars = [Car.__new__(Car) for _ in range(len(columns['x']))]
+        for name in CAR_SNAPSHOT_FIELDS:
+            values = columns[name]
+            if name in CAR_SNAPSHOT_FLAGS:
+                values = map(bool, values)
+            # Запись через дескриптор слота в map - без разбора имени на каждую машину
+            deque(map(getattr(Car, name).__set__, cars, values), maxlen=0)
+        color = columns['color']
+        for i, car in enumerate(cars):
+            car.color = tuple(color[i * 3:i * 3 + 3])
+            car.turning = False
+        self.cars = cars
+        self.lane_index.rebuild(cars)
+        self.grid.rebuild(cars)
+        self.selected_car = next((car for car in cars if car.selected), None)
+        self.accidents = [load_accident(entry, None if car1 is None else cars[car1], None if car2 is None else cars[car2])
+                          for entry, car1, car2 in state['accidents']]
+        if self.profiles is not None:
+            self.profiles.rows = list(state.get('profiles') or [])
+        load_common_state(self, state)
+
+    def sprite_keys(self, cars):
+        return car_sprite_keys(cars)
+
+    def traffic_sample(self):
+        # Скорости по дорогам: дорога -> (сумма, число машин), и очереди: перекрёсток ->
+        # сколько машин стоит не дальше QUEUE_DISTANCE от его стоп-линии
+        speeds = {}
+        queues = {}
+        for (base_road, direction, _), (_, cars) in self.lane_index.lanes.items():
+            if not cars:
+                continue
+            road = road_key(direction, base_road)
+            total, count = speeds.get(road, (0.0, 0))
+            speeds[road] = (total + sum(map(CAR_SPEED, cars)), count + len(cars))
+            for car in cars:
+                if car.speed < QUEUE_SPEED and not car.in_accident:
+                    inter, distance = self.topology.next_intersection(car)
+                    if distance < QUEUE_DISTANCE:
+                        queues[inter.x, inter.y] = queues.get((inter.x, inter.y), 0) + 1
+        return speeds, queues
+
+    def interpolate(self, snapshot, alpha, cars):
+        # Положения машин cars между снимком прошлого тика и текущим.
+        # Машины без снимка и перескочившие (поворот, машина из пула) рисуются как есть
+        positions = []
+        for car in cars:
+            x, y = car.x, car.y
+            previous = snapshot.get(car)
+            if previous is not None:
+                px, py = previous
+                if abs(x - px) + abs(y - py) < INTERPOLATION_JUMP:
+                    x = px + (x - px) * alpha
+                    y = py + (y - py) * alpha
+            positions.append((x, y))
+        return positions
+
+    def step(self):
+        timer = self.timer
+        timer.start()
+        self.current_time += timedelta(minutes=self.time_speed)
+        spawn_cars(self)
+        self.lane_index.refresh()
+        timer.mark('spawn')
+
+        for light in self.intersections:
+            light.update()
+        timer.mark('lights')
+
+        # Уехавшие машины удаляются на месте, без построения нового списка
+        accidents_before = len(self.accidents)
+        cars = self.cars
+        alive = 0
+        for car in cars:
+            if car.update(self.topology, self.lane_index, self.accidents, self.random):
+                cars[alive] = car
+                alive += 1
+            else:
+                self.lane_index.remove(car)
+                road = road_key(car.direction, car.base_road)
+                self.throughput[road] = self.throughput.get(road, 0) + 1
+                if car is self.selected_car:
+                    # Машина уходит в пул и в этом же кадре может достаться новому водителю
+                    self.select(None)
+                self.pool.release(car)
+        del cars[alive:]
+        timer.mark('cars')
+
+        # Машину впереди в своей полосе уже проверил Car.update, здесь - все
+        # остальные касания: на перекрёстке, при проезде на красный и перестроении
+        self.grid.rebuild(cars)
+        for car, other, distance in self.grid.pairs(SIDE_IMPACT_DISTANCE):
+            if car.index_key != other.index_key and car.check_accident(other, distance, self.random):
+                car.cause_accident(other, "Боковой удар", self.accidents, self.random)
+        timer.mark('collisions')
+
+        self.new_accidents = self.accidents[accidents_before:]
+        for accident in self.new_accidents:
+            record_accident(self, accident)
+        self.accidents = [accident for accident in self.accidents if accident.update()]
+        timer.mark('accidents')
+
+        self.ticks += 1
+        if self.recorder:
+            self.recorder.record(self)
+        if self.stats:
+            self.stats.update(self)
+        if self.telemetry:
+            self.telemetry.publish(self)
+
+def road_key(direction, base_road):
+    return ('y' if direction in (LEFT, RIGHT) else 'x', base_road)
+
+def road_name(road):
+    axis, base_road = road
+    return f"{'гориз.' if axis == 'y' else 'верт.'} {axis}={base_road}"
+
+# === Движок на NumPy ===
+# Весь парк хранится в непрерывных массивах - по массиву на атрибут Car, - и шаг
+# симуляции выполняется векторными операциями сразу над всеми машинами. Правила
+# те же, что в Car.update, но соседей (машину впереди, свободную полосу) каждая
+# машина видит в состоянии на начало тика, а не по мере обновления остальных.
+KEY_STRIDE = 1e7  # Разнос ключей разных дорог и полос в одном отсортированном массиве
+
+def draw_driver_profiles(rng, k):
+    # Те же распределения, что в Car.__init__, сразу для k машин
+    age = rng.integers(18, 76, k)
+    experience = np.maximum(1, age - 18)
+    mood = rng.integers(0, len(MOODS), k)
+    angry = mood == ANGRY
+    tired_or_nervous = (mood == TIRED) | (mood == NERVOUS)
+
+    attention = np.where(age < YOUNG_DRIVER_AGE, 0.8, np.where(age > OLD_DRIVER_AGE, 0.9, 1.0))
+    attention *= np.array(MOOD_ATTENTION)[mood]
+    attention *= np.minimum(1.2, 1.0 + experience * 0.01)
+    roll = rng.random(k) * 100
+    attention *= np.where(roll < INATTENTIVE_DRIVER_PERCENT, 0.7,
+                          np.where(roll < INATTENTIVE_DRIVER_PERCENT + VERY_ATTENTIVE_DRIVER_PERCENT, 1.2, 1.0))
+    aggression = rng.uniform(0.1, 1.0, k)
+
+    car_age = rng.integers(0, 21, k)
+    bad_tires = rng.random(k) < BAD_TIRES_PERCENT / 100
+    bad_brakes = rng.random(k) < BAD_BRAKES_PERCENT / 100
+    engine_power = rng.uniform(0.8, 1.2, k)
+
+    speed_multiplier = np.where(age < YOUNG_DRIVER_AGE, 1.1, 1.0) * np.where(angry, 1.2, 1.0)
+    speed_multiplier *= 0.9 + aggression * 0.2
+
+    reaction = np.where(age > OLD_DRIVER_AGE, 1.2, 1.0) * np.where(experience < 5, 1.1, 1.0)
+    reaction *= np.where(tired_or_nervous, 1.2, 1.0)
+    reaction = np.clip(reaction / attention, 0.7, 1.5)
+
+    color = np.column_stack([
+        rng.integers(180, 256, k),
+        rng.integers(100, 221, k),
+        rng.integers(100, 221, k)
+    ])
+
+    return {
+        'driver_age': age,
+        'driver_experience': experience,
+        'driver_mood': mood,
+        'driver_attention': attention,
+        'driver_aggression': aggression,
+        'car_age': car_age,
+        'bad_tires': bad_tires,
+        'bad_brakes': bad_brakes,
+        'engine_power': engine_power,
+        'max_speed_multiplier': speed_multiplier,
+        'max_speed': MAX_SPEED * speed_multiplier,
+        'accel': 0.07 * engine_power,
+        'decel': 0.15 * np.where(bad_brakes, 0.7, 1.0),
+        'reaction_time': reaction,
+        'color': color,
+    }
+
+def draw_road_positions(rng, sim, count):
+    # То же, что random_road_position, сразу для count машин: x, y, direction, lane, base_road
+    roads = np.array(sim.h_roads + sim.v_roads)
+    road = rng.integers(0, len(roads), count)
+    horizontal = road < len(sim.h_roads)
+    forward = rng.random(count) < 0.5
+    direction = np.where(horizontal, np.where(forward, RIGHT, LEFT), np.where(forward, DOWN, UP))
+    lane = np.where(forward, 0, 2) + rng.integers(0, 2, count)
+    along = rng.random(count) * np.where(horizontal, sim.world_width, sim.world_height)
+    base_road = roads[road]
+    return np.where(horizontal, along, base_road), np.where(horizontal, base_road, along), direction, lane, base_road
+
+# Атрибуты машины и их типы в массивах движка
+CAR_FIELDS = {
+    'car_id': 'i8', 'x': 'f8', 'y': 'f8', 'direction': 'i1', 'lane': 'i1',
+    'base_road': 'f8', 'road_id': 'i4', 'speed': 'f8',
+    'driver_age': 'i2', 'driver_experience': 'i2', 'driver_mood': 'i1',
+    'driver_attention': 'f8', 'driver_aggression': 'f8',
+    'car_age': 'i1', 'bad_tires': '?', 'bad_brakes': '?',
+    'max_speed': 'f8', 'accel': 'f8', 'decel': 'f8', 'reaction_time': 'f8', 'color': 'u1',
+    'turn_decision': 'i1', 'changing_lane': '?', 'lane_change_progress': 'f8', 'target_lane': 'i1',
+    'lane_change_cooldown': 'i2', 'accident_timer': 'i2', 'in_accident': '?',
+}
+
+class NumpySimulation:
+    def __init__(self, seed=None, h_roads=h_roads, v_roads=v_roads, world_size=(WIDTH, HEIGHT),
+                 start_time=START_TIME, time_speed=TIME_SPEED):
+        self.random = SimRandom(seed)
+        # Пачки бросков движка - из генераторов NumPy своих потоков
+        self.spawn_rng = self.random.generator('spawn')
+        self.behavior_rng = self.random.generator('behavior')
+        self.accident_rng = self.random.generator('accidents')
+        self.h_roads = sorted(h_roads)
+        self.v_roads = sorted(v_roads)
+        self.world_width, self.world_height = world_size
+        self.current_time = start_time
+        self.time_speed = time_speed
+        self.timer = PhaseTimer()
+        self.intersections = city_intersections(self.v_roads, self.h_roads, self.random.lights)
+        self.topology = RoadTopology(self.intersections, self.world_width, self.world_height)
+        self.accidents = []
+        self.new_accidents = []
+        self.selected_id = None
+        self.next_id = 0
+        self.recorder = None
+        self.stats = None
+        self.telemetry = None
+        self._views = None
+        self._cells = None  # Сетка клеток из _grid
+
+        # Статистика
+        self.ticks = 0
+        self.cars_spawned = 0
+        self.accidents_by_reason = {}
+        self.accident_factors = {}  # (признак, значение) -> число аварий
+        self.throughput = {}
+
+        self._build_tables()
+        for name, dtype in CAR_FIELDS.items():
+            shape = (0, 3) if name == 'color' else 0
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+
+    def _build_tables(self):
+        # Дороги с направлением: (base_road, направление) -> номер
+        self.road_ids = {}
+        self.road_base = []
+        self.road_direction = []
+        for base_road, directions in [(y, (RIGHT, LEFT)) for y in self.h_roads] + [(x, (DOWN, UP)) for x in self.v_roads]:
+            for d in directions:
+                self.road_ids[(base_road, d)] = len(self.road_base)
+                self.road_base.append(base_road)
+                self.road_direction.append(d)
+
+        self.direction_sign = np.array([1.0, -1.0, 1.0, -1.0])
+        self.lane_offsets = np.array([H_LANE_OFFSETS, H_LANE_OFFSETS, V_LANE_OFFSETS, V_LANE_OFFSETS], dtype=float)
+        self.inter_x = np.array([inter.x for inter in self.intersections], dtype=float)
+        self.inter_y = np.array([inter.y for inter in self.intersections], dtype=float)
+
+        # Стоп-линии всех дорог одним массивом, отсортированным по (дорога, продвижение)
+        inter_number = {id(inter): i for i, inter in enumerate(self.intersections)}
+        stops = []
+        for (base_road, direction), (lines, inters) in self.topology.roads.items():
+            road = self.road_ids[(base_road, direction)]
+            for line, inter in zip(lines, inters):
+                progress = self.direction_sign[direction] * line
+                stops.append((road * KEY_STRIDE + progress, road, progress, inter_number[id(inter)]))
+        stops.sort()
+        self.stop_keys, self.stop_road, self.stop_progress, self.stop_inter = (
+            np.array(column) for column in zip(*stops))
+
+        # Дорога, на которую выезжает машина, повернув на перекрёстке в направлении d
+        self.inter_road = np.array([
+            [self.road_ids[(inter.y if d in (RIGHT, LEFT) else inter.x, d)] for d in range(4)]
+            for inter in self.intersections
+        ])
+
+        # Варианты поворота по (направление, полоса) из turn_options
+        self.option_count = np.zeros((4, 4), dtype=int)
+        self.turn_options = np.full((4, 4, 3), STRAIGHT)
+        for d in range(4):
+            for lane in range(4):
+                options = turn_options(d, lane)
+                self.option_count[d, lane] = len(options)
+                self.turn_options[d, lane, :len(options)] = options
+
+        # Результат поворота берётся из Car.start_turn, чтобы оба движка поворачивали одинаково
+        self.turn_direction = np.zeros((UTURN + 1, 4), dtype=np.int8)
+        self.turn_lane = np.zeros((UTURN + 1, 4, 4), dtype=np.int8)
+        for decision in range(UTURN + 1):
+            for d in range(4):
+                for lane in range(4):
+                    car = Car.__new__(Car)
+                    car.direction, car.lane, car.turn_decision = d, lane, decision
+                    if decision not in (NO_TURN, STRAIGHT):
+                        car.start_turn(self.intersections[0])
+                    self.turn_direction[decision, d] = car.direction
+                    self.turn_lane[decision, d, lane] = car.lane
+
+        # Точки появления машин - как в spawn_cars
+        spawn_points = []
+        for y in self.h_roads:
+            spawn_points.append((-50, y, RIGHT, 0, y))
+            spawn_points.append((self.world_width + 50, y, LEFT, 2, y))
+        for x in self.v_roads:
+            spawn_points.append((x, -50, DOWN, 0, x))
+            spawn_points.append((x, self.world_height + 50, UP, 2, x))
+        self.spawn_x, self.spawn_y, self.spawn_direction, self.spawn_lane, self.spawn_base = (
+            np.array(column) for column in zip(*spawn_points))
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def cars(self):
+        # Объекты-представления для отрисовки и выбора мышью, по одному на машину
+        if self._views is None:
+            self._views = [CarView(self, i) for i in range(len(self.x))]
+        return self._views
+
+    def has_car(self, view):
+        i = np.searchsorted(self.car_id, view.car_id)
+        return i < len(self.car_id) and self.car_id[i] == view.car_id
+
+    def car_at(self, pos):
+        # Клик мышью: клетка точки и восемь соседних в сетке столкновений конца
+        # тика, как SpatialHash.near у движка объектов - без обхода всего города
+        if not len(self):
+            return None
+        x, y = pos
+        order, sorted_cells, x0, y0, rows = self._grid()
+        cx, cy = math.floor(x / CAR_SIZE) - x0, math.floor(y / CAR_SIZE) - y0
+        if not -1 <= cy < rows:
+            return None
+        cells = np.array([(cx + dx) * rows + cy + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+        lo = np.searchsorted(sorted_cells, cells, side='left')
+        hi = np.searchsorted(sorted_cells, cells, side='right')
+        near = np.concatenate([order[a:b] for a, b in zip(lo.tolist(), hi.tolist())])
+        dx = np.abs(self.x[near] - x)
+        dy = np.abs(self.y[near] - y)
+        horizontal = (self.direction[near] == LEFT) | (self.direction[near] == RIGHT)
+        half_x = np.where(horizontal, CAR_SIZE / 2, CAR_SIZE / 4)
+        half_y = np.where(horizontal, CAR_SIZE / 4, CAR_SIZE / 2)
+        hits = np.flatnonzero((dx <= half_x) & (dy <= half_y))
+        if not len(hits):
+            return None
+        return CarView(self, int(near[hits[np.argmin(dx[hits] ** 2 + dy[hits] ** 2)]]))
+
+    def select(self, view):
+        self.selected_id = None if view is None else view.car_id
+
+    def add_cars(self, profile, x, y, direction, lane, base_road):
+        k = len(x)
+        direction = np.asarray(direction)
+        base_road = np.asarray(base_road)
+        new = dict(profile)
+        new.update(
+            car_id=np.arange(self.next_id, self.next_id + k),
+            x=x, y=y, direction=direction, lane=lane, base_road=base_road,
+            road_id=[self.road_ids[(b, d)] for b, d in zip(base_road.tolist(), direction.tolist())],
+            speed=np.zeros(k),
+            turn_decision=np.full(k, NO_TURN),
+            changing_lane=np.zeros(k, dtype=bool),
+            lane_change_progress=np.zeros(k),
+            target_lane=lane,
+            lane_change_cooldown=np.zeros(k),
+            accident_timer=np.zeros(k),
+            in_accident=np.zeros(k, dtype=bool),
+        )
+        for name, dtype in CAR_FIELDS.items():
+            setattr(self, name, np.concatenate([getattr(self, name), np.asarray(new[name], dtype=dtype)]))
+
+        self.next_id += k
+        self.cars_spawned += k
+        self._views = None
+
+    def populate(self, count):
+        # Расставляет машины по дорогам сразу, как будто город уже жил
+        x, y, direction, lane, base_road = draw_road_positions(self.spawn_rng, self, count)
+        self.add_cars(draw_driver_profiles(self.spawn_rng, count), x, y, direction, lane, base_road)
+
+    def visible_cars(self, rect):
+        visible = np.flatnonzero((self.x >= rect.left - VISIBLE_MARGIN) & (self.x <= rect.right + VISIBLE_MARGIN) &
+                                 (self.y >= rect.top - VISIBLE_MARGIN) & (self.y <= rect.bottom + VISIBLE_MARGIN))
+        return [CarView(self, i) for i in visible.tolist()]
+
+    def position_snapshot(self, rect):
+        return self.car_id.copy(), self.x.copy(), self.y.copy()
+
+    def save_state(self):
+        state = common_state(self)
+        state['cars'] = {name: getattr(self, name) for name in CAR_FIELDS}
+        state['accidents'] = [accident_state(accident, accident.car1, accident.car2) for accident in self.accidents]
+        state['selected_id'] = self.selected_id
+        return state
+
+    def load_state(self, state):
+        for name, dtype in CAR_FIELDS.items():
+            setattr(self, name, np.asarray(state['cars'][name], dtype=dtype))
+        self.accidents = [load_accident(entry, car1, car2) for entry, car1, car2 in state['accidents']]
+        self.selected_id = state['selected_id']
+        self._views = None
+        load_common_state(self, state)
+
+    def sprite_keys(self, cars):
+        # Те же ключи, что у car_sprite_keys, но столбцами, без обращения к каждой машине
+        index = np.fromiter((car.index() for car in cars), dtype=int, count=len(cars))
+        colors = self.color[index].tolist()
+        keys = list(zip(map(tuple, colors), self.direction[index].tolist()))
+        in_accident = self.in_accident[index]
+        selected = self.car_id[index] == self.selected_id
+        for i in np.flatnonzero(in_accident | selected).tolist():
+            keys[i] += (bool(in_accident[i]), bool(selected[i]))
+        return keys
+
+    def traffic_sample(self):
+        # То же, что Simulation.traffic_sample, по массивам
+        roads = len(self.road_base)
+        totals = np.bincount(self.road_id, weights=self.speed, minlength=roads).tolist()
+        counts = np.bincount(self.road_id, minlength=roads).tolist()
+        speeds = {}
+        for road in range(roads):
+            if counts[road]:
+                key = road_key(self.road_direction[road], self.road_base[road])
+                total, count = speeds.get(key, (0.0, 0))
+                speeds[key] = (total + totals[road], count + counts[road])
+
+        progress = self.direction_sign[self.direction] * np.where(self.direction < DOWN, self.x, self.y)
+        _, dist_to_int, next_int = self._next_stop(progress)
+        waiting = (self.speed < QUEUE_SPEED) & ~self.in_accident & (dist_to_int < QUEUE_DISTANCE)
+        inters, waiting_counts = np.unique(next_int[waiting], return_counts=True)
+        queues = {(self.intersections[i].x, self.intersections[i].y): count
+                  for i, count in zip(inters.tolist(), waiting_counts.tolist())}
+        return speeds, queues
+
+    def interpolate(self, snapshot, alpha, cars):
+        # Номера машин отсортированы, поэтому прошлое положение находится бинпоиском
+        ids, px, py = snapshot
+        index = np.fromiter((car.index() for car in cars), dtype=int, count=len(cars))
+        x, y, car_id = self.x[index], self.y[index], self.car_id[index]
+        if not len(ids):
+            return list(zip(x.tolist(), y.tolist()))
+        i = np.minimum(np.searchsorted(ids, car_id), len(ids) - 1)
+        px, py = px[i], py[i]
+        smooth = (ids[i] == car_id) & (np.abs(x - px) + np.abs(y - py) < INTERPOLATION_JUMP)
+        x = np.where(smooth, px + (x - px) * alpha, x)
+        y = np.where(smooth, py + (y - py) * alpha, y)
+        return list(zip(x.tolist(), y.tolist()))
+
+    def _spawn(self):
+        spawn_probability = TRAFFIC_INTENSITY.get(self.current_time.hour, 0.01)
+        if len(self) >= MAX_CARS_IN_CITY * 0.8:
+            spawn_probability *= 0.5
+
+        hit = self.spawn_rng.random(len(self.spawn_x)) < spawn_probability
+        k = int(hit.sum())
+        if k:
+            lane = self.spawn_lane[hit] + self.spawn_rng.integers(0, 2, k)
+            self.add_cars(draw_driver_profiles(self.spawn_rng, k), self.spawn_x[hit], self.spawn_y[hit],
+                          self.spawn_direction[hit], lane, self.spawn_base[hit])
+
+    def step(self):
+        timer = self.timer
+        timer.start()
+        self.current_time += timedelta(minutes=self.time_speed)
+        self._spawn()
+        timer.mark('spawn')
+
+        for light in self.intersections:
+            light.update()
+        horizontal_green = np.fromiter((inter.horizontal_green for inter in self.intersections),
+                                       dtype=bool, count=len(self.intersections))
+        timer.mark('lights')
+
+        accidents_before = len(self.accidents)
+        if len(self):
+            self._remove(self._update_cars(horizontal_green))
+        timer.mark('cars')
+
+        if len(self):
+            self._side_impacts()
+        timer.mark('collisions')
+
+        self.new_accidents = self.accidents[accidents_before:]
+        for accident in self.new_accidents:
+            record_accident(self, accident)
+        self.accidents = [accident for accident in self.accidents if accident.update()]
+        timer.mark('accidents')
+
+        self.ticks += 1
+        self._views = None
+        if self.recorder:
+            self.recorder.record(self)
+        if self.stats:
+            self.stats.update(self)
+        if self.telemetry:
+            self.telemetry.publish(self)
+
+    def _next_stop(self, progress):
+        # Ближайший перекрёсток: первая стоп-линия своей дороги впереди по ходу
+        i = np.searchsorted(self.stop_keys, self.road_id * KEY_STRIDE + progress, side='right')
+        inside = i < len(self.stop_keys)
+        i = np.minimum(i, len(self.stop_keys) - 1)
+        has_next = inside & (self.stop_road[i] == self.road_id)
+        return has_next, np.where(has_next, self.stop_progress[i] - progress, np.inf), self.stop_inter[i]
+
+    def _update_cars(self, horizontal_green):
+        n = len(self)
+        rng = self.behavior_rng
+        self._cells = None  # Машины сдвигаются на месте, в тех же массивах
+
+        # Машины в аварии только ждут окончания таймера
+        waiting = self.in_accident.copy()
+        self.accident_timer[waiting] -= 1
+        freed = waiting & (self.accident_timer <= 0)
+        self.in_accident[freed] = False
+        self.speed[freed] = self.max_speed[freed] * 0.5
+        active = ~waiting
+
+        # Смена полосы
+        horizontal = self.direction < DOWN
+        changing = active & self.changing_lane
+        self.lane_change_progress[changing] += 0.1
+        finished = changing & (self.lane_change_progress >= 1)
+        self.lane[finished] = self.target_lane[finished]
+        self.changing_lane[finished] = False
+        self.lane_change_progress[finished] = 0
+        self.lane_change_cooldown[finished] = 30
+
+        offset = self.lane_offsets[self.direction, self.lane]
+        target_offset = self.lane_offsets[self.direction, self.target_lane]
+        offset = np.where(changing & ~finished, offset + (target_offset - offset) * self.lane_change_progress, offset)
+        lateral = self.base_road + offset
+        self.y = np.where(active & horizontal, lateral, self.y)
+        self.x = np.where(active & ~horizontal, lateral, self.x)
+
+        cooling = active & (self.lane_change_cooldown > 0)
+        self.lane_change_cooldown[cooling] -= 1
+
+        # Удаление машин за пределами экрана
+        gone = active & ((self.x < -100) | (self.x > self.world_width + 100) |
+                         (self.y < -100) | (self.y > self.world_height + 100))
+        live = active & ~gone
+
+        sign = self.direction_sign[self.direction]
+        progress = sign * np.where(horizontal, self.x, self.y)
+
+        has_next, dist_to_int, next_int = self._next_stop(progress)
+
+        # Машина впереди: следующая по продвижению в той же полосе той же дороги
+        lane_key = self.road_id * 4 + self.lane
+        key = lane_key * KEY_STRIDE + progress
+        candidates = np.flatnonzero(~self.in_accident & ~gone)
+        order = candidates[np.argsort(key[candidates], kind='stable')]
+        sorted_keys = key[order]
+        j = np.searchsorted(sorted_keys, key, side='right')
+        if len(order):
+            lead = order[np.minimum(j, len(order) - 1)]
+            has_lead = (j < len(order)) & (lane_key[lead] == lane_key)
+        else:
+            lead = np.zeros(n, dtype=int)
+            has_lead = np.zeros(n, dtype=bool)
+        lead_dist = np.where(has_lead, progress[lead] - progress, np.inf)
+
+        # Проверка на аварию
+        close = np.flatnonzero(live & has_lead & (lead_dist < CAR_SIZE))
+        if len(close):
+            self._check_accidents(close, lead[close], lead_dist[close], "Столкновение")
+        moving = live & ~self.in_accident
+
+        # Определение состояния светофора
+        green = horizontal_green[next_int]
+        light_ok = ~has_next | np.where(horizontal, green, ~green)
+
+        # 1. Торможение из-за машины впереди
+        lead_speed = self.speed[lead]
+        safe_follow_distance = FOLLOW_DISTANCE * (1.0 + (1 - self.driver_attention) * 0.5)
+        should_brake = has_lead & (lead_dist < safe_follow_distance)
+        attempt = np.flatnonzero(moving & should_brake & ~self.changing_lane & (self.lane_change_cooldown == 0))
+        attempt = attempt[rng.random(len(attempt)) < 0.02 * self.driver_aggression[attempt]]
+        if len(attempt):
+            self._try_change_lane(attempt, sorted_keys, progress)
+
+        # 2. Торможение на красный свет
+        red_ahead = has_next & (dist_to_int < STOP_LINE_DISTANCE * 3) & ~light_ok
+        should_brake |= red_ahead
+        self.speed[moving & red_ahead & (dist_to_int < 5)] = 0
+
+        # 3. Торможение из-за пробки
+        should_brake |= has_lead & (lead_speed == 0) & (lead_dist < safe_follow_distance * 1.2)
+
+        # Ускорение/торможение и движение
+        new_speed = np.where(should_brake,
+                             np.maximum(0, self.speed - self.decel * self.reaction_time),
+                             np.minimum(self.max_speed, self.speed + self.accel))
+        self.speed = np.where(moving, new_speed, self.speed)
+        shift = np.where(moving, self.speed, 0.0) * sign
+        self.x += np.where(horizontal, shift, 0.0)
+        self.y += np.where(horizontal, 0.0, shift)
+
+        # Решение о повороте
+        approaching = moving & has_next & light_ok & (self.speed > 0.1)
+        deciding = np.flatnonzero(approaching & (dist_to_int < 40) & (self.turn_decision == NO_TURN))
+        if len(deciding):
+            d = self.direction[deciding]
+            lane = self.lane[deciding]
+            pick = (rng.random(len(deciding)) * self.option_count[d, lane]).astype(int)
+            choice = self.turn_options[d, lane, pick]
+            self.turn_decision[deciding] = np.where(rng.random(len(deciding)) < TURN_PROBABILITY, choice, STRAIGHT)
+
+        # Начало поворота
+        turning = np.flatnonzero(approaching & (dist_to_int < 20) & (self.turn_decision != NO_TURN))
+        if len(turning):
+            self._turn(turning, next_int[turning])
+
+        return gone
+
+    def _check_accidents(self, cars, leads, distance, reason):
+        risk = 1.5 - np.minimum(self.driver_attention[cars], self.driver_attention[leads])
+        risk *= np.where(self.bad_brakes[cars] | self.bad_brakes[leads], 1.2, 1.0)
+        risk *= np.where(self.bad_tires[cars] | self.bad_tires[leads], 1.1, 1.0)
+        risk *= 0.5 + (self.speed[cars] + self.speed[leads]) / (MAX_SPEED * 2)
+        risk *= np.where((self.driver_experience[cars] < 3) | (self.driver_experience[leads] < 3), 1.05, 1.0)
+        risk *= np.where((self.driver_mood[cars] == ANGRY) | (self.driver_mood[leads] == ANGRY), 1.1, 1.0)
+        probability = np.where(distance < FOLLOW_DISTANCE * 0.3, 0.01, 0.0) * risk * 0.02
+
+        hit = self.accident_rng.random(len(cars)) < probability
+        # Аварии редки, поэтому разбираются по одной: машина не попадает в две аварии за тик
+        for car, other in zip(cars[hit].tolist(), leads[hit].tolist()):
+            if not self.in_accident[car] and not self.in_accident[other]:
+                self._cause_accident(car, other, reason)
+
+    def _grid(self):
+        # Та же сетка, что SpatialHash, но клетки - числовые ключи: машины
+        # сортируются по клетке, и соседи каждой клетки находятся бинпоиском.
+        # Сетка конца тика остаётся для car_at, пока массивы машин те же
+        if self._cells is None or self._cells[0] is not self.x:
+            cx = np.floor(self.x / CAR_SIZE).astype(np.int64)
+            cy = np.floor(self.y / CAR_SIZE).astype(np.int64)
+            x0, y0 = int(cx.min()), int(cy.min())
+            rows = int(cy.max()) - y0 + 2  # Запас в одну строку, чтобы соседние ключи не заходили на другой столбец
+            cell = (cx - x0) * rows + (cy - y0)
+            order = np.argsort(cell, kind='stable')
+            self._cells = (self.x, order, cell[order], x0, y0, rows)
+        return self._cells[1:]
+
+    def _side_impacts(self):
+        order, sorted_cells, _, _, rows = self._grid()
+
+        firsts, seconds = [], []
+        for dx, dy in ((0, 0),) + HALF_NEIGHBOURS:
+            # Искомые ключи идут по возрастанию, и бинпоиск почти не промахивается мимо кэша
+            neighbour = sorted_cells + (dx * rows + dy)
+            lo = np.searchsorted(sorted_cells, neighbour, side='left')
+            count = np.searchsorted(sorted_cells, neighbour, side='right') - lo
+            total = int(count.sum())
+            if not total:
+                continue
+            # Все машины соседней клетки для каждой машины, одним плоским массивом
+            starts = np.repeat(lo - (np.cumsum(count) - count), count)
+            first = np.repeat(order, count)
+            second = order[starts + np.arange(total)]
+            if dx == 0 and dy == 0:
+                unique = first < second
+                first, second = first[unique], second[unique]
+            firsts.append(first)
+            seconds.append(second)
+        if not firsts:
+            return
+        first = np.concatenate(firsts)
+        second = np.concatenate(seconds)
+
+        distance = np.hypot(self.x[first] - self.x[second], self.y[first] - self.y[second])
+        lane_key = self.road_id * 4 + self.lane
+        near = ((distance < SIDE_IMPACT_DISTANCE) & (lane_key[first] != lane_key[second]) &
+                ~self.in_accident[first] & ~self.in_accident[second])
+        if near.any():
+            self._check_accidents(first[near], second[near], distance[near], "Боковой удар")
+
+    def _cause_accident(self, car, other, reason):
+        for i in (car, other):
+            self.in_accident[i] = True
+            self.accident_timer[i] = ACCIDENT_DURATION
+            self.speed[i] = 0
+        accident_x = (self.x[car] + self.x[other]) / 2
+        accident_y = (self.y[car] + self.y[other]) / 2
+        driver = (int(self.driver_age[car]), int(self.driver_mood[car]),
+                  bool(self.bad_brakes[car] or self.bad_brakes[other]), bool(self.bad_tires[car] or self.bad_tires[other]))
+        self.accidents.append(Accident(accident_x, accident_y, int(self.car_id[car]), int(self.car_id[other]), reason, driver,
+                                       self.random.accidents.choice(SEVERITIES)))
+
+    def _try_change_lane(self, cars, sorted_keys, progress):
+        target = self.lane[cars] ^ 1
+        key = (self.road_id[cars] * 4 + target) * KEY_STRIDE + progress[cars]
+        gap = FOLLOW_DISTANCE * 2
+        lo = np.searchsorted(sorted_keys, key - gap, side='right')
+        hi = np.searchsorted(sorted_keys, key + gap, side='left')
+        clear = hi <= lo
+        cars = cars[clear]
+        self.target_lane[cars] = target[clear]
+        self.changing_lane[cars] = True
+        self.lane_change_progress[cars] = 0
+
+    def _turn(self, cars, inters):
+        decision = self.turn_decision[cars]
+        direction = self.direction[cars]
+        self.turn_decision[cars] = NO_TURN
+        turned = decision != STRAIGHT
+        cars, inters, decision, direction = cars[turned], inters[turned], decision[turned], direction[turned]
+
+        new_direction = self.turn_direction[decision, direction]
+        self.lane[cars] = self.turn_lane[decision, direction, self.lane[cars]]
+        self.direction[cars] = new_direction
+        self.base_road[cars] = np.where(new_direction < DOWN, self.inter_y[inters], self.inter_x[inters])
+        self.road_id[cars] = self.inter_road[inters, new_direction]
+
+    def _remove(self, gone):
+        if not gone.any():
+            return
+        roads, counts = np.unique(self.road_id[gone], return_counts=True)
+        for road, count in zip(roads.tolist(), counts.tolist()):
+            key = road_key(self.road_direction[road], self.road_base[road])
+            self.throughput[key] = self.throughput.get(key, 0) + count
+
+        keep = ~gone
+        for name in CAR_FIELDS:
+            setattr(self, name, getattr(self, name)[keep])
+
+def car_view_field(name, convert):
+    return property(lambda view: convert(getattr(view.sim, name)[view.index()]))
+
+class CarView:
+    # Машина NumPy-движка в виде объекта с атрибутами Car, для отрисовки и окна информации
+    __slots__ = ('sim', 'car_id', '_i', '_ids')
+
+    def __init__(self, sim, i):
+        self.sim = sim
+        self.car_id = int(sim.car_id[i])
+        self._i = i
+        self._ids = sim.car_id
+
+    def index(self):
+        # Массивы уплотняются после шага, а у движка по районам ещё и собираются
+        # заново под экран - тогда массив номеров новый, и машина ищется по номеру
+        if self._ids is not self.sim.car_id:
+            self._i = int(np.searchsorted(self.sim.car_id, self.car_id))
+            self._ids = self.sim.car_id
+        return self._i
+
+    x = car_view_field('x', float)
+    y = car_view_field('y', float)
+    speed = car_view_field('speed', float)
+    lane = car_view_field('lane', int)
+    direction = car_view_field('direction', int)
+    in_accident = car_view_field('in_accident', bool)
+    color = car_view_field('color', lambda color: tuple(color.tolist()))
+    driver_age = car_view_field('driver_age', int)
+    driver_experience = car_view_field('driver_experience', int)
+    driver_mood = car_view_field('driver_mood', int)
+    car_age = car_view_field('car_age', int)
+    bad_tires = car_view_field('bad_tires', bool)
+    bad_brakes = car_view_field('bad_brakes', bool)
+
+    @property
+    def selected(self):
+        return self.sim.selected_id == self.car_id
+
+# === Движок по районам ===
+# Большой город делится на прямоугольные районы, и каждый район шагает движком
+# NumPy в своём процессе - один поток Python больше не потолок. Границы районов
+# проходят посередине между дорогами. Машины района после тика лежат в его
+# общей памяти (multiprocessing.shared_memory): оттуда соседи забирают въехавшие
+# к ним машины и копии машин у своей границы - призраков. Призраки нужны только
+# для поиска машины впереди, свободной полосы и столкновений у границы, двигает
+# их свой район. Въезды, светофоры и статистика - в основном процессе, а окно
+# читает из общей памяти только районы, попавшие на экран.
+GHOST_MARGIN = FOLLOW_DISTANCE * 3  # Дальше машина впереди и соседняя полоса ни на что не влияют
+REGION_CAPACITY = 1 << 17  # Машин в районе; память выделяется по мере записи
+
+def region_edges(roads, size, parts):
+    # Границы районов по одной оси: промежутки между соседними дорогами,
+    # ближайшие к равным долям size
+    gaps = [(a + b) / 2 for a, b in zip(roads, roads[1:])]
+    edges = sorted({min(gaps, key=lambda gap: abs(gap - size * k / parts)) for k in range(1, parts)} if gaps else ())
+    if len(edges) != parts - 1:
+        raise ValueError(f"{parts} районов по оси, а промежутков между дорогами {len(gaps)}")
+    return edges
+
+class RegionGrid:
+    # Районы - столбцы между x_edges и строки между y_edges; крайние районы
+    # тянутся за край мира, туда, где появляются и исчезают машины
+    def __init__(self, x_edges, y_edges):
+        self.x_edges = x_edges
+        self.y_edges = y_edges
+        self.rows = len(y_edges) + 1
+        self.count = (len(x_edges) + 1) * self.rows
+        self.x_cuts = np.array(x_edges, dtype=float)
+        self.y_cuts = np.array(y_edges, dtype=float)
+
+    def region_of(self, x, y):
+        return np.searchsorted(self.x_cuts, x, side='right') * self.rows + np.searchsorted(self.y_cuts, y, side='right')
+
+    def bounds(self, region):
+        column, row = divmod(region, self.rows)
+        xs = [-math.inf] + self.x_edges + [math.inf]
+        ys = [-math.inf] + self.y_edges + [math.inf]
+        return xs[column], ys[row], xs[column + 1], ys[row + 1]
+
+    def near(self, region, x, y, margin):
+        left, top, right, bottom = self.bounds(region)
+        return (x >= left - margin) & (x < right + margin) & (y >= top - margin) & (y < bottom + margin)
+
+    def overlapping(self, left, top, right, bottom):
+        regions = []
+        for region in range(self.count):
+            r_left, r_top, r_right, r_bottom = self.bounds(region)
+            if r_left <= right and left < r_right and r_top <= bottom and top < r_bottom:
+                regions.append(region)
+        return regions
+
+    def neighbours(self, region):
+        left, top, right, bottom = self.bounds(region)
+        return [other for other in self.overlapping(left - GHOST_MARGIN, top - GHOST_MARGIN,
+                                                    right + GHOST_MARGIN, bottom + GHOST_MARGIN)
+                if other != region]
+
+def car_row_dtype():
+    # Машина одной строкой: те же поля и типы, что у массивов движка NumPy
+    return np.dtype([(name, dtype, (3,)) if name == 'color' else (name, dtype) for name, dtype in CAR_FIELDS.items()])
+
+def car_rows(sim):
+    rows = np.empty(len(sim.x), dtype=car_row_dtype())
+    for name in CAR_FIELDS:
+        rows[name] = getattr(sim, name)
+    return rows
+
+def row_bytes(rows):
+    # Те же строки как сырые байты: выборка по маске и копия так на порядок
+    # быстрее, чем у структурного массива, который переносит поле за полем
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize)))
+
+def join_rows(parts):
+    rows = np.empty(sum(map(len, parts)), dtype=car_row_dtype())
+    raw = row_bytes(rows)
+    start = 0
+    for part in parts:
+        raw[start:start + len(part)] = row_bytes(part)
+        start += len(part)
+    return rows
+
+def set_car_rows(sim, rows):
+    # rows - своя копия, не общая память: её перепишет следующий тик
+    for name in CAR_FIELDS:
+        setattr(sim, name, np.ascontiguousarray(rows[name]))
+    sim._views = None
+
+class RegionBuffer:
+    # Общая память района: [машин, из них у границы, разбитых призраков], затем
+    # машины района после тика - сначала те, что у границы или уже за ней, - и
+    # номера чужих машин, попавших у него в аварию. Соседи читают только начало
+    def __init__(self, capacity, name=None):
+        from multiprocessing import shared_memory  # Только для движка по районам: модуль грузится долго
+        dtype = car_row_dtype()
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=24 + capacity * (dtype.itemsize + 8))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.header = np.ndarray(3, dtype='i8', buffer=self.shm.buf)
+        self.rows = np.ndarray(capacity, dtype=dtype, buffer=self.shm.buf, offset=24)
+        self.hits = np.ndarray(capacity, dtype='i8', buffer=self.shm.buf, offset=24 + capacity * dtype.itemsize)
+
+    def cars(self):
+        return self.rows[:self.header[0]]
+
+    def border(self):
+        return self.rows[:self.header[1]]
+
+    def crashed(self):
+        return self.hits[:self.header[2]]
+
+    def write(self, sim, border, hits):
+        n = len(sim.x)
+        if n > len(self.rows):
+            raise ValueError(f"в районе {n} машин, а места в общей памяти на {len(self.rows)}")
+        rows = self.rows[:n]
+        for name in CAR_FIELDS:
+            rows[name] = getattr(sim, name)
+        self.hits[:len(hits)] = hits
+        self.header[:] = n, border, len(hits)
+
+    def close(self, unlink=False):
+        # Массивы держат память открытой: сначала они, потом сам блок
+        self.header = self.rows = self.hits = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+class RegionSimulation(NumpySimulation):
+    # Движок одного района в процессе-работнике. Въезды и светофоры приходят из
+    # основного процесса, машины соседей - из их общей памяти
+    def __init__(self, region, grid, seed, **layout):
+        # Свои потоки поведения и аварий у каждого района, от общего зерна
+        super().__init__(f"{seed}/район {region}", **layout)
+        self.region = region
+        self.grid = grid
+        self.neighbours = grid.neighbours(region)
+        self.ghosts = np.zeros(0, dtype=car_row_dtype())
+        self.is_ghost = np.zeros(0, dtype=bool)
+
+    def _append(self, rows):
+        for name in CAR_FIELDS:
+            setattr(self, name, np.concatenate([getattr(self, name), rows[name]]))
+
+    def _keep(self, mask):
+        for name in CAR_FIELDS:
+            setattr(self, name, getattr(self, name)[mask])
+
+    def add(self, buffers, rows):
+        self._append(rows)
+        self._publish(buffers, ())
+        return len(self)
+
+    def _publish(self, buffers, hits):
+        # Машины у границы - вперёд: только их смотрят соседи при обмене
+        inner = self.grid.near(self.region, self.x, self.y, -GHOST_MARGIN)
+        self._keep(np.argsort(inner, kind='stable'))
+        buffers[self.region].write(self, int(np.count_nonzero(~inner)), hits)
+
+    def advance(self, buffers, horizontal_green, arrivals):
+        # Тик района: свои машины и новые с въездов, рядом призраки соседей
+        self._append(arrivals)
+        owned = len(self)
+        self._append(self.ghosts)
+        self.is_ghost = np.arange(len(self)) >= owned
+
+        if len(self):
+            gone = self._update_cars(horizontal_green) & ~self.is_ghost  # Призраки уезжают у себя
+            self._remove(gone)
+            self.is_ghost = self.is_ghost[~gone]
+        if len(self):
+            self._side_impacts()
+
+        # Призраки, разбитые в этом тике: их районы узнают об аварии при обмене
+        crashed = self.is_ghost & self.in_accident & (self.accident_timer == ACCIDENT_DURATION)
+        hits = self.car_id[crashed]
+        self._keep(~self.is_ghost)
+        self.is_ghost = np.zeros(len(self), dtype=bool)
+        self._publish(buffers, hits)
+
+        accidents, self.accidents = self.accidents, []
+        throughput, self.throughput = self.throughput, {}
+        return accidents, throughput
+
+    def exchange(self, buffers):
+        # После тика всех районов: свои машины - по положению, из своей общей
+        # памяти и у границ соседей, призраки - чужие машины не дальше GHOST_MARGIN
+        own = buffers[self.region]
+        owned, ghosts = [own.cars()[len(own.border()):]], []
+        for region in [self.region] + self.neighbours:
+            cars = buffers[region].border()
+            x, y = cars['x'], cars['y']
+            mine = self.grid.region_of(x, y) == self.region
+            owned.append(row_bytes(cars)[mine])
+            ghosts.append(row_bytes(cars)[~mine & self.grid.near(self.region, x, y, GHOST_MARGIN)])
+        set_car_rows(self, join_rows(owned))
+        self.ghosts = join_rows(ghosts)
+
+        crashed = np.concatenate([buffers[region].crashed() for region in self.neighbours] + [np.zeros(0, dtype='i8')])
+        hit = np.isin(self.car_id, crashed) & ~self.in_accident
+        self.in_accident[hit] = True
+        self.accident_timer[hit] = ACCIDENT_DURATION
+        self.speed[hit] = 0
+        return len(self)
+
+    def _check_accidents(self, cars, leads, distance, reason):
+        # Пару у границы видят оба района; решает район машины с меньшим номером,
+        # чтобы авария не разыгрывалась дважды
+        owner = np.where(self.car_id[cars] < self.car_id[leads], cars, leads)
+        mine = ~self.is_ghost[owner]
+        super()._check_accidents(cars[mine], leads[mine], distance[mine], reason)
+
+def region_worker(conn, region, grid, seed, layout, names, capacity):
+    sim = RegionSimulation(region, grid, seed, **layout)
+    buffers = [RegionBuffer(capacity, name) for name in names]
+    commands = {'add': sim.add, 'advance': sim.advance, 'exchange': sim.exchange}
+    try:
+        while True:
+            command, *args = conn.recv()
+            if command == 'close':
+                break
+            conn.send(commands[command](buffers, *args))
+    finally:
+        for buffer in buffers:
+            buffer.close()
+
+class ShardedSimulation(NumpySimulation):
+    # Основной процесс: въезды, светофоры, статистика и окно. Собственные массивы
+    # NumPy-движка здесь - только собранные из районов машины: под экран, а для
+    # записи, телеметрии, снимка и выборки статистики - все
+    def __init__(self, seed=None, h_roads=h_roads, v_roads=v_roads, world_size=(WIDTH, HEIGHT),
+                 start_time=START_TIME, time_speed=TIME_SPEED, regions=(2, 2)):
+        if seed is None:
+            seed = random.getrandbits(64)  # Районы засеваются от одного зерна
+        super().__init__(seed, h_roads, v_roads, world_size, start_time, time_speed)
+        columns, rows = regions
+        self.grid = RegionGrid(region_edges(self.v_roads, self.world_width, columns),
+                               region_edges(self.h_roads, self.world_height, rows))
+        self.city_cars = 0
+        self._gathered = None  # (тик, прямоугольник) последней сборки; None вместо прямоугольника - все машины
+
+        self.buffers = [RegionBuffer(REGION_CAPACITY) for _ in range(self.grid.count)]
+        layout = {'h_roads': self.h_roads, 'v_roads': self.v_roads, 'world_size': world_size,
+                  'start_time': start_time, 'time_speed': time_speed}
+        names = [buffer.name for buffer in self.buffers]
+        # spawn, а не fork: у окна свои потоки и pygame, копировать их в работников нельзя
+        context = mp.get_context("spawn")
+        self.conns = []
+        self.workers = []
+        for region in range(self.grid.count):
+            conn, child = context.Pipe()
+            worker = context.Process(target=region_worker, name=f"район {region}", daemon=True,
+                                     args=(child, region, self.grid, seed, layout, names, REGION_CAPACITY))
+            worker.start()
+            child.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def __len__(self):
+        return self.city_cars
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close',))
+        for worker in self.workers:
+            worker.join()
+        for buffer in self.buffers:
+            buffer.close(unlink=True)
+
+    def _call(self, messages):
+        # Команда всем районам сразу, ответы - по порядку районов
+        for conn, message in zip(self.conns, messages):
+            conn.send(message)
+        try:
+            return [conn.recv() for conn in self.conns]
+        except (EOFError, ConnectionResetError):
+            raise RuntimeError("процесс района завершился, его ошибка - в выводе выше")
+
+    def _take_new_cars(self):
+        # Машины, которые add_cars только что сложил в пустые массивы, по районам
+        rows = car_rows(self)
+        region = self.grid.region_of(rows['x'], rows['y'])
+        set_car_rows(self, rows[:0])
+        return [rows[region == r] for r in range(self.grid.count)]
+
+    def _exchange(self):
+        self.city_cars = sum(self._call(('exchange',) for _ in self.conns))
+        self._gathered = None
+
+    def populate(self, count):
+        set_car_rows(self, car_rows(self)[:0])
+        super().populate(count)
+        self._call(('add', rows) for rows in self._take_new_cars())
+        self._exchange()
+
+    def step(self):
+        timer = self.timer
+        timer.start()
+        self.current_time += timedelta(minutes=self.time_speed)
+        set_car_rows(self, car_rows(self)[:0])
+        self._spawn()
+        arrivals = self._take_new_cars()
+        timer.mark('spawn')
+
+        for light in self.intersections:
+            light.update()
+        horizontal_green = np.fromiter((inter.horizontal_green for inter in self.intersections),
+                                       dtype=bool, count=len(self.intersections))
+        timer.mark('lights')
+
+        # Районы шагают параллельно, каждый - с движением и столкновениями у себя;
+        # collisions здесь - обмен на границах: передача машин, призраки, аварии с ними
+        results = self._call(('advance', horizontal_green, rows) for rows in arrivals)
+        timer.mark('cars')
+        self._exchange()
+        timer.mark('collisions')
+
+        self.new_accidents = []
+        for accidents, throughput in results:
+            self.new_accidents.extend(accidents)
+            for road, count in throughput.items():
+                self.throughput[road] = self.throughput.get(road, 0) + count
+        for accident in self.new_accidents:
+            record_accident(self, accident)
+        self.accidents = [accident for accident in self.accidents + self.new_accidents if accident.update()]
+        timer.mark('accidents')
+
+        self.ticks += 1
+        if self.recorder or self.telemetry:
+            self._gather()
+        if self.recorder:
+            self.recorder.record(self)
+        if self.stats:
+            self.stats.update(self)
+        if self.telemetry:
+            self.telemetry.publish(self)
+
+    def _gather(self, rect=None):
+        # Машины из общей памяти районов: все или только в прямоугольнике rect
+        # (и выбранная, где бы она ни была), по возрастанию номеров
+        key = None if rect is None else (rect.left, rect.top, rect.right, rect.bottom)
+        if self._gathered in ((self.ticks, key), (self.ticks, None)):
+            return
+        if rect is None:
+            regions = range(self.grid.count)
+        else:
+            left, top = rect.left - VISIBLE_MARGIN, rect.top - VISIBLE_MARGIN
+            right, bottom = rect.right + VISIBLE_MARGIN, rect.bottom + VISIBLE_MARGIN
+            regions = self.grid.overlapping(left, top, right, bottom)
+        parts = []
+        for region, buffer in enumerate(self.buffers):
+            cars = buffer.cars()
+            if region in regions:
+                if rect is None:
+                    parts.append(cars)
+                    continue
+                x, y = cars['x'], cars['y']
+                wanted = (x >= left) & (x <= right) & (y >= top) & (y <= bottom)
+            elif self.selected_id is not None:
+                wanted = np.zeros(len(cars), dtype=bool)
+            else:
+                continue
+            if self.selected_id is not None:
+                wanted |= cars['car_id'] == self.selected_id
+            parts.append(row_bytes(cars)[wanted])
+        rows = join_rows(parts)
+        order = np.argsort(rows['car_id'], kind='stable')
+        set_car_rows(self, row_bytes(rows)[order].view(rows.dtype))
+        self._gathered = (self.ticks, key)
+
+    def has_car(self, view):
+        # После шага собранные массивы пусты, машина ищется по номеру прямо
+        # в общей памяти районов - без сборки всего города
+        return any((buffer.cars()['car_id'] == view.car_id).any() for buffer in self.buffers)
+
+    def visible_cars(self, rect):
+        self._gather(rect)
+        return super().visible_cars(rect)
+
+    def position_snapshot(self, rect):
+        self._gather(rect)
+        return super().position_snapshot(rect)
+
+    def traffic_sample(self):
+        self._gather()
+        return super().traffic_sample()
+
+    def save_state(self):
+        # Снимок - обычный снимок движка NumPy: загружается в один процесс
+        self._gather()
+        return super().save_state()
+
+# === Снимки ===
+# Полное состояние города в одном файле: сигнатура, затем pickle, где атрибуты
+# машин лежат столбцами (array или массивы NumPy) - это и компактно, и грузится
+# одним чтением без разбора по машине. Снимки - для отладки на своей машине:
+# pickle из чужих рук открывать нельзя.
+SNAPSHOT_MAGIC = b"DTPSNAP2"
+SNAPSHOT_FILE = "snapshot.dtp"
+SNAPSHOT_STATS = ('ticks', 'cars_spawned', 'accidents_by_reason', 'accident_factors', 'throughput')
+
+# Атрибуты Car и их типы в array; index_* и turning восстанавливаются сами
+CAR_SNAPSHOT_FIELDS = {
+    'car_id': 'q', 'x': 'd', 'y': 'd', 'direction': 'b', 'lane': 'b', 'base_road': 'q', 'speed': 'd',
+    'driver_age': 'h', 'driver_experience': 'h', 'driver_mood': 'b',
+    'driver_attention': 'd', 'driver_aggression': 'd',
+    'car_age': 'b', 'bad_tires': 'b', 'bad_brakes': 'b', 'engine_power': 'd',
+    'max_speed_multiplier': 'd', 'max_speed': 'd', 'accel': 'd', 'decel': 'd', 'reaction_time': 'd',
+    'turn_decision': 'b', 'passed_stop_line': 'b',
+    'changing_lane': 'b', 'lane_change_progress': 'd', 'target_lane_temp': 'b', 'lane_change_cooldown': 'h',
+    'accident_timer': 'h', 'in_accident': 'b', 'selected': 'b',
+}
+CAR_SNAPSHOT_FLAGS = {'bad_tires', 'bad_brakes', 'passed_stop_line', 'changing_lane', 'in_accident', 'selected'}
+
+def common_state(sim):
+    return {
+        'engine': 'numpy' if isinstance(sim, NumpySimulation) else 'objects',
+        'layout': {
+            'h_roads': sim.h_roads,
+            'v_roads': sim.v_roads,
+            'world_size': (sim.world_width, sim.world_height),
+            'start_time': sim.current_time,
+            'time_speed': sim.time_speed,
+        },
+        'lights': [(inter.timer, inter.horizontal_green) for inter in sim.intersections],
+        'stats': {name: getattr(sim, name) for name in SNAPSHOT_STATS},
+        'next_id': sim.next_id,
+        'random': sim.random.getstate(),
+    }
+
+def load_common_state(sim, state):
+    for inter, (timer, horizontal_green) in zip(sim.intersections, state['lights']):
+        inter.timer = timer
+        inter.horizontal_green = horizontal_green
+    for name, value in state['stats'].items():
+        setattr(sim, name, value)
+    sim.next_id = state['next_id']
+    # Последним: конструкторы выше тоже тянут случайные числа
+    sim.random.setstate(state['random'])
+
+def accident_state(accident, car1, car2):
+    return ((accident.x, accident.y, accident.reason, accident.driver, accident.timer, accident.severity), car1, car2)
+
+def load_accident(entry, car1, car2):
+    x, y, reason, driver, timer, severity = entry
+    accident = Accident(x, y, car1, car2, reason, driver, severity)
+    accident.timer = timer
+    return accident
+
+def save_snapshot(sim, path):
+    with open(path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        pickle.dump(sim.save_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_snapshot(path):
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path}: не снимок симуляции")
+        state = pickle.load(f)
+    if state['engine'] == 'numpy':
+        if np is None:
+            raise ValueError(f"{path}: для снимка движка numpy нужен пакет numpy")
+        sim = NumpySimulation(None, **state['layout'])
+    else:
+        sim = Simulation(None, **state['layout'])
+    with gc_paused():
+        sim.load_state(state)
+    return sim
+
+# === Запись траекторий ===
+# Каждый тик - строка на машину в столбцах-файлах, открытых как np.memmap.
+# Строки копятся в памяти и дописываются пачками по RECORD_BATCH_ROWS, файлы
+# растут удвоением, поэтому в тике нет ни одной операции с файлом на машину.
+# Аварии и повороты - отдельным журналом событий, описания машин - отдельной
+# таблицей. Прочитать запись без копирования: Recording(папка).
+RECORD_COLUMNS = {'car_id': 'i8', 'x': 'f4', 'y': 'f4', 'speed': 'f4', 'lane': 'i1', 'direction': 'i1', 'flags': 'u1'}
+TICK_COLUMNS = {'tick': 'i8', 'row': 'i8'}  # Номер тика и его первая строка в RECORD_COLUMNS
+IN_ACCIDENT_FLAG, CHANGING_LANE_FLAG = 1, 2
+RECORD_BATCH_ROWS = 1 << 16
+RECORD_CAPACITY = 1 << 20  # Строк в новом файле столбца, дальше - удвоение
+
+ACCIDENT_EVENT, TURN_EVENT = range(2)
+# Для аварии a, b - номера причины и тяжести в meta.json, для поворота - направления до и после
+EVENT_DTYPE = [('tick', 'i8'), ('kind', 'i1'), ('car_id', 'i8'), ('other_id', 'i8'),
+               ('x', 'f4'), ('y', 'f4'), ('a', 'i1'), ('b', 'i1')]
+CAR_DTYPE = [('car_id', 'i8'), ('color', 'u1', 3), ('driver_age', 'i2'), ('driver_experience', 'i2'),
+             ('driver_mood', 'i1'), ('car_age', 'i1'), ('bad_tires', '?'), ('bad_brakes', '?')]
+
+class RecordColumn:
+    # Столбец-файл, который растёт удвоением; лишний хвост отрезается при закрытии
+    def __init__(self, path, dtype, capacity=RECORD_CAPACITY):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.size = 0
+        self._open(capacity)
+
+    def _open(self, capacity):
+        with open(self.path, "r+b" if os.path.exists(self.path) else "w+b") as f:
+            f.truncate(capacity * self.dtype.itemsize)
+        self.data = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity,))
+
+    def append(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            capacity = max(end, 2 * len(self.data))
+            self.data.flush()
+            self.data = None
+            self._open(capacity)
+        self.data[self.size:end] = values
+        self.size = end
+
+    def close(self):
+        self.data.flush()
+        self.data = None
+        with open(self.path, "r+b") as f:
+            f.truncate(self.size * self.dtype.itemsize)
+
+def gather_car_columns(sim):
+    # Столбцы RECORD_COLUMNS текущего тика, по возрастанию номеров машин
+    if isinstance(sim, NumpySimulation):
+        # Копии: движок меняет свои массивы на месте
+        columns = {name: getattr(sim, name).astype(dtype) for name, dtype in RECORD_COLUMNS.items() if name != 'flags'}
+        columns['flags'] = (sim.in_accident * IN_ACCIDENT_FLAG | sim.changing_lane * CHANGING_LANE_FLAG).astype('u1')
+        return columns
+    cars = sim.cars
+    n = len(cars)
+    columns = {name: np.fromiter((getattr(car, name) for car in cars), dtype=RECORD_COLUMNS[name], count=n)
+               for name in ('car_id', 'x', 'y', 'speed', 'lane', 'direction')}
+    columns['flags'] = np.fromiter((car.in_accident * IN_ACCIDENT_FLAG | car.changing_lane * CHANGING_LANE_FLAG
+                                    for car in cars), dtype='u1', count=n)
+    return columns
+
+def event_car_id(car):
+    # В авариях движка объектов хранятся сами машины, у NumPy - их номера
+    if car is None or isinstance(car, int):
+        return -1 if car is None else car
+    return car.car_id
+
+class TrajectoryRecorder:
+    def __init__(self, path, sim):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.columns = {name: RecordColumn(os.path.join(path, f"{name}.bin"), dtype)
+                        for name, dtype in {**RECORD_COLUMNS, **TICK_COLUMNS}.items()}
+        # Светофоры - по биту на перекрёсток в каждом тике, в порядке sim.intersections
+        self.light_bytes = (len(sim.intersections) + 7) // 8
+        self.columns['lights'] = RecordColumn(os.path.join(path, "lights.bin"), ('u1', self.light_bytes))
+        self.events_file = open(os.path.join(path, "events.bin"), "wb")
+        self.cars_file = open(os.path.join(path, "cars.bin"), "wb")
+        self.layout = common_state(sim)['layout']
+        self.reasons = []
+        self.batch = []
+        self.batch_rows = 0
+        self.events = []
+        self.rows = 0
+        self.ticks = 0
+        self.max_id = -1
+        self.prev_ids = np.zeros(0, dtype='i8')
+        self.prev_direction = np.zeros(0, dtype='i1')
+
+    def record(self, sim):
+        columns = gather_car_columns(sim)
+        ids, direction = columns['car_id'], columns['direction']
+
+        # Поворот - машина сменила направление с прошлого тика; номера отсортированы
+        if len(self.prev_ids) and len(ids):
+            i = np.minimum(np.searchsorted(self.prev_ids, ids), len(self.prev_ids) - 1)
+            turned = np.flatnonzero((self.prev_ids[i] == ids) & (self.prev_direction[i] != direction))
+            for car in turned.tolist():
+                self.events.append((sim.ticks, TURN_EVENT, ids[car], -1, columns['x'][car], columns['y'][car],
+                                    self.prev_direction[i[car]], direction[car]))
+        self.prev_ids, self.prev_direction = ids, direction
+
+        for accident in sim.new_accidents:
+            if accident.reason not in self.reasons:
+                self.reasons.append(accident.reason)
+            self.events.append((sim.ticks, ACCIDENT_EVENT, event_car_id(accident.car1), event_car_id(accident.car2),
+                                accident.x, accident.y, self.reasons.index(accident.reason),
+                                SEVERITIES.index(accident.severity)))
+
+        first_new = int(np.searchsorted(ids, self.max_id, side='right'))
+        if first_new < len(ids):
+            self.cars_file.write(self._car_table(sim, first_new).tobytes())
+            self.max_id = int(ids[-1])
+
+        lights = np.packbits(np.fromiter((inter.horizontal_green for inter in sim.intersections),
+                                         dtype=bool, count=len(sim.intersections)))
+        self.batch.append((sim.ticks, columns, lights))
+        self.batch_rows += len(ids)
+        if self.batch_rows >= RECORD_BATCH_ROWS:
+            self.flush()
+
+    def _car_table(self, sim, first):
+        names = [name for name, *_ in CAR_DTYPE]
+        if isinstance(sim, NumpySimulation):
+            table = np.zeros(len(sim) - first, dtype=CAR_DTYPE)
+            for name in names:
+                table[name] = getattr(sim, name)[first:]
+            return table
+        cars = sim.cars[first:]
+        return np.array([tuple(getattr(car, name) for name in names) for car in cars], dtype=CAR_DTYPE)
+
+    def flush(self):
+        if self.batch:
+            ticks = np.array([tick for tick, _, _ in self.batch], dtype='i8')
+            sizes = np.array([len(columns['car_id']) for _, columns, _ in self.batch], dtype='i8')
+            self.columns['tick'].append(ticks)
+            self.columns['row'].append(self.rows + np.cumsum(sizes) - sizes)
+            self.columns['lights'].append(np.array([lights for _, _, lights in self.batch]))
+            for name in RECORD_COLUMNS:
+                self.columns[name].append(np.concatenate([columns[name] for _, columns, _ in self.batch]))
+            self.rows += int(sizes.sum())
+            self.ticks += len(self.batch)
+            self.batch = []
+            self.batch_rows = 0
+        if self.events:
+            self.events_file.write(np.array(self.events, dtype=EVENT_DTYPE).tobytes())
+            self.events = []
+        self.events_file.flush()
+        self.cars_file.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        # meta.json пишется при каждом сбросе: недописанную запись тоже можно открыть
+        layout = dict(self.layout, start_time=self.layout['start_time'].isoformat())
+        meta = {'rows': self.rows, 'ticks': self.ticks, 'layout': layout,
+                'reasons': self.reasons, 'severities': SEVERITIES,
+                'columns': RECORD_COLUMNS, 'tick_columns': TICK_COLUMNS, 'light_bytes': self.light_bytes}
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    def close(self):
+        self.flush()
+        for column in self.columns.values():
+            column.close()
+        self.events_file.close()
+        self.cars_file.close()
+
+class Recording:
+    # Запись только для чтения: столбцы - np.memmap, страницы подгружаются по мере обращения
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.layout = dict(self.meta['layout'], start_time=datetime.fromisoformat(self.meta['layout']['start_time']))
+        self.columns = {name: self._map(path, name, dtype, self.meta['rows'])
+                        for name, dtype in self.meta['columns'].items()}
+        self.tick = self._map(path, 'tick', 'i8', self.meta['ticks'])
+        self.row = self._map(path, 'row', 'i8', self.meta['ticks'])
+        self.lights = self._map(path, 'lights', ('u1', self.meta['light_bytes']), self.meta['ticks'])
+        self.events = self._map(path, 'events', EVENT_DTYPE)
+        self.cars = self._map(path, 'cars', CAR_DTYPE)
+
+    @staticmethod
+    def _map(path, name, dtype, count=None):
+        filename = os.path.join(path, f"{name}.bin")
+        dtype = np.dtype(dtype)
+        if count is None:
+            count = os.path.getsize(filename) // dtype.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode="r", shape=(count,))
+
+    def __len__(self):
+        return len(self.tick)
+
+    def frame(self, i):
+        # Строки i-го записанного тика: срезы memmap, без копирования
+        start = self.row[i]
+        end = self.row[i + 1] if i + 1 < len(self.row) else self.meta['rows']
+        return {name: column[start:end] for name, column in self.columns.items()}
+
+# === Потоковая статистика ===
+# Сводка по окнам игрового времени (по умолчанию - час): аварии по часу, причине,
+# тяжести и профилю водителя, средняя скорость по дорогам, очереди у перекрёстков,
+# сколько машин въехало и уехало. События учитываются счётчиками за O(1), скорости
+# и очереди снимаются раз в STATS_SAMPLE_TICKS тиков. Закрытое окно уходит в очередь
+# фонового потока, который дописывает его в stats.csv и stats.jsonl, - запись на
+# диск не задерживает тик. В памяти только текущее окно и последние STATS_HISTORY,
+# так что память не растёт, сколько бы город ни работал.
+STATS_WINDOW_MINUTES = 60
+STATS_SAMPLE_TICKS = 3
+STATS_HISTORY = 48
+STATS_QUEUE_SIZE = 256  # Окон в очереди на запись; если диск не успевает, лишние отбрасываются
+QUEUE_SPEED = MAX_SPEED * 0.1  # Медленнее - машина стоит
+QUEUE_DISTANCE = CAR_SIZE * 15  # Дальше от стоп-линии - уже не очередь к перекрёстку
+STATS_CSV_HEADER = ("start", "metric", "key", "value")
+CAR_SPEED = attrgetter('speed')
+
+def stats_rows(summary):
+    # Окно сводки в строки CSV: начало окна, показатель, ключ, значение
+    start = summary['start']
+    rows = [(start, name, "", summary[name]) for name in ('ticks', 'spawned', 'exited', 'accidents')]
+    rows += [(start, f"accidents:{entry['factor']}", entry['value'], entry['count']) for entry in summary['by_factor']]
+    rows += [(start, "speed_kmh", road, speed) for road, speed in summary['speed_kmh'].items()]
+    for inter, queue_length in summary['queues'].items():
+        rows.append((start, "queue_mean", inter, queue_length['mean']))
+        rows.append((start, "queue_max", inter, queue_length['max']))
+    return rows
+
+class StatsAggregator:
+    def __init__(self, path, sim, window_minutes=STATS_WINDOW_MINUTES):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.window_minutes = window_minutes
+        self.history = deque(maxlen=STATS_HISTORY)
+        self.dropped = 0
+        self.window = None
+        self.sim = sim
+        self.spawned = sim.cars_spawned
+        self.cars = len(sim)
+        # Файлы открываются здесь, чтобы ошибка была видна сразу, а не в потоке
+        self.csv_file = open(os.path.join(path, "stats.csv"), "w", newline="", encoding="utf-8")
+        self.json_file = open(os.path.join(path, "stats.jsonl"), "w", encoding="utf-8")
+        self.queue = queue.Queue(maxsize=STATS_QUEUE_SIZE)
+        self.writer = threading.Thread(target=self._write, name="stats-writer", daemon=True)
+        self.writer.start()
+
+    def window_start(self, moment):
+        minutes = (moment.hour * 60 + moment.minute) // self.window_minutes * self.window_minutes
+        return moment.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+
+    def update(self, sim):
+        # Раз в тик, в конце sim.step
+        start = self.window_start(sim.current_time)
+        if self.window is None or start != self.window['start']:
+            self.close_window()
+            self.window = {'start': start, 'ticks': 0, 'samples': 0, 'spawned': 0, 'exited': 0,
+                           'factors': {}, 'speed': {}, 'queues': {}}
+        if sim is not self.sim:
+            # Новый город (загружен снимок по F8): счётчики считаются от него
+            self.sim = sim
+            self.spawned = sim.cars_spawned
+            self.cars = len(sim)
+
+        window = self.window
+        window['ticks'] += 1
+        spawned = sim.cars_spawned - self.spawned
+        cars = len(sim)
+        window['spawned'] += spawned
+        window['exited'] += spawned - (cars - self.cars)
+        self.spawned = sim.cars_spawned
+        self.cars = cars
+
+        factors = window['factors']
+        for accident in sim.new_accidents:
+            for key in accident_factor_keys(accident, sim.current_time.hour):
+                factors[key] = factors.get(key, 0) + 1
+
+        if sim.ticks % STATS_SAMPLE_TICKS == 0:
+            window['samples'] += 1
+            speeds, queues = sim.traffic_sample()
+            speed = window['speed']
+            for road, (total, count) in speeds.items():
+                old_total, old_count = speed.get(road, (0.0, 0))
+                speed[road] = (old_total + total, old_count + count)
+            window_queues = window['queues']
+            for inter, count in queues.items():
+                total, longest = window_queues.get(inter, (0, 0))
+                window_queues[inter] = (total + count, max(longest, count))
+
+    def close_window(self):
+        window = self.window
+        if window is None or not window['ticks']:
+            return
+        samples = max(1, window['samples'])
+        factors = sorted(window['factors'].items(), key=lambda item: (FACTOR_NAMES.index(item[0][0]), str(item[0][1])))
+        summary = {
+            'start': window['start'].isoformat(),
+            'ticks': window['ticks'],
+            'spawned': window['spawned'],
+            'exited': window['exited'],
+            'accidents': sum(count for (factor, _), count in factors if factor == "причина"),
+            'by_factor': [{'factor': factor, 'value': value, 'count': count} for (factor, value), count in factors],
+            'speed_kmh': {road_name(road): round(total / count / MAX_SPEED * MAX_SPEED_KMH, 2)
+                          for road, (total, count) in sorted(window['speed'].items())},
+            'queues': {f"{x},{y}": {'mean': round(total / samples, 2), 'max': longest}
+                       for (x, y), (total, longest) in sorted(window['queues'].items())},
+        }
+        self.history.append(summary)
+        self.window = None
+        try:
+            self.queue.put_nowait(summary)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        writer = csv.writer(self.csv_file)
+        writer.writerow(STATS_CSV_HEADER)
+        while True:
+            summary = self.queue.get()
+            if summary is None:
+                break
+            self.json_file.write(json.dumps(summary, ensure_ascii=False) + "\n")
+            writer.writerows(stats_rows(summary))
+            self.json_file.flush()
+            self.csv_file.flush()
+
+    def close(self):
+        # Недописанное окно тоже сохраняется
+        self.close_window()
+        self.queue.put(None)
+        self.writer.join()
+        self.csv_file.close()
+        self.json_file.close()
+
+# === Режим без окна ===
+def run_headless(sim, ticks):
+    telemetry = sim.telemetry
+    paused = False
+    start = time.perf_counter()
+    for _ in range(ticks):
+        if telemetry:
+            # Пауза от клиента телеметрии держит тики, пока не придёт resume
+            paused = telemetry.apply_controls(sim, paused)
+            while paused:
+                time.sleep(1 / TICK_RATE)
+                paused = telemetry.apply_controls(sim, paused)
+        sim.step()
+    elapsed = time.perf_counter() - start
+
+    print(f"Тиков: {sim.ticks}, время симуляции: {sim.current_time.strftime('%d.%m %H:%M')}")
+    print(f"Создано машин: {sim.cars_spawned}, в городе: {len(sim)}")
+    print(f"Аварий: {sum(sim.accidents_by_reason.values())}")
+    for reason, count in sorted(sim.accidents_by_reason.items()):
+        print(f"  {reason}: {count}")
+    print("Проехало по дорогам:")
+    for road, count in sorted(sim.throughput.items()):
+        print(f"  {road_name(road)}: {count}")
+    print(f"Скорость: {sim.ticks / elapsed:.1f} тиков/с")
+    print(f"Фазы тика, мс (среднее / p95 за последние {sim.timer.window} тиков):")
+    for phase in STEP_PHASES:
+        print(f"  {phase}: {sim.timer.average(phase) * 1000:.3f} / {sim.timer.percentile(phase, 95) * 1000:.3f}")
+
+# === Монте-Карло ===
+# Авария - редкое событие, поэтому статистика копится по тысячам независимых
+# прогонов. У каждого свой город и своё зерно, процессы ничего не делят между
+# собой, и время растёт линейно с числом ядер.
+CONFIDENCE_Z = 1.96  # 95% доверительный интервал
+FACTOR_NAMES = ["причина", "тяжесть", "час", "возраст", "настроение", "тормоза", "шины"]
+
+def ticks_per_day(time_speed):
+    # Скорость времени у города своя (time_speed в планировке), сутки - по ней
+    if time_speed <= 0:
+        raise ValueError("при time_speed <= 0 игровые сутки не наступят")
+    return max(1, round(24 * 60 / time_speed))
+
+def monte_carlo_run(task):
+    seed, engine, ticks, layout = task
+    sim = NumpySimulation(seed, **layout) if engine == "numpy" else Simulation(seed, **layout)
+    for _ in range(ticks):
+        sim.step()
+    return sim.accident_factors, sim.cars_spawned
+
+def mean_interval(values):
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, 0.0
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    return mean, CONFIDENCE_Z * math.sqrt(variance / n)
+
+def run_monte_carlo(runs, days, seed, engine, workers, output=None, layout=None):
+    workers = workers or os.cpu_count()
+    layout = layout or {}
+    ticks = days * ticks_per_day(layout.get('time_speed', TIME_SPEED))
+    tasks = [(seed + i, engine, ticks, layout) for i in range(runs)]
+    start = time.perf_counter()
+    with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        # Прогоны раздаются пачками, чтобы процессы не простаивали на пересылке задач
+        results = list(pool.map(monte_carlo_run, tasks, chunksize=max(1, runs // (workers * 4))))
+    elapsed = time.perf_counter() - start
+
+    # Аварии в день по каждому прогону; прогон без аварий такого вида даёт ноль
+    total_mean, total_ci = mean_interval([sum(count for key, count in factors.items() if key[0] == "причина") / days
+                                          for factors, _ in results])
+    keys = sorted({key for factors, _ in results for key in factors},
+                  key=lambda key: (FACTOR_NAMES.index(key[0]), key[1]))
+    rows = []
+    for key in keys:
+        counts = [factors.get(key, 0) for factors, _ in results]
+        mean, ci = mean_interval([count / days for count in counts])
+        rows.append({"factor": key[0], "value": key[1], "per_day": mean, "ci95": ci, "total": sum(counts)})
+
+    print(f"Прогонов: {runs} по {days} дн., процессов: {workers}, за {elapsed:.1f} с")
+    print(f"Создано машин: {sum(spawned for _, spawned in results)}")
+    print(f"Аварий в день: {total_mean:.4f} ± {total_ci:.4f}")
+    factor = None
+    for row in rows:
+        if row["factor"] != factor:
+            factor = row["factor"]
+            print(f"{factor}:")
+        print(f"  {row['value']}: {row['per_day']:.4f} ± {row['ci95']:.4f} в день (всего {row['total']})")
+
+    if output:
+        report = {"runs": runs, "days": days, "seed": seed, "engine": engine,
+                  "per_day": total_mean, "ci95": total_ci, "factors": rows}
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {output}")